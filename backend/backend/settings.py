@@ -96,6 +96,31 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# The cache must be shared by every process (web workers and run_plan_worker):
+# it holds the version stamps that invalidate in-process constraint data.
+# Use Redis if REDIS_URL is set (requires the redis package), otherwise a table
+# in the main database (created by the nutrition migrations).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'nutrition_cache',
+            # Culling drops random entries, stamps included; keep it for real overflow
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -136,3 +161,26 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Nutrition app
+# Resolve allowed foods through the in-process bitset index instead of chained ORM excludes
+NUTRITION_USE_CONSTRAINT_INDEX = os.environ.get('NUTRITION_USE_CONSTRAINT_INDEX', 'False') == 'True'
+
+# Cache alias holding version stamps and per-user allowed-food sets
+NUTRITION_CACHE_ALIAS = 'default'
+NUTRITION_ALLOWED_FOODS_CACHE_TIMEOUT = 3600
+
+# Per-slot time budget of the 'optimized' meal plan algorithm
+NUTRITION_OPTIMIZER_TIME_BUDGET_MS = 50
+
+# Generated compositions memoized per process (0 disables), and the rounding
+# of daily targets (kcal, grams) that decides which users share an entry
+NUTRITION_GENERATION_CACHE_SIZE = 1024
+NUTRITION_GENERATION_CALORIE_ROUNDING = 10
+NUTRITION_GENERATION_MACRO_ROUNDING = 1
+
+# Days a food counts as recently used by a meal type, and the score penalty per
+# recent use, when composing multi-day plans (a window of 0 disables variety)
+NUTRITION_VARIETY_WINDOW_DAYS = 3
+NUTRITION_VARIETY_PENALTY = 0.5
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .models import (
-    UserProfile, Food, Meal, MealFood, MealPlan,
+    UserProfile, Food, Meal, MealFood, MealPlan, MealPlanMeal, MealPlanDayTotals, PlanGenerationJob,
     FoodCategory, DietaryPattern, UserDietaryPreference, UserAllergy, UserFoodDislike
 )
 
@@ -24,7 +24,7 @@ class FoodCategoryAdmin(admin.ModelAdmin):
 @admin.register(Food)
 class FoodAdmin(admin.ModelAdmin):
     list_display = ['name', 'calories_per_100g', 'protein_per_100g', 'carbs_per_100g', 'fat_per_100g', 'created_at']
-    list_filter = ['created_at', 'categories']
+    list_filter = ['created_at', 'categories', 'is_protein_source', 'is_carb_source', 'is_vegetable', 'is_fat_source']
     search_fields = ['name']
     readonly_fields = ['created_at', 'updated_at']
     filter_horizontal = ['categories']
@@ -78,16 +78,57 @@ class MealAdmin(admin.ModelAdmin):
     list_display = ['name', 'meal_type', 'created_at']
     list_filter = ['meal_type', 'created_at']
     search_fields = ['name']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['content_hash', *Meal.TOTAL_FIELDS, 'created_at', 'updated_at']
     inlines = [MealFoodInline]
     ordering = ['-created_at']
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Meal.refresh_totals([form.instance.pk])
+        # An edited meal no longer matches its interned composition
+        if change and form.instance.content_hash:
+            Meal.objects.filter(pk=form.instance.pk).update(content_hash=None)
+
+
+class MealPlanMealInline(admin.TabularInline):
+    """Inline admin placing meals on days of a MealPlan."""
+    model = MealPlanMeal
+    extra = 1
+    fields = ['meal', 'day']
+    raw_id_fields = ['meal']
+
+
+class MealPlanDayTotalsInline(admin.TabularInline):
+    """Read-only inline of the stored per-day totals of a MealPlan."""
+    model = MealPlanDayTotals
+    fields = ['day', 'meal_count', *MealPlanDayTotals.TOTAL_FIELDS]
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(MealPlan)
 class MealPlanAdmin(admin.ModelAdmin):
-    list_display = ['user', 'start_date', 'end_date', 'created_at']
+    list_display = ['user', 'start_date', 'end_date', 'total_calories', 'created_at']
     list_filter = ['created_at', 'start_date', 'end_date']
     search_fields = ['user__username', 'user__email']
-    readonly_fields = ['created_at', 'updated_at']
-    filter_horizontal = ['meals']
+    readonly_fields = [*MealPlan.TOTAL_FIELDS, 'created_at', 'updated_at']
+    inlines = [MealPlanMealInline, MealPlanDayTotalsInline]
+    ordering = ['-created_at']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Inline link edits bypass the m2m signals that keep the totals
+        MealPlanDayTotals.rebuild([form.instance.pk])
+
+
+@admin.register(PlanGenerationJob)
+class PlanGenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'num_days', 'algorithm', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'algorithm', 'created_at']
+    search_fields = ['user__username']
+    readonly_fields = ['meal_plan', 'worker', 'attempts', 'created_at', 'started_at', 'finished_at']
     ordering = ['-created_at']
@@ -0,0 +1,135 @@
+"""
+Multi-pattern substring matcher for free-text allergen names.
+
+Builds an Aho-Corasick automaton over a set of allergen strings so every
+allergen can be matched against a food name in a single pass over the name,
+instead of one substring test (or one SQL LIKE predicate) per allergen.
+"""
+
+import re
+from collections import deque
+from functools import lru_cache
+
+
+def normalize(text):
+    """Normalize allergen and food names for case-insensitive matching."""
+    return text.lower()
+
+
+class AllergenMatcher:
+    """
+    Aho-Corasick automaton over normalized allergen strings.
+
+    Usage:
+        matcher = AllergenMatcher(['peanut', 'milk'])
+        matcher.find('Peanut Butter')  # {'peanut'}
+    """
+
+    def __init__(self, allergens):
+        self.allergens = sorted({normalize(allergen) for allergen in allergens})
+        # An empty allergen is a substring of every name
+        self.matches_everything = '' in self.allergens
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [frozenset()]
+        for allergen in self.allergens:
+            if allergen:
+                self._insert(allergen)
+        self._link()
+
+        # Boolean checks only need to know whether any allergen occurs, which a
+        # compiled alternation answers in one pass without leaving C code
+        self._any = re.compile('|'.join(re.escape(allergen) for allergen in self.allergens if allergen))
+
+    def _insert(self, allergen):
+        state = 0
+        for char in allergen:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(frozenset())
+            state = next_state
+        self._output[state] = self._output[state] | {allergen}
+
+    def _link(self):
+        """Compute failure links breadth-first and merge outputs along them."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = link if link != next_state else 0
+                self._output[next_state] = self._output[next_state] | self._output[self._fail[next_state]]
+
+    def __bool__(self):
+        return bool(self.allergens)
+
+    def find(self, name):
+        """
+        Return the set of allergens contained in `name`.
+
+        Args:
+            name: Food name (normalized internally)
+
+        Returns:
+            Set of normalized allergen strings found in the name
+        """
+        found = {''} if self.matches_everything else set()
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for char in normalize(name):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def matches(self, name):
+        """Return True if any allergen is contained in `name`."""
+        if self.matches_everything:
+            return True
+        return bool(self.allergens) and self._any.search(normalize(name)) is not None
+
+    def match_catalog(self, foods):
+        """
+        Match every allergen against many foods in one linear pass.
+
+        Args:
+            foods: Iterable of (food_id, name) pairs
+
+        Returns:
+            Dictionary mapping food id to the set of allergens found in its name;
+            foods without matches are omitted
+        """
+        matched = {}
+        if not self:
+            return matched
+        for food_id, name in foods:
+            found = self.find(name)
+            if found:
+                matched[food_id] = found
+        return matched
+
+
+@lru_cache(maxsize=1024)
+def _compile(allergens):
+    return AllergenMatcher(allergens)
+
+
+def get_matcher(allergens):
+    """
+    Return a compiled matcher for a collection of allergens.
+    Compiled automatons are memoized, so users sharing the same allergens share one.
+    """
+    return _compile(frozenset(normalize(allergen) for allergen in allergens))
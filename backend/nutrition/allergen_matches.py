@@ -0,0 +1,130 @@
+"""
+Maintenance of the materialized allergen-to-food match table.
+
+Each distinct free-text allergen is matched against the catalog once, when it
+is first needed, and the matches are stored in AllergenMatch. Food writes then
+update only the rows of the food that changed.
+
+Only Food.save() keeps the table in sync. Bulk writes (bulk_create,
+QuerySet.update(name=...), raw SQL imports) bypass the signals, so callers must
+follow them with refresh_foods() for the touched foods, or run the
+rebuild_allergen_matches command after a catalog import. Both also bump the
+catalog version, which those writes skipped as well.
+"""
+
+from django.db import transaction
+from . import versions
+from .allergen_matcher import AllergenMatcher, normalize
+from .models import Food, AllergenTerm, AllergenMatch
+
+
+BATCH_SIZE = 1000
+
+
+def ensure_terms(allergen_names):
+    """
+    Make sure matches exist for every allergen, computing missing ones.
+
+    Args:
+        allergen_names: Iterable of free-text allergen names
+
+    Returns:
+        List of normalized allergen names
+    """
+    terms = sorted({normalize(name) for name in allergen_names})
+    if not terms:
+        return terms
+
+    known = set(AllergenTerm.objects.filter(name__in=terms).values_list('name', flat=True))
+    missing = [term for term in terms if term not in known]
+    if missing:
+        matcher = AllergenMatcher(missing)
+        matched = matcher.match_catalog(Food.objects.values_list('id', 'name'))
+        with transaction.atomic():
+            AllergenMatch.objects.bulk_create(
+                [
+                    AllergenMatch(allergen_normalized=term, food_id=food_id)
+                    for food_id, found in matched.items()
+                    for term in found
+                ],
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            AllergenTerm.objects.bulk_create(
+                [AllergenTerm(name=term) for term in missing],
+                ignore_conflicts=True,
+            )
+    return terms
+
+
+def refresh_food(food):
+    """
+    Recompute the stored matches of a single food, e.g. after it was created or renamed.
+
+    Args:
+        food: Food instance
+    """
+    _store_matches([food])
+
+
+def refresh_foods(foods):
+    """
+    Recompute the stored matches of several foods after a bulk write, and invalidate
+    the catalog-derived caches the write did not reach.
+
+    Args:
+        foods: Iterable of saved Food instances
+    """
+    _store_matches(list(foods))
+    versions.bump_version_on_commit(versions.CATALOG)
+
+
+def _store_matches(foods):
+    terms = list(AllergenTerm.objects.values_list('name', flat=True))
+    matcher = AllergenMatcher(terms) if terms else None
+    with transaction.atomic():
+        AllergenMatch.objects.filter(food__in=foods).delete()
+        if matcher is None:
+            return
+        AllergenMatch.objects.bulk_create(
+            [
+                AllergenMatch(allergen_normalized=term, food=food)
+                for food in foods
+                for term in matcher.find(food.name)
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+
+def rebuild(allergen_names=()):
+    """
+    Rebuild the whole match table in bulk.
+
+    Args:
+        allergen_names: Extra allergen names to register besides the existing terms
+
+    Returns:
+        Tuple of (number of terms, number of matches)
+    """
+    terms = set(AllergenTerm.objects.values_list('name', flat=True))
+    terms.update(normalize(name) for name in allergen_names)
+    matcher = AllergenMatcher(terms)
+    matched = matcher.match_catalog(Food.objects.values_list('id', 'name'))
+
+    with transaction.atomic():
+        AllergenMatch.objects.all().delete()
+        matches = AllergenMatch.objects.bulk_create(
+            [
+                AllergenMatch(allergen_normalized=term, food_id=food_id)
+                for food_id, found in matched.items()
+                for term in found
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        AllergenTerm.objects.bulk_create(
+            [AllergenTerm(name=term) for term in terms],
+            ignore_conflicts=True,
+        )
+        versions.bump_version_on_commit(versions.CATALOG)
+    return len(terms), len(matches)
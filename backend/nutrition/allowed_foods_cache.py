@@ -0,0 +1,88 @@
+"""
+Per-user cache of resolved allowed-food id sets.
+
+Entries are keyed by the user's constraint version and the catalog version, so
+a bump of either stamp (see signals.py) makes stale entries unreachable. The
+backend is whichever Django cache NUTRITION_CACHE_ALIAS points at: the
+database cache by default, or Redis when configured in settings.
+"""
+
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from . import versions
+
+
+class AllowedFoodCache:
+    """
+    Cache of allowed-food id sets with process-local hit/miss counters.
+    """
+
+    KEY_PREFIX = 'nutrition:allowed'
+
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def _cache():
+        return caches[getattr(settings, 'NUTRITION_CACHE_ALIAS', 'default')]
+
+    @staticmethod
+    def make_key(user_id):
+        """
+        Build the cache key for a user from the current version stamps.
+        """
+        user_version = versions.get_version(versions.user_constraints(user_id))
+        catalog_version = versions.get_version(versions.CATALOG)
+        return f"{AllowedFoodCache.KEY_PREFIX}:{user_id}:{user_version}:{catalog_version}"
+
+    @classmethod
+    def get_or_compute(cls, user_id, compute):
+        """
+        Return the cached allowed-food id set for a user, computing it on a miss.
+
+        Args:
+            user_id: Id of the user
+            compute: Callable returning an iterable of allowed food ids
+
+        Returns:
+            frozenset of allowed Food ids
+        """
+        cache = cls._cache()
+        key = cls.make_key(user_id)
+        food_ids = cache.get(key)
+        if food_ids is not None:
+            cls._record(hit=True)
+            return food_ids
+
+        cls._record(hit=False)
+        food_ids = frozenset(compute())
+        cache.set(key, food_ids, getattr(settings, 'NUTRITION_ALLOWED_FOODS_CACHE_TIMEOUT', 3600))
+        return food_ids
+
+    @classmethod
+    def _record(cls, hit):
+        with cls._lock:
+            if hit:
+                cls.hits += 1
+            else:
+                cls.misses += 1
+
+    @classmethod
+    def stats(cls):
+        """
+        Return hit/miss counters for this process.
+        """
+        total = cls.hits + cls.misses
+        return {
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_rate': round(cls.hits / total, 4) if total else None,
+        }
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._lock:
+            cls.hits = 0
+            cls.misses = 0
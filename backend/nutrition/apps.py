@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class NutritionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'nutrition'
+
+    def ready(self):
+        # Register signal receivers that invalidate cached constraint data
+        from . import signals  # noqa: F401
+
+        # The pattern registry (and FoodConstraintIndex) are deliberately not
+        # loaded here: ready() also runs for migrate, before their tables may
+        # exist, and for the test runner, before the test database is set up,
+        # and Django warns about queries during app initialization. They load
+        # on first use instead, and reload whenever their version stamp moves.
@@ -0,0 +1,145 @@
+"""
+In-process bitset index over the food catalog for resolving allowed foods.
+
+The index keeps one row of category bits per food plus the excluded-category
+bits of every dietary pattern, so dietary pattern filtering becomes a few
+vectorized bitwise operations instead of a chain of M2M excludes.
+"""
+
+import threading
+import numpy as np
+from .allergen_matcher import get_matcher, normalize
+from .models import Food, FoodCategory
+from .pattern_registry import get_registry
+from . import versions
+
+
+class FoodConstraintIndex:
+    """
+    Immutable snapshot of food ids, names and category bitmasks.
+
+    Category membership is stored as an (n_foods, n_words) uint64 array where
+    bit i of the row is set when the food belongs to the i-th category.
+    """
+
+    WORD_BITS = 64
+
+    def __init__(self, food_ids, food_names, category_bits, food_masks, pattern_masks, version=None):
+        self.food_ids = food_ids
+        self.food_names = food_names
+        self.category_bits = category_bits
+        self.food_masks = food_masks
+        self.pattern_masks = pattern_masks
+        self.version = version
+        self._positions = {food_id: row for row, food_id in enumerate(food_ids.tolist())}
+
+    @classmethod
+    def build(cls, version=None, pattern_ids=()):
+        """
+        Build an index from the database and the compiled pattern registry.
+
+        Args:
+            version: Catalog version stamp the snapshot corresponds to
+            pattern_ids: Ids of patterns the registry must contain (see get_registry)
+
+        Returns:
+            FoodConstraintIndex instance
+        """
+        foods = list(Food.objects.order_by('id').values_list('id', 'name'))
+        category_ids = list(FoodCategory.objects.order_by('id').values_list('id', flat=True))
+        category_bits = {category_id: bit for bit, category_id in enumerate(category_ids)}
+        n_words = max(1, -(-len(category_ids) // cls.WORD_BITS))
+
+        food_ids = np.array([food_id for food_id, _ in foods], dtype=np.int64)
+        food_names = [normalize(name) for _, name in foods]
+        positions = {food_id: row for row, (food_id, _) in enumerate(foods)}
+
+        food_masks = np.zeros((len(foods), n_words), dtype=np.uint64)
+        memberships = Food.categories.through.objects.values_list('food_id', 'foodcategory_id')
+        for food_id, category_id in memberships:
+            row = positions.get(food_id)
+            bit = category_bits.get(category_id)
+            if row is not None and bit is not None:
+                food_masks[row, bit // cls.WORD_BITS] |= np.uint64(1 << (bit % cls.WORD_BITS))
+
+        pattern_masks = {}
+        for pattern in get_registry(pattern_ids).all():
+            mask = pattern_masks.setdefault(pattern.id, np.zeros(n_words, dtype=np.uint64))
+            for category_id in pattern.excluded_category_ids:
+                bit = category_bits.get(category_id)
+                if bit is not None:
+                    mask[bit // cls.WORD_BITS] |= np.uint64(1 << (bit % cls.WORD_BITS))
+
+        return cls(food_ids, food_names, category_bits, food_masks, pattern_masks, version)
+
+    def __len__(self):
+        return len(self.food_ids)
+
+    def has_patterns(self, pattern_ids):
+        """Whether every id of pattern_ids has a mask."""
+        return all(pattern_id in self.pattern_masks for pattern_id in pattern_ids)
+
+    def allowed_mask(self, pattern_ids=(), allergen_names=(), excluded_food_ids=()):
+        """
+        Compute a boolean mask over the catalog of foods that pass every constraint.
+
+        Args:
+            pattern_ids: Ids of the user's dietary patterns
+            allergen_names: Allergen strings matched case-insensitively against food names
+            excluded_food_ids: Ids of foods excluded outright (allergies and dislikes)
+
+        Returns:
+            numpy boolean array aligned with food_ids
+        """
+        keep = np.ones(len(self.food_ids), dtype=bool)
+
+        combined = np.zeros(self.food_masks.shape[1], dtype=np.uint64)
+        for pattern_id in pattern_ids:
+            mask = self.pattern_masks.get(pattern_id)
+            if mask is not None:
+                combined |= mask
+        if combined.any():
+            keep &= ~(self.food_masks & combined).any(axis=1)
+
+        rows = [self._positions[food_id] for food_id in excluded_food_ids if food_id in self._positions]
+        if rows:
+            keep[rows] = False
+
+        matcher = get_matcher(allergen_names)
+        if matcher:
+            for row in np.flatnonzero(keep).tolist():
+                if matcher.matches(self.food_names[row]):
+                    keep[row] = False
+
+        return keep
+
+    def allowed_ids(self, pattern_ids=(), allergen_names=(), excluded_food_ids=()):
+        """
+        Return the ids of foods that pass every constraint, in ascending order.
+        """
+        keep = self.allowed_mask(pattern_ids, allergen_names, excluded_food_ids)
+        return self.food_ids[keep].tolist()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(pattern_ids=()):
+    """
+    Return the process-wide index, rebuilding it when the catalog version
+    changed or when it lacks one of pattern_ids (see get_registry).
+
+    Args:
+        pattern_ids: Ids of patterns that must be present
+    """
+    global _index
+    pattern_ids = list(pattern_ids)
+    version = versions.get_version(versions.CATALOG)
+    index = _index
+    if index is not None and index.version == version and index.has_patterns(pattern_ids):
+        return index
+    with _index_lock:
+        if _index is None or _index.version != version or not _index.has_patterns(pattern_ids):
+            _index = FoodConstraintIndex.build(version=version, pattern_ids=pattern_ids)
+        return _index
@@ -1,6 +1,131 @@
-from django.contrib.auth.models import User
-from django.db.models import Q
-from .models import Food, UserDietaryPreference, UserAllergy, UserFoodDislike, FoodCategory, DietaryPattern
+from django.conf import settings
+from django.db.models import Count, Q
+from . import allergen_matches
+from .allergen_matcher import get_matcher, normalize
+from .allowed_foods_cache import AllowedFoodCache
+from .constraint_index import get_index
+from .pattern_registry import get_registry
+from .models import (
+    Food, UserDietaryPreference, UserAllergy, UserFoodDislike, AllergenMatch
+)
+
+
+class UserConstraints:
+    """
+    A user's dietary preferences, allergies and dislikes loaded into memory.
+    Lets many foods be checked and explained without further queries.
+    """
+    
+    def __init__(self, user_id, preferences=(), allergies=(), dislikes=(), registry=None):
+        self.user_id = user_id
+        self.preferences = list(preferences)
+        self.allergies = list(allergies)
+        self.dislikes = list(dislikes)
+        
+        if registry is None or not registry.has_all(preference.pattern_id for preference in self.preferences):
+            registry = get_registry(preference.pattern_id for preference in self.preferences)
+        self.patterns = [
+            pattern for pattern in (registry.get(preference.pattern_id) for preference in self.preferences)
+            if pattern is not None
+        ]
+        self.excluded_category_ids = registry.excluded_category_ids(
+            preference.pattern_id for preference in self.preferences
+        )
+        self.allergic_food_ids = {allergy.food_id for allergy in self.allergies if allergy.food_id}
+        self.allergen_names = [normalize(allergy.allergen_name) for allergy in self.allergies]
+        self.allergen_matcher = get_matcher(self.allergen_names)
+        self.disliked_food_ids = {dislike.food_id for dislike in self.dislikes}
+    
+    @classmethod
+    def load(cls, user_ids):
+        """
+        Load constraints for many users with a fixed number of queries.
+        
+        Args:
+            user_ids: Iterable of User ids
+            
+        Returns:
+            Dictionary mapping user id to UserConstraints
+        """
+        user_ids = list(user_ids)
+        preferences = {user_id: [] for user_id in user_ids}
+        allergies = {user_id: [] for user_id in user_ids}
+        dislikes = {user_id: [] for user_id in user_ids}
+        
+        for preference in UserDietaryPreference.objects.filter(user_id__in=user_ids):
+            preferences[preference.user_id].append(preference)
+        for allergy in UserAllergy.objects.filter(user_id__in=user_ids).select_related('food'):
+            allergies[allergy.user_id].append(allergy)
+        for dislike in UserFoodDislike.objects.filter(user_id__in=user_ids):
+            dislikes[dislike.user_id].append(dislike)
+        
+        # One registry (and one version check) for every user
+        registry = get_registry(
+            preference.pattern_id for user_preferences in preferences.values() for preference in user_preferences
+        )
+        return {
+            user_id: cls(user_id, preferences[user_id], allergies[user_id], dislikes[user_id], registry)
+            for user_id in user_ids
+        }
+    
+    def is_allowed(self, food, category_ids):
+        """
+        Check a food against the constraints, matching ConstraintService.get_allowed_foods.
+        
+        Args:
+            food: Food instance to check
+            category_ids: Set of the food's FoodCategory ids
+            
+        Returns:
+            Boolean: True if food is allowed, False otherwise
+        """
+        if self.excluded_category_ids & category_ids:
+            return False
+        if food.id in self.allergic_food_ids or food.id in self.disliked_food_ids:
+            return False
+        return not self.allergen_matcher.matches(food.name)
+    
+    def exclusion_reasons(self, food, category_ids):
+        """
+        Explain why a food is excluded, matching ConstraintService.get_exclusion_reasons.
+        
+        Args:
+            food: Food instance to check
+            category_ids: Set of the food's FoodCategory ids
+            
+        Returns:
+            List of strings explaining why the food is excluded
+        """
+        reasons = []
+        
+        for pattern in self.patterns:
+            category_names = [
+                display_name
+                for category_id, _, display_name, _ in pattern.excluded_categories
+                if category_id in category_ids
+            ]
+            if category_names:
+                reasons.append(
+                    f"Violates {pattern.display_name} diet (contains: {', '.join(category_names)})"
+                )
+        
+        for allergy in self.allergies:
+            if allergy.food_id == food.id:
+                reasons.append(f"Allergic to {allergy.food.name} (severity: {allergy.get_severity_display()})")
+        
+        found_allergens = self.allergen_matcher.find(food.name)
+        for allergy in self.allergies:
+            if allergy.food_id is None and normalize(allergy.allergen_name) in found_allergens:
+                reasons.append(f"Contains allergen: {allergy.allergen_name} (severity: {allergy.get_severity_display()})")
+        
+        for dislike in self.dislikes:
+            if dislike.food_id == food.id:
+                reason_text = "User dislikes this food"
+                if dislike.reason:
+                    reason_text += f": {dislike.reason}"
+                reasons.append(reason_text)
+        
+        return reasons
 
 
 class ConstraintService:
@@ -16,6 +141,25 @@ class ConstraintService:
         Get all foods that are allowed for a given user.
         Excludes foods that violate dietary patterns, allergies, or dislikes.
         
+        Args:
+            user: Django User instance
+            
+        Returns:
+            QuerySet of Food objects that are allowed for the user
+        """
+        pattern_ids, excluded_food_ids, allergen_names = ConstraintService._load_exclusions(user)
+        return Food.objects.filter(ConstraintService.allowed_foods_filter(
+            pattern_ids=pattern_ids,
+            excluded_food_ids=excluded_food_ids,
+            allergen_names=allergen_matches.ensure_terms(allergen_names),
+        ))
+    
+    @staticmethod
+    def query_allowed_foods(user):
+        """
+        Build the allowed-foods QuerySet directly with ORM excludes.
+        This is the reference path the FoodConstraintIndex must agree with.
+        
         Args:
             user: Django User instance
             
@@ -26,11 +170,11 @@ class ConstraintService:
         allowed_foods = Food.objects.all()
         
         # Exclude foods based on dietary patterns
-        dietary_preferences = UserDietaryPreference.objects.filter(user=user)
+        dietary_preferences = list(UserDietaryPreference.objects.filter(user=user))
+        registry = get_registry(preference.pattern_id for preference in dietary_preferences)
         for preference in dietary_preferences:
-            pattern = preference.pattern
-            # Get excluded categories for this pattern
-            excluded_categories = pattern.excluded_categories.all()
+            # Get excluded categories for this pattern from the compiled registry
+            excluded_categories = registry.excluded_category_ids([preference.pattern_id])
             if excluded_categories:
                 # Exclude foods that have any of the excluded categories
                 allowed_foods = allowed_foods.exclude(categories__in=excluded_categories)
@@ -42,11 +186,14 @@ class ConstraintService:
             allowed_foods = allowed_foods.exclude(id__in=allergic_food_ids)
         
         # Also check allergen names (for allergens not in database)
-        allergen_names = [allergy.allergen_name.lower() for allergy in allergies]
+        allergen_names = allergen_matches.ensure_terms(allergy.allergen_name for allergy in allergies)
         if allergen_names:
-            # Exclude foods whose name contains any allergen name
-            for allergen in allergen_names:
-                allowed_foods = allowed_foods.exclude(name__icontains=allergen)
+            # Exclude foods whose name contains any allergen name via the materialized match table
+            allowed_foods = allowed_foods.exclude(
+                id__in=AllergenMatch.objects.filter(
+                    allergen_normalized__in=allergen_names
+                ).values('food_id')
+            )
         
         # Exclude foods user dislikes
         disliked_foods = UserFoodDislike.objects.filter(user=user)
@@ -56,6 +203,104 @@ class ConstraintService:
         
         return allowed_foods.distinct()
     
+    @staticmethod
+    def use_index():
+        """
+        Whether allowed foods are resolved through the in-process FoodConstraintIndex.
+        Controlled by the NUTRITION_USE_CONSTRAINT_INDEX setting.
+        """
+        return getattr(settings, 'NUTRITION_USE_CONSTRAINT_INDEX', False)
+    
+    @staticmethod
+    def get_allowed_food_ids(user):
+        """
+        Get the ids of all foods that are allowed for a given user.
+        Results are cached per user and invalidated when the user's constraints
+        or the food catalog change.
+        
+        Args:
+            user: Django User instance
+            
+        Returns:
+            frozenset of Food ids that are allowed for the user
+        """
+        return AllowedFoodCache.get_or_compute(
+            user.id, lambda: ConstraintService.compute_allowed_food_ids(user)
+        )
+    
+    @staticmethod
+    def compute_allowed_food_ids(user):
+        """
+        Resolve allowed food ids without the cache.
+        Uses the FoodConstraintIndex when enabled, otherwise the ORM query.
+        
+        Args:
+            user: Django User instance
+            
+        Returns:
+            List of Food ids that are allowed for the user
+        """
+        if not ConstraintService.use_index():
+            return list(ConstraintService.query_allowed_foods(user).values_list('id', flat=True))
+        
+        pattern_ids, excluded_food_ids, allergen_names = ConstraintService._load_exclusions(user)
+        return get_index(pattern_ids).allowed_ids(
+            pattern_ids=pattern_ids,
+            allergen_names=allergen_names,
+            excluded_food_ids=excluded_food_ids,
+        )
+    
+    @staticmethod
+    def _load_exclusions(user):
+        """
+        Load what a user's constraints exclude, as plain ids and names.
+        
+        Returns:
+            Tuple (dietary pattern ids, ids of foods excluded outright by
+            allergies and dislikes, free-text allergen names)
+        """
+        pattern_ids = list(
+            UserDietaryPreference.objects.filter(user=user).values_list('pattern_id', flat=True)
+        )
+        allergies = list(UserAllergy.objects.filter(user=user).values_list('food_id', 'allergen_name'))
+        disliked_food_ids = list(UserFoodDislike.objects.filter(user=user).values_list('food_id', flat=True))
+        
+        excluded_food_ids = [food_id for food_id, _ in allergies if food_id] + disliked_food_ids
+        allergen_names = [allergen_name for _, allergen_name in allergies]
+        return pattern_ids, excluded_food_ids, allergen_names
+    
+    @staticmethod
+    def allowed_foods_filter(pattern_ids=(), excluded_food_ids=(), allergen_names=(), registry=None):
+        """
+        Build a Q object matching allowed foods, using subqueries instead of joins
+        so it can be used inside aggregates without duplicating rows.
+        
+        Args:
+            pattern_ids: Ids of the user's dietary patterns
+            excluded_food_ids: Ids of foods excluded outright (allergies and dislikes)
+            allergen_names: Normalized allergen names already present in AllergenMatch
+            registry: PatternRegistry already holding pattern_ids (default: get_registry())
+            
+        Returns:
+            Q object
+        """
+        allowed = Q()
+        pattern_ids = list(pattern_ids)
+        if registry is None:
+            registry = get_registry(pattern_ids)
+        excluded_categories = registry.excluded_category_ids(pattern_ids)
+        if excluded_categories:
+            allowed &= ~Q(id__in=Food.categories.through.objects.filter(
+                foodcategory_id__in=excluded_categories
+            ).values('food_id'))
+        if excluded_food_ids:
+            allowed &= ~Q(id__in=excluded_food_ids)
+        if allergen_names:
+            allowed &= ~Q(id__in=AllergenMatch.objects.filter(
+                allergen_normalized__in=allergen_names
+            ).values('food_id'))
+        return allowed
+    
     @staticmethod
     def is_food_allowed(user, food):
         """
@@ -68,8 +313,7 @@ class ConstraintService:
         Returns:
             Boolean: True if food is allowed, False otherwise
         """
-        allowed_foods = ConstraintService.get_allowed_foods(user)
-        return allowed_foods.filter(id=food.id).exists()
+        return food.id in ConstraintService.get_allowed_food_ids(user)
     
     @staticmethod
     def get_excluded_foods(user):
@@ -82,10 +326,9 @@ class ConstraintService:
         Returns:
             QuerySet of Food objects that are excluded for the user
         """
-        all_foods = Food.objects.all()
-        allowed_foods = ConstraintService.get_allowed_foods(user)
-        excluded_foods = all_foods.exclude(id__in=allowed_foods.values_list('id', flat=True))
-        return excluded_foods
+        # A subquery, not the cached id set: that would inline every allowed id
+        # in this query and again wherever the result is filtered on
+        return Food.objects.exclude(id__in=ConstraintService.get_allowed_foods(user).values('id'))
     
     @staticmethod
     def get_exclusion_reasons(user, food):
@@ -99,43 +342,74 @@ class ConstraintService:
         Returns:
             List of strings explaining why the food is excluded
         """
-        reasons = []
+        constraints = UserConstraints.load([user.id])[user.id]
+        category_ids = {category.id for category in food.categories.all()}
+        return constraints.exclusion_reasons(food, category_ids)
+    
+    @staticmethod
+    def explain_exclusions(user, foods=None):
+        """
+        Explain exclusions for many foods at once.
+        Loads the user's constraints once and the catalog's category assignments
+        in a single query, then matches them in memory.
         
-        # Check dietary patterns
-        dietary_preferences = UserDietaryPreference.objects.filter(user=user)
-        for preference in dietary_preferences:
-            pattern = preference.pattern
-            excluded_categories = pattern.excluded_categories.all()
-            food_categories = food.categories.all()
+        Args:
+            user: Django User instance
+            foods: Optional QuerySet of Food objects (defaults to the whole catalog)
             
-            # Check if food has any category that's excluded by this pattern
-            conflicting_categories = excluded_categories.filter(id__in=food_categories.values_list('id', flat=True))
-            if conflicting_categories:
-                category_names = [cat.get_name_display() for cat in conflicting_categories]
-                reasons.append(
-                    f"Violates {pattern.get_name_display()} diet (contains: {', '.join(category_names)})"
-                )
+        Returns:
+            Dictionary mapping food id to a list of reasons (same strings as
+            get_exclusion_reasons); foods without any reason are omitted
+        """
+        constraints = UserConstraints.load([user.id])[user.id]
+        if foods is None:
+            foods = Food.objects.all()
         
-        # Check allergies
-        allergies = UserAllergy.objects.filter(user=user, food=food)
-        for allergy in allergies:
-            reasons.append(f"Allergic to {allergy.food.name} (severity: {allergy.get_severity_display()})")
+        category_ids = {}
+        memberships = Food.categories.through.objects.filter(
+            food_id__in=foods.values('id')
+        ).values_list('food_id', 'foodcategory_id')
+        for food_id, category_id in memberships:
+            category_ids.setdefault(food_id, set()).add(category_id)
         
-        # Check allergen names in food name
-        allergies_by_name = UserAllergy.objects.filter(user=user, food__isnull=True)
-        for allergy in allergies_by_name:
-            if allergy.allergen_name.lower() in food.name.lower():
-                reasons.append(f"Contains allergen: {allergy.allergen_name} (severity: {allergy.get_severity_display()})")
+        explanations = {}
+        for food in foods.only('id', 'name'):
+            reasons = constraints.exclusion_reasons(food, category_ids.get(food.id, set()))
+            if reasons:
+                explanations[food.id] = reasons
+        return explanations
+    
+    @staticmethod
+    def check_foods_allowed(user_ids, food_ids):
+        """
+        Check every (user, food) pair with a constant number of queries.
         
-        # Check dislikes
-        dislikes = UserFoodDislike.objects.filter(user=user, food=food)
-        for dislike in dislikes:
-            reason_text = f"User dislikes this food"
-            if dislike.reason:
-                reason_text += f": {dislike.reason}"
-            reasons.append(reason_text)
+        Args:
+            user_ids: List of User ids
+            food_ids: List of Food ids
+            
+        Returns:
+            List of dictionaries with user_id, food_id, food_name, is_allowed
+            and exclusion_reasons, ordered by user then food as given
+        """
+        constraints = UserConstraints.load(user_ids)
+        foods = Food.objects.filter(id__in=food_ids).prefetch_related('categories').in_bulk()
         
-        return reasons
+        results = []
+        for user_id in user_ids:
+            user_constraints = constraints[user_id]
+            for food_id in food_ids:
+                food = foods[food_id]
+                category_ids = {category.id for category in food.categories.all()}
+                is_allowed = user_constraints.is_allowed(food, category_ids)
+                results.append({
+                    'user_id': user_id,
+                    'food_id': food.id,
+                    'food_name': food.name,
+                    'is_allowed': is_allowed,
+                    'exclusion_reasons': [] if is_allowed else user_constraints.exclusion_reasons(food, category_ids),
+                })
+        return results
     
     @staticmethod
     def get_user_constraints_summary(user):
@@ -149,14 +423,27 @@ class ConstraintService:
         Returns:
             Dictionary with summary of user constraints
         """
-        dietary_preferences = UserDietaryPreference.objects.filter(user=user)
-        allergies = UserAllergy.objects.filter(user=user)
-        dislikes = UserFoodDislike.objects.filter(user=user)
+        dietary_preferences = list(UserDietaryPreference.objects.filter(user=user))
+        registry = get_registry(pref.pattern_id for pref in dietary_preferences)
+        allergies = list(UserAllergy.objects.filter(user=user).select_related('food'))
+        dislikes = list(UserFoodDislike.objects.filter(user=user).select_related('food'))
+        
+        allowed_filter = ConstraintService.allowed_foods_filter(
+            pattern_ids=[pref.pattern_id for pref in dietary_preferences],
+            excluded_food_ids=[allergy.food_id for allergy in allergies if allergy.food_id]
+            + [dislike.food_id for dislike in dislikes],
+            allergen_names=allergen_matches.ensure_terms(allergy.allergen_name for allergy in allergies),
+            registry=registry,
+        )
+        counts = Food.objects.aggregate(
+            total=Count('id'),
+            allowed=Count('id', filter=allowed_filter),
+        )
         
         return {
             'dietary_patterns': [
                 {
-                    'pattern': pref.pattern.get_name_display(),
+                    'pattern': registry.get(pref.pattern_id).display_name,
                     'custom_notes': pref.custom_notes
                 }
                 for pref in dietary_preferences
@@ -176,7 +463,7 @@ class ConstraintService:
                 }
                 for dislike in dislikes
             ],
-            'total_allowed_foods': ConstraintService.get_allowed_foods(user).count(),
-            'total_excluded_foods': ConstraintService.get_excluded_foods(user).count(),
+            'total_allowed_foods': counts['allowed'],
+            'total_excluded_foods': counts['total'] - counts['allowed'],
         }
 
@@ -0,0 +1,182 @@
+"""
+Dense nutrient matrix over the food catalog.
+
+Holds per-100g nutrient values of every food in one contiguous float array so
+nutrition for many (food, quantity) pairs is a quantity vector times a matrix
+slice instead of a Python loop over Decimal fields.
+"""
+
+import threading
+from datetime import timedelta
+import numpy as np
+from .models import Food
+from . import versions
+
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar')
+FIELDS = tuple(f"{nutrient}_per_100g" for nutrient in NUTRIENTS)
+
+# Columns whose values may be missing (null in the database)
+OPTIONAL_NUTRIENTS = ('fiber', 'sugar')
+
+# How far before the last sync refreshes look back. updated_at is set when a
+# food is saved, not when its transaction commits, so a transaction committing
+# after a newer one can carry older timestamps; it is caught if it lasted less.
+SYNC_WINDOW = timedelta(minutes=5)
+
+
+class FoodMatrix:
+    """
+    Float matrix of shape (n_foods, n_nutrients) with an id -> row index.
+
+    `present` marks which cells hold a value; fiber and sugar cells of foods
+    with a null (or zero) value are absent, mirroring Food.calculate_nutrition.
+    """
+
+    def __init__(self):
+        self.values = np.zeros((0, len(NUTRIENTS)), dtype=np.float64)
+        self.present = np.zeros((0, len(NUTRIENTS)), dtype=bool)
+        self.food_ids = np.zeros(0, dtype=np.int64)
+        self.rows = {}
+        self.synced_at = None
+        self.version = None
+
+    def __len__(self):
+        return len(self.food_ids)
+
+    def __contains__(self, food_id):
+        return food_id in self.rows
+
+    @classmethod
+    def build(cls, version=None):
+        """Build a matrix for the whole catalog."""
+        matrix = cls()
+        matrix.refresh(version=version)
+        return matrix
+
+    def copy(self):
+        """Return an independent copy that can be refreshed while readers use this one."""
+        matrix = FoodMatrix()
+        matrix.values = self.values.copy()
+        matrix.present = self.present.copy()
+        matrix.food_ids = self.food_ids.copy()
+        matrix.rows = dict(self.rows)
+        matrix.synced_at = self.synced_at
+        matrix.version = self.version
+        return matrix
+
+    def refresh(self, version=None):
+        """
+        Bring the matrix up to date with the database.
+
+        Only foods updated since SYNC_WINDOW before the last sync are
+        reloaded; deleted foods are detected by comparing the id set. Writes
+        that bypass `updated_at` (QuerySet.update) require a full build.
+
+        Args:
+            version: Catalog version stamp the refreshed matrix corresponds to
+        """
+        changed = Food.objects.order_by('id').values_list('id', 'updated_at', *FIELDS)
+        if self.synced_at is not None:
+            changed = changed.filter(updated_at__gte=self.synced_at - SYNC_WINDOW)
+            current_ids = set(Food.objects.values_list('id', flat=True))
+            deleted = [food_id for food_id in self.rows if food_id not in current_ids]
+            if deleted:
+                self._remove(deleted)
+
+        changed = list(changed)
+        if changed:
+            self._upsert(changed)
+            latest = max(row[1] for row in changed)
+            if self.synced_at is None or latest > self.synced_at:
+                self.synced_at = latest
+        self.version = version
+
+    def _upsert(self, rows):
+        new_ids = [row[0] for row in rows if row[0] not in self.rows]
+        if new_ids:
+            start = len(self.food_ids)
+            self.values = np.vstack([self.values, np.zeros((len(new_ids), len(NUTRIENTS)))])
+            self.present = np.vstack([self.present, np.zeros((len(new_ids), len(NUTRIENTS)), dtype=bool)])
+            self.food_ids = np.concatenate([self.food_ids, np.array(new_ids, dtype=np.int64)])
+            for offset, food_id in enumerate(new_ids):
+                self.rows[food_id] = start + offset
+
+        for food_id, _, *nutrients in rows:
+            row = self.rows[food_id]
+            for column, value in enumerate(nutrients):
+                self.values[row, column] = float(value) if value else 0.0
+                self.present[row, column] = bool(value) or NUTRIENTS[column] not in OPTIONAL_NUTRIENTS
+
+    def _remove(self, food_ids):
+        keep = np.ones(len(self.food_ids), dtype=bool)
+        keep[[self.rows[food_id] for food_id in food_ids]] = False
+        self.values = np.ascontiguousarray(self.values[keep])
+        self.present = np.ascontiguousarray(self.present[keep])
+        self.food_ids = self.food_ids[keep]
+        self.rows = {food_id: row for row, food_id in enumerate(self.food_ids.tolist())}
+
+    def row_indices(self, food_ids):
+        """Return the matrix rows of the given food ids as an integer array."""
+        return np.fromiter((self.rows[food_id] for food_id in food_ids), dtype=np.int64, count=len(food_ids))
+
+    def nutrition(self, food_ids, quantities):
+        """
+        Nutrition of each (food, grams) pair.
+
+        Args:
+            food_ids: Sequence of Food ids
+            quantities: Sequence of quantities in grams
+
+        Returns:
+            Tuple (values, present) of (n, n_nutrients) arrays
+        """
+        rows = self.row_indices(food_ids)
+        multipliers = np.asarray(quantities, dtype=np.float64) / 100.0
+        return self.values[rows] * multipliers[:, None], self.present[rows]
+
+    def totals(self, food_ids, quantities):
+        """
+        Total nutrition of a set of (food, grams) pairs, shaped like Meal.calculate_total_nutrition.
+
+        Returns:
+            Dictionary of nutrient totals rounded to 2 decimals; fiber and sugar
+            are None when no food contributes to them
+        """
+        values, present = self.nutrition(food_ids, quantities)
+        totals = (values * present).sum(axis=0)
+        return self.as_dict(totals, present.any(axis=0))
+
+    @staticmethod
+    def as_dict(vector, present=None):
+        """Convert a nutrient vector into the API dictionary shape."""
+        result = {}
+        for column, nutrient in enumerate(NUTRIENTS):
+            value = round(float(vector[column]), 2)
+            if nutrient in OPTIONAL_NUTRIENTS and (present is not None and not present[column] or value <= 0):
+                value = None
+            result[nutrient] = value
+        return result
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_matrix():
+    """
+    Return the process-wide matrix, refreshing it incrementally when the catalog changed.
+    """
+    global _matrix
+    version = versions.get_version(versions.CATALOG)
+    matrix = _matrix
+    if matrix is not None and matrix.version == version:
+        return matrix
+    with _matrix_lock:
+        if _matrix is None:
+            _matrix = FoodMatrix.build(version=version)
+        elif _matrix.version != version:
+            # Refresh a copy so concurrent readers never see a half-updated matrix
+            matrix = _matrix.copy()
+            matrix.refresh(version=version)
+            _matrix = matrix
+        return _matrix
@@ -0,0 +1,125 @@
+"""
+Process-local memo of generated meal plan compositions.
+
+Users with the same (rounded) targets and the same allowed foods get the same
+plan, so the composition is computed once and reused. Entries hold plain
+tuples of food ids and quantities, never model instances or database rows,
+and are evicted least-recently-used once NUTRITION_GENERATION_CACHE_SIZE
+entries are stored.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from django.conf import settings
+from . import versions
+
+
+class GenerationCache:
+    """
+    LRU cache of compositions with process-local hit/miss counters.
+    """
+
+    _lock = threading.Lock()
+    _entries = OrderedDict()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def round_targets(calorie_target, protein_target, carb_target, fat_target):
+        """
+        Round daily targets to the configured granularity. Generation runs on
+        the rounded targets so every user sharing a key gets the same plan.
+
+        Returns:
+            Tuple of Decimals (calories, protein, carbs, fat)
+        """
+        calorie_step = Decimal(str(getattr(settings, 'NUTRITION_GENERATION_CALORIE_ROUNDING', 10)))
+        macro_step = Decimal(str(getattr(settings, 'NUTRITION_GENERATION_MACRO_ROUNDING', 1)))
+
+        def round_to(value, step):
+            return (Decimal(str(value)) / step).quantize(Decimal('1'), rounding=ROUND_HALF_UP) * step
+
+        return (
+            round_to(calorie_target, calorie_step),
+            round_to(protein_target, macro_step),
+            round_to(carb_target, macro_step),
+            round_to(fat_target, macro_step),
+        )
+
+    @staticmethod
+    def fingerprint(food_ids):
+        """Return a stable hash of a set of food ids."""
+        ids = np.sort(np.fromiter(food_ids, dtype=np.int64, count=len(food_ids)))
+        return hashlib.blake2b(ids.tobytes(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def make_key(targets, distribution, num_days, allowed_ids, algorithm, algorithm_version, variety=()):
+        """
+        Build the key of a composition.
+
+        variety holds the variety engine settings and seed the composition
+        was made with.
+
+        The catalog version is part of the key because nutrient edits change
+        the composition even when the allowed ids stay the same.
+        """
+        return (
+            tuple(str(target) for target in targets),
+            tuple(str(share) for share in distribution),
+            num_days,
+            GenerationCache.fingerprint(allowed_ids),
+            algorithm,
+            algorithm_version,
+            tuple(str(value) for value in variety),
+            versions.get_version(versions.CATALOG),
+        )
+
+    @classmethod
+    def get(cls, key):
+        """Return the cached composition for key, or None."""
+        with cls._lock:
+            composition = cls._entries.get(key)
+            if composition is None:
+                cls.misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls.hits += 1
+            return composition
+
+    @classmethod
+    def put(cls, key, composition):
+        """Store a composition, evicting the least recently used entries over the cap."""
+        capacity = getattr(settings, 'NUTRITION_GENERATION_CACHE_SIZE', 1024)
+        with cls._lock:
+            cls._entries[key] = composition
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > capacity:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def stats(cls):
+        """
+        Return size and hit/miss counters for this process.
+        """
+        total = cls.hits + cls.misses
+        return {
+            'size': len(cls._entries),
+            'capacity': getattr(settings, 'NUTRITION_GENERATION_CACHE_SIZE', 1024),
+            'hits': cls.hits,
+            'misses': cls.misses,
+            'hit_rate': round(cls.hits / total, 4) if total else None,
+        }
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._lock:
+            cls.hits = 0
+            cls.misses = 0
@@ -0,0 +1,410 @@
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from nutrition import allergen_matches, fixed_point
+from nutrition.models import (
+    Food, FoodCategory, DietaryPattern, Meal, MealPlan, MealPlanMeal, UserProfile,
+    UserDietaryPreference, UserAllergy, UserFoodDislike
+)
+from nutrition.constraint_index import FoodConstraintIndex
+from nutrition.constraint_service import ConstraintService
+from nutrition.food_matrix import get_matrix
+from nutrition.generation_cache import GenerationCache
+from nutrition.meal_optimizer import MealOptimizer, TARGETS
+from nutrition.serializers import MealPlanSerializer
+from nutrition.services import FoodRolePools, MealPlanGenerator
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hot paths against a synthetic catalog. All generated data is rolled back.'
+
+    SUITES = {
+        'constraints': 'bench_constraints',
+        'optimizer': 'bench_optimizer',
+        'stream': 'bench_stream',
+        'variety': 'bench_variety',
+        'queries': 'bench_queries',
+        'kernel': 'bench_kernel',
+    }
+
+    ALLERGENS = ['peanut', 'shellfish', 'milk', 'wheat', 'soy', 'egg', 'sesame', 'almond']
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(self.SUITES), help='Benchmark suite to run')
+        parser.add_argument('--foods', type=int, default=2000, help='Number of synthetic foods')
+        parser.add_argument('--users', type=int, default=20, help='Number of synthetic users')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per measurement')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data')
+        parser.add_argument('--days', type=int, default=30, help='Plan length for the stream suite')
+        parser.add_argument(
+            '--horizons', type=int, nargs='+', default=[7, 30, 90], help='Plan lengths for the variety suite'
+        )
+        parser.add_argument(
+            '--plan-days', type=int, nargs='+', default=[1, 7, 28], help='Plan lengths for the queries suite'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            fixture = self._build_fixture(rng, options['foods'], options['users'])
+            getattr(self, self.SUITES[options['suite']])(fixture, options)
+            transaction.set_rollback(True)
+
+    # ----------------------------
+    # Suites
+    # ----------------------------
+
+    def bench_constraints(self, fixture, options):
+        """ORM chained excludes vs FoodConstraintIndex for get_allowed_foods."""
+        users = fixture['users']
+        repeat = options['repeat']
+
+        build_ms = self._time(lambda: FoodConstraintIndex.build(), repeat)
+        index = FoodConstraintIndex.build()
+
+        def orm_path():
+            return [
+                sorted(ConstraintService.query_allowed_foods(user).values_list('id', flat=True))
+                for user in users
+            ]
+
+        def index_path():
+            results = []
+            for user in users:
+                pattern_ids = list(user.dietary_preferences.values_list('pattern_id', flat=True))
+                allergies = list(user.allergies.values_list('food_id', 'allergen_name'))
+                excluded = [food_id for food_id, _ in allergies if food_id]
+                excluded += list(user.food_dislikes.values_list('food_id', flat=True))
+                results.append(index.allowed_ids(
+                    pattern_ids=pattern_ids,
+                    allergen_names=[name for _, name in allergies],
+                    excluded_food_ids=excluded,
+                ))
+            return results
+
+        if orm_path() != index_path():
+            raise CommandError('FoodConstraintIndex returned different ids than the ORM path.')
+
+        orm_ms = self._time(orm_path, repeat)
+        index_ms = self._time(index_path, repeat)
+
+        self._report(f"Catalog: {len(index)} foods, {len(users)} users (ids verified identical)")
+        self._report(f"Index build: {self._format(build_ms)}")
+        self._report(f"ORM path ({len(users)} users): {self._format(orm_ms)}")
+        self._report(f"Index path ({len(users)} users): {self._format(index_ms)}")
+        self._report(f"Speedup: {statistics.median(orm_ms) / statistics.median(index_ms):.1f}x")
+
+    def bench_optimizer(self, fixture, options):
+        """Greedy _compose_meal vs MealOptimizer: deviation from slot targets and per-slot latency."""
+        rng = random.Random(options['seed'])
+        matrix = get_matrix()
+        errors = {'greedy': [], 'optimized': []}
+        latency = {'greedy': [], 'optimized': []}
+
+        for user in fixture['users']:
+            profile = self._create_profile(rng, user)
+            foods = list(ConstraintService.get_allowed_foods(user))
+            if not foods:
+                continue
+            pools = FoodRolePools(foods)
+            optimizer = MealOptimizer(pools, matrix)
+
+            for meal_type, label, percent in MealPlanGenerator.MEAL_SLOTS:
+                targets = MealPlanGenerator.slot_targets(profile, percent)
+                target_calories = Decimal(str(profile.calorie_target)) * percent
+
+                start = time.perf_counter()
+                planned = MealPlanGenerator._compose_meal(label, meal_type, target_calories, pools)
+                latency['greedy'].append((time.perf_counter() - start) * 1000)
+                items = [(food.id, grams) for food, grams in planned.portions]
+                errors['greedy'].append(self._deviation(matrix, items, targets))
+
+                start = time.perf_counter()
+                portions = optimizer.optimize(targets)
+                latency['optimized'].append((time.perf_counter() - start) * 1000)
+                items = [(food.id, grams) for food, grams in portions]
+                errors['optimized'].append(self._deviation(matrix, items, targets))
+
+        self._report(f"Catalog: {len(matrix)} foods, {len(latency['greedy'])} meal slots")
+        for algorithm in ('greedy', 'optimized'):
+            mean_errors = [statistics.mean(column) for column in zip(*errors[algorithm])]
+            deviations = ', '.join(
+                f"{nutrient} {error * 100:.1f}%" for nutrient, error in zip(TARGETS, mean_errors)
+            )
+            self._report(f"{algorithm}: {self._format(latency[algorithm])} per slot")
+            self._report(f"  mean deviation from targets: {deviations}")
+
+    def bench_stream(self, fixture, options):
+        """Blocking generate + serialize vs streamed NDJSON: time to first day and to the full plan."""
+        rng = random.Random(options['seed'])
+        num_days = options['days']
+        users = [user for user in fixture['users'] if self._create_profile(rng, user)]
+        first_day = {algorithm: [] for algorithm in MealPlanGenerator.ALGORITHMS}
+        streamed = {algorithm: [] for algorithm in MealPlanGenerator.ALGORITHMS}
+        blocking = {algorithm: [] for algorithm in MealPlanGenerator.ALGORITHMS}
+
+        for algorithm in MealPlanGenerator.ALGORITHMS:
+            for user in users:
+                if not ConstraintService.get_allowed_food_ids(user):
+                    continue
+                # Every run composes from scratch rather than hitting the generation cache
+                GenerationCache.clear()
+                start = time.perf_counter()
+                meal_plan = MealPlanGenerator.generate_meal_plan(user, num_days=num_days, algorithm=algorithm)
+                json.dumps(MealPlanSerializer(meal_plan).data, cls=DjangoJSONEncoder)
+                blocking[algorithm].append((time.perf_counter() - start) * 1000)
+
+                GenerationCache.clear()
+                start = time.perf_counter()
+                for line, event in enumerate(MealPlanGenerator.stream_meal_plan(user, num_days, algorithm)):
+                    json.dumps(event, cls=DjangoJSONEncoder)
+                    if line == 0:
+                        first_day[algorithm].append((time.perf_counter() - start) * 1000)
+                streamed[algorithm].append((time.perf_counter() - start) * 1000)
+
+        self._report(f"{num_days}-day plans, {len(blocking['greedy'])} users per algorithm")
+        for algorithm in MealPlanGenerator.ALGORITHMS:
+            self._report(f"{algorithm}:")
+            self._report(f"  blocking response: {self._format(blocking[algorithm])}")
+            self._report(f"  streamed, first day: {self._format(first_day[algorithm])}")
+            self._report(f"  streamed, full plan: {self._format(streamed[algorithm])}")
+
+    def bench_variety(self, fixture, options):
+        """Variety-aware plan_meals latency by catalog size and horizon, with repetition stats."""
+        rng = random.Random(options['seed'])
+        profile = self._create_profile(rng, fixture['users'][0])
+        matrix = get_matrix()
+        foods = fixture['foods']
+        sizes = sorted({max(len(foods) // 8, 1), max(len(foods) // 2, 1), len(foods)})
+
+        for algorithm in MealPlanGenerator.ALGORITHMS:
+            self._report(f"{algorithm}:")
+            for size in sizes:
+                pools = FoodRolePools(foods[:size])
+                for days in options['horizons']:
+                    def plan():
+                        return MealPlanGenerator.plan_meals(
+                            profile, pools, days, algorithm, matrix=matrix, seed=options['seed']
+                        )
+
+                    samples = self._time(plan, options['repeat'])
+                    planned_meals = plan()
+                    if planned_meals != plan():
+                        raise CommandError('Seeded plans differ between runs.')
+                    distinct = len({
+                        (planned.meal_type, food.id) for planned in planned_meals for food, _ in planned.portions
+                    })
+                    self._report(
+                        f"  {size} foods, {days} days: {self._format(samples)} "
+                        f"({statistics.median(samples) / days:.2f} ms/day), "
+                        f"{distinct} distinct (meal type, food) pairs, "
+                        f"max repeats in window {self._max_repeats(planned_meals)}"
+                    )
+
+    def bench_queries(self, fixture, options):
+        """Queries and latency of the meal plan list endpoint as plans grow, by totals source."""
+        rng = random.Random(options['seed'])
+        user = next(user for user in fixture['users'] if ConstraintService.get_allowed_food_ids(user))
+        self._create_profile(rng, user)
+        client = Client(HTTP_HOST='localhost')
+        url = f"/api/meal-plans/?user_id={user.id}"
+        num_plans = 4
+
+        for days in options['plan_days']:
+            MealPlan.objects.filter(user=user).delete()
+            for _ in range(num_plans):
+                MealPlanGenerator.generate_meal_plan(user, num_days=days, seed=rng.randrange(1 << 30))
+            meals = MealPlanMeal.objects.filter(mealplan__user=user).count()
+            self._report(f"{days}-day plans, {num_plans} plans per page, {meals // num_plans} meals per plan:")
+
+            for label, suffix in (('stored totals', ''), ('SQL-summed totals', '&totals=computed')):
+                def get():
+                    response = client.get(url + suffix)
+                    if response.status_code != 200:
+                        raise CommandError(f'{url + suffix} returned {response.status_code}.')
+
+                self._report(
+                    f"  {label}: {self._count_queries(get)} queries, "
+                    f"{self._format(self._time(get, options['repeat']))}"
+                )
+
+            # Per-meal Python totals over unprefetched meals, as before stored totals
+            def python_totals():
+                for meal_plan in MealPlan.objects.filter(user=user):
+                    for meal in meal_plan.meals.all():
+                        meal.calculate_total_nutrition()
+
+            self._report(
+                f"  Python totals: {self._count_queries(python_totals)} queries, "
+                f"{self._format(self._time(python_totals, options['repeat']))}"
+            )
+
+    def bench_kernel(self, fixture, options):
+        """Decimal nutrition math vs the candidate fixed-point kernel (nutrition/fixed_point.py)."""
+        rng = random.Random(options['seed'])
+        foods = fixture['foods']
+        repeat = options['repeat']
+        # Quantities as MealFood stores them
+        portions = [(rng.choice(foods), Decimal(rng.randint(1000, 40000)).scaleb(-2)) for _ in range(2000)]
+        meals = [portions[start:start + 4] for start in range(0, len(portions), 4)]
+
+        # Parsed once per food, as a per-Food cache in the models would; parsing
+        # on every call makes the kernel several times slower than Decimal
+        parsed = {
+            food.id: fixed_point.FoodNutrients(tuple(getattr(food, source) for source in Meal.TOTAL_SOURCES.values()))
+            for food in foods
+        }
+
+        def nutrients(food):
+            return parsed[food.id]
+
+        cases = [
+            (
+                f'Food.calculate_nutrition ({len(portions)} portions)',
+                lambda: [food.calculate_nutrition(grams) for food, grams in portions],
+                lambda: [fixed_point.calculate_nutrition(nutrients(food), grams) for food, grams in portions],
+            ),
+            (
+                f'Meal.totals_for_portions ({len(meals)} meals)',
+                lambda: [Meal.totals_for_portions(meal) for meal in meals],
+                lambda: [
+                    fixed_point.compute_totals(
+                        [(nutrients(food), grams) for food, grams in meal], Meal.TOTAL_FIELDS, Meal.OPTIONAL_TOTALS
+                    )
+                    for meal in meals
+                ],
+            ),
+        ]
+
+        self._report(f"Catalog: {len(foods)} foods (outputs verified identical, exponents included)")
+        for label, decimal_path, kernel in cases:
+            # repr() tells Decimal('5.00') from Decimal('5.0')
+            if repr(decimal_path()) != repr(kernel()):
+                raise CommandError(f'{label}: the kernel differs from the Decimal code.')
+            decimal_ms = self._time(decimal_path, repeat)
+            kernel_ms = self._time(kernel, repeat)
+            self._report(f"{label}:")
+            self._report(f"  Decimal: {self._format(decimal_ms)}")
+            self._report(f"  fixed point: {self._format(kernel_ms)}")
+            self._report(f"  speedup: {statistics.median(decimal_ms) / statistics.median(kernel_ms):.1f}x")
+
+    # ----------------------------
+    # Helpers
+    # ----------------------------
+
+    def _build_fixture(self, rng, num_foods, num_users):
+        categories = [
+            FoodCategory.objects.get_or_create(name=name)[0]
+            for name, _ in FoodCategory.CATEGORY_CHOICES
+        ]
+        patterns = []
+        for name, _ in DietaryPattern.PATTERN_CHOICES:
+            pattern, _ = DietaryPattern.objects.get_or_create(name=name)
+            if not pattern.excluded_categories.exists():
+                pattern.excluded_categories.set(rng.sample(categories, rng.randint(1, 3)))
+            patterns.append(pattern)
+
+        foods = [
+            Food(
+                name=f"Bench {rng.choice(self.ALLERGENS + ['rice', 'bean', 'kale'])} food {i}",
+                calories_per_100g=Decimal(rng.randint(20, 600)),
+                protein_per_100g=Decimal(rng.randint(0, 40)),
+                carbs_per_100g=Decimal(rng.randint(0, 80)),
+                fat_per_100g=Decimal(rng.randint(0, 50)),
+                fiber_per_100g=Decimal(rng.randint(0, 10)) if rng.random() < 0.8 else None,
+                sugar_per_100g=Decimal(rng.randint(0, 30)) if rng.random() < 0.8 else None,
+            )
+            for i in range(num_foods)
+        ]
+        for food in foods:
+            food.assign_roles()
+        foods = Food.objects.bulk_create(foods)
+        # bulk_create skips the post_save signal that maintains allergen matches
+        allergen_matches.refresh_foods(foods)
+        Food.categories.through.objects.bulk_create([
+            Food.categories.through(food_id=food.id, foodcategory_id=category.id)
+            for food in foods
+            for category in rng.sample(categories, rng.randint(0, 3))
+        ])
+
+        users = []
+        for i in range(num_users):
+            user = User.objects.create(username=f"bench-user-{i}")
+            for pattern in rng.sample(patterns, rng.randint(0, 2)):
+                UserDietaryPreference.objects.create(user=user, pattern=pattern)
+            for allergen in rng.sample(self.ALLERGENS, rng.randint(0, 2)):
+                UserAllergy.objects.create(user=user, allergen_name=allergen)
+            for food in rng.sample(foods, min(len(foods), rng.randint(0, 5))):
+                UserFoodDislike.objects.create(user=user, food=food)
+            users.append(user)
+
+        return {'foods': foods, 'users': users, 'categories': categories, 'patterns': patterns}
+
+    def _create_profile(self, rng, user):
+        calories = rng.randint(1600, 3000)
+        return UserProfile.objects.create(
+            user=user,
+            age=rng.randint(20, 60),
+            height=Decimal(rng.randint(60, 76)),
+            weight=Decimal(rng.randint(120, 220)),
+            activity_level='moderately_active',
+            calorie_target=calories,
+            protein_target=Decimal(calories * 0.30 / 4).quantize(Decimal('0.01')),
+            carb_target=Decimal(calories * 0.40 / 4).quantize(Decimal('0.01')),
+            fat_target=Decimal(calories * 0.30 / 9).quantize(Decimal('0.01')),
+        )
+
+    def _deviation(self, matrix, items, targets):
+        """Relative absolute deviation of a meal's (calories, protein, carbs, fat) from its targets."""
+        if items:
+            totals = matrix.totals([food_id for food_id, _ in items], [float(grams) for _, grams in items])
+        else:
+            totals = dict.fromkeys(TARGETS, 0.0)
+        return [abs(totals[nutrient] - target) / target for nutrient, target in zip(TARGETS, targets)]
+
+    def _max_repeats(self, planned_meals):
+        """Most uses of one food by one meal type within any variety window."""
+        window = settings.NUTRITION_VARIETY_WINDOW_DAYS or 1
+        uses = {}
+        for planned in planned_meals:
+            for food, _ in planned.portions:
+                uses.setdefault((planned.meal_type, food.id), []).append(planned.day)
+        return max(
+            (sum(1 for other in days if day <= other < day + window) for days in uses.values() for day in days),
+            default=0,
+        )
+
+    def _count_queries(self, fn):
+        """Queries run by fn(); counted by a wrapper since requests reset connection.queries."""
+        count = 0
+
+        def counter(execute, sql, params, many, context):
+            nonlocal count
+            count += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(counter):
+            fn()
+        return count
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    def _format(self, samples):
+        return f"median {statistics.median(samples):.2f} ms, min {min(samples):.2f} ms"
+
+    def _report(self, line):
+        self.stdout.write(line)
@@ -0,0 +1,92 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from nutrition.models import Meal, MealFood, MealPlanMeal, MealPlanDayTotals
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Merge identical interned meals (those with a content hash) into one shared row. '
+        'Meals written by users have no content hash and are left alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many meals would be merged',
+        )
+
+    def handle(self, *args, **options):
+        # Only interned meals are shared; user-authored meals must stay private
+        compositions = defaultdict(list)
+        for meal_id, food_id, quantity in MealFood.objects.filter(meal__content_hash__isnull=False).values_list(
+            'meal_id', 'food_id', 'quantity_in_grams'
+        ):
+            compositions[meal_id].append((food_id, quantity))
+
+        groups = defaultdict(list)
+        stale = []
+        for meal_id, meal_type, content_hash in Meal.objects.filter(
+            content_hash__isnull=False
+        ).order_by('id').values_list('id', 'meal_type', 'content_hash'):
+            computed = Meal.compute_content_hash(meal_type, compositions.get(meal_id, ()))
+            groups[computed].append(meal_id)
+            if content_hash != computed:
+                stale.append(Meal(id=meal_id, content_hash=computed))
+
+        # The oldest meal of each group is kept
+        keepers = {}
+        for meal_ids in groups.values():
+            for duplicate_id in meal_ids[1:]:
+                keepers[duplicate_id] = meal_ids[0]
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'{len(keepers)} duplicate meals would be merged into {len(groups)} distinct meals; '
+                f'{len(stale)} content hashes would be updated.'
+            )
+            return
+
+        with transaction.atomic():
+            links = set(
+                MealPlanMeal.objects.filter(meal_id__in=set(keepers.values())).values_list(
+                    'mealplan_id', 'meal_id', 'day'
+                )
+            )
+            to_delete = []
+            to_repoint = []
+            changed_plan_ids = set()
+            for row in MealPlanMeal.objects.filter(meal_id__in=list(keepers)).order_by('id'):
+                changed_plan_ids.add(row.mealplan_id)
+                link = (row.mealplan_id, keepers[row.meal_id], row.day)
+                if link in links:
+                    # The plan already holds the kept meal on that day
+                    to_delete.append(row.id)
+                else:
+                    row.meal_id = link[1]
+                    links.add(link)
+                    to_repoint.append(row)
+
+            MealPlanMeal.objects.bulk_update(to_repoint, ['meal'], batch_size=BATCH_SIZE)
+            duplicate_ids = list(keepers)
+            for start in range(0, len(to_delete), BATCH_SIZE):
+                MealPlanMeal.objects.filter(id__in=to_delete[start:start + BATCH_SIZE]).delete()
+            for start in range(0, len(duplicate_ids), BATCH_SIZE):
+                Meal.objects.filter(id__in=duplicate_ids[start:start + BATCH_SIZE]).delete()
+
+            stale = [meal for meal in stale if meal.id not in keepers]
+            Meal.objects.bulk_update(stale, ['content_hash'], batch_size=BATCH_SIZE)
+
+            # Links dropped as duplicates change their plans' meal counts
+            MealPlanDayTotals.rebuild(changed_plan_ids)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Deduplicated meals! Merged: {len(keepers)}, Distinct: {len(groups)}, '
+                f'Plan links moved: {len(to_repoint)}'
+            )
+        )
@@ -0,0 +1,330 @@
+import itertools
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from nutrition.constraint_service import ConstraintService
+from nutrition.food_matrix import get_matrix
+from nutrition.models import Food, UserProfile
+from nutrition.services import FoodRolePools, MealPlanGenerator, PlannedMeal
+
+
+# Read-only catalog shared by every task of a worker process, set by _init_worker
+_catalog = None
+_matrix = None
+
+
+def _init_worker(shared):
+    """
+    Set up Django in the worker and unpack the shared catalog. The data is
+    passed pickled so model classes are only loaded once the app registry
+    is ready (needed with the spawn/forkserver start methods).
+    """
+    global _catalog, _matrix
+    django.setup()
+    _catalog, _matrix = pickle.loads(shared)
+
+
+def _plan_user(task):
+    """
+    Compose one user's meals in a worker process. Never touches the database.
+
+    Returns:
+        Tuple (user_id, meals, error) where meals is a list of
+        (name, meal_type, [(food_id, grams), ...], day) or None on failure
+    """
+    user_id, targets, allowed_ids, num_days, algorithm, seed = task
+    try:
+        calorie_target, protein_target, carb_target, fat_target = targets
+        profile = UserProfile(
+            calorie_target=calorie_target,
+            protein_target=protein_target,
+            carb_target=carb_target,
+            fat_target=fat_target,
+        )
+        pools = FoodRolePools([_catalog[food_id] for food_id in allowed_ids])
+        planned_meals = MealPlanGenerator.plan_meals(
+            profile, pools, num_days, algorithm, matrix=_matrix, seed=seed
+        )
+    except Exception as e:
+        return user_id, None, f"{type(e).__name__}: {e}"
+    meals = [
+        (planned.name, planned.meal_type, [(food.id, grams) for food, grams in planned.portions], planned.day)
+        for planned in planned_meals
+    ]
+    return user_id, meals, None
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate meal plans for many users at once. Meals are composed in a process pool '
+        'and written back in batches; progress is checkpointed so an interrupted run can resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-ids', type=int, nargs='+', help='Only these users')
+        parser.add_argument('--logged-in-within', type=int, metavar='DAYS', help='Only users who logged in within DAYS days')
+        parser.add_argument('--include-inactive', action='store_true', help='Also include users with is_active=False')
+        parser.add_argument('--num-days', type=int, default=7, help='Days per plan (default: 7)')
+        parser.add_argument(
+            '--algorithm', choices=MealPlanGenerator.ALGORITHMS, default='greedy',
+            help='Meal composition algorithm (default: greedy)'
+        )
+        parser.add_argument('--seed', type=int, help='Variety seed used for every plan (default: unseeded)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Worker processes (default: CPU count; 0 composes in this process)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Users written per transaction (default: 200); plans longer than '
+                 f'{MealPlanGenerator.LONG_PLAN_DAYS} days use proportionally smaller batches'
+        )
+        parser.add_argument(
+            '--checkpoint', metavar='PATH',
+            help='JSON file recording finished users; users already in it are skipped'
+        )
+
+    def handle(self, *args, **options):
+        num_days = options['num_days']
+        algorithm = options['algorithm']
+        seed = options['seed']
+        if num_days < 1 or num_days > MealPlanGenerator.MAX_DAYS:
+            raise CommandError(f'--num-days must be between 1 and {MealPlanGenerator.MAX_DAYS}.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        if options['user_ids']:
+            unknown = set(options['user_ids']) - set(
+                User.objects.filter(id__in=options['user_ids']).values_list('id', flat=True)
+            )
+            if unknown:
+                raise CommandError(f"Unknown user ids: {', '.join(map(str, sorted(unknown)))}.")
+
+        checkpoint = self._load_checkpoint(options['checkpoint'])
+        completed = set(checkpoint['completed'])
+        user_ids = [user_id for user_id in self._select_users(options) if user_id not in completed]
+        if completed:
+            self.stdout.write(f'Resuming: {len(completed)} users already done.')
+        if not user_ids:
+            self.stdout.write(self.style.SUCCESS('No users to generate meal plans for.'))
+            return
+
+        # Shared data is loaded once and handed to every worker
+        catalog = {food.id: food for food in Food.objects.order_by('id')}
+        matrix = get_matrix() if algorithm == 'optimized' else None
+        batch_size = options['batch_size']
+        if num_days > MealPlanGenerator.LONG_PLAN_DAYS:
+            # Hold no more composed days per batch than a batch of the longest short plans
+            batch_size = max(1, batch_size * MealPlanGenerator.LONG_PLAN_DAYS // num_days)
+        batches = [user_ids[start:start + batch_size] for start in range(0, len(user_ids), batch_size)]
+
+        done = 0
+        failed = 0
+        started = time.perf_counter()
+        # The first batch is resolved before the pool exists (see _executor)
+        tasks = self._tasks(batches[0], num_days, algorithm, seed)
+        with self._executor(options['workers'], catalog, matrix) as executor:
+            futures = self._submit(executor, tasks)
+            for number, batch in enumerate(batches):
+                results = []
+                for user_id, future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append((user_id, None, f"{type(e).__name__}: {e}"))
+                # Keep the workers busy with the next batch while this one is written
+                if number + 1 < len(batches):
+                    futures = self._submit(executor, self._tasks(batches[number + 1], num_days, algorithm, seed))
+
+                saved, errors = self._write(results, catalog, num_days)
+                checkpoint['completed'].extend(saved)
+                checkpoint['failed'].update(errors)
+                for user_id in saved:
+                    checkpoint['failed'].pop(str(user_id), None)
+                self._save_checkpoint(options['checkpoint'], checkpoint)
+
+                done += len(saved)
+                failed += len(errors)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'[{done + failed}/{len(user_ids)}] {done} generated, {failed} failed, '
+                    f'{(done + failed) / elapsed:.1f} users/sec'
+                )
+                for user_id, error in errors.items():
+                    self.stderr.write(f'  user {user_id}: {error}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Generated {done} meal plans ({failed} failed) in {elapsed:.1f}s: '
+                f'{len(user_ids) / elapsed:.1f} users/sec'
+            )
+        )
+
+    def _select_users(self, options):
+        users = User.objects.filter(userprofile__isnull=False).order_by('id')
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+        if not options['include_inactive']:
+            users = users.filter(is_active=True)
+        if options['logged_in_within'] is not None:
+            users = users.filter(last_login__gte=timezone.now() - timedelta(days=options['logged_in_within']))
+        return list(users.values_list('id', flat=True))
+
+    def _executor(self, workers, catalog, matrix):
+        shared = pickle.dumps((catalog, matrix))
+        if workers > 0:
+            # Forked workers must not share this process's database connections. With
+            # fork, every worker starts on the first submit, so no query may run between
+            # here and then; connections opened afterwards stay in this process.
+            connections.close_all()
+            return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared,))
+        _init_worker(shared)
+        return _InlineExecutor()
+
+    def _tasks(self, user_ids, num_days, algorithm, seed):
+        """
+        Resolve targets and allowed foods here (database work) for _plan_user.
+
+        Returns:
+            List of (user_id, task), where task is a _plan_user argument or
+            a _Done holding the user's failed result
+        """
+        profiles = UserProfile.objects.filter(user_id__in=user_ids).select_related('user').in_bulk(
+            field_name='user_id'
+        )
+        tasks = []
+        for user_id in user_ids:
+            profile = profiles[user_id]
+            try:
+                allowed_ids = sorted(ConstraintService.get_allowed_food_ids(profile.user))
+                if not allowed_ids:
+                    raise ValueError("No foods available in database. Please seed foods first.")
+            except Exception as e:
+                tasks.append((user_id, _Done((user_id, None, f"{type(e).__name__}: {e}"))))
+                continue
+            targets = MealPlanGenerator.generation_targets(profile, num_days)
+            tasks.append((user_id, (user_id, targets, allowed_ids, num_days, algorithm, seed)))
+        return tasks
+
+    def _submit(self, executor, tasks):
+        """
+        Submit the CPU-bound composition of resolved tasks to the executor.
+
+        Returns:
+            List of (user_id, Future)
+        """
+        return [
+            (user_id, task if isinstance(task, _Done) else executor.submit(_plan_user, task))
+            for user_id, task in tasks
+        ]
+
+    def _write(self, results, catalog, num_days):
+        """
+        Persist a batch of composed plans in one transaction. If the batch
+        fails, users are retried one by one so a bad user cannot block the rest.
+        Plans longer than LONG_PLAN_DAYS are saved one by one, CHUNK_DAYS
+        days at a time (see MealPlanGenerator.persist_days).
+
+        Returns:
+            Tuple (saved user ids, {user id as str: error})
+        """
+        errors = {}
+        plans = []
+        users = User.objects.in_bulk([user_id for user_id, meals, _ in results if meals is not None])
+        start_date = timezone.localdate()
+        if num_days > MealPlanGenerator.LONG_PLAN_DAYS:
+            saved = []
+            for user_id, meals, error in results:
+                if meals is None:
+                    errors[str(user_id)] = error
+                    continue
+                try:
+                    MealPlanGenerator.persist_days(
+                        users[user_id], self._days(meals, catalog), num_days, start_date=start_date
+                    )
+                    saved.append(user_id)
+                except Exception as e:
+                    errors[str(user_id)] = f"{type(e).__name__}: {e}"
+            return saved, errors
+
+        for user_id, meals, error in results:
+            if meals is None:
+                errors[str(user_id)] = error
+                continue
+            planned_meals = [
+                PlannedMeal(name, meal_type, tuple((catalog[food_id], grams) for food_id, grams in portions), day)
+                for name, meal_type, portions, day in meals
+            ]
+            plans.append((users[user_id], planned_meals))
+
+        try:
+            MealPlanGenerator.persist_many(plans, start_date=start_date)
+            return [user.id for user, _ in plans], errors
+        except Exception:
+            pass
+
+        saved = []
+        for user, planned_meals in plans:
+            try:
+                MealPlanGenerator.persist(user, planned_meals, start_date=start_date)
+                saved.append(user.id)
+            except Exception as e:
+                errors[str(user.id)] = f"{type(e).__name__}: {e}"
+        return saved, errors
+
+    def _days(self, meals, catalog):
+        """Rebuild composed meals as (day, list of PlannedMeal), one day at a time."""
+        for day, day_meals in itertools.groupby(meals, key=lambda meal: meal[3]):
+            yield day, [
+                PlannedMeal(name, meal_type, tuple((catalog[food_id], grams) for food_id, grams in portions), day)
+                for name, meal_type, portions, day in day_meals
+            ]
+
+    def _load_checkpoint(self, path):
+        if path and os.path.exists(path):
+            with open(path) as f:
+                checkpoint = json.load(f)
+            checkpoint.setdefault('completed', [])
+            checkpoint.setdefault('failed', {})
+            return checkpoint
+        return {'completed': [], 'failed': {}}
+
+    def _save_checkpoint(self, path, checkpoint):
+        if not path:
+            return
+        # Write then rename so an interrupted run never leaves a truncated file
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, path)
+
+
+class _Done:
+    """Already resolved stand-in for a Future."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _InlineExecutor:
+    """Executor running tasks immediately in the calling process (--workers 0)."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        return _Done(fn(*args))
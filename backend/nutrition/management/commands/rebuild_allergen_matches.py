@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from nutrition.allergen_matches import rebuild
+from nutrition.models import UserAllergy
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the materialized allergen-to-food match table in bulk. '
+        'Run after catalog imports that bypass Food.save() (bulk_create, update, raw SQL).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--include-user-allergies',
+            action='store_true',
+            help='Also register every allergen name currently used in user allergies',
+        )
+
+    def handle(self, *args, **options):
+        allergen_names = []
+        if options['include_user_allergies']:
+            allergen_names = UserAllergy.objects.values_list('allergen_name', flat=True).distinct()
+
+        term_count, match_count = rebuild(allergen_names)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt allergen matches! Terms: {term_count}, Matches: {match_count}'
+            )
+        )
@@ -0,0 +1,68 @@
+import os
+import socket
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from nutrition import plan_jobs, versions
+
+
+class Command(BaseCommand):
+    help = 'Process queued meal plan generation jobs (POST /api/meal-plans/generate/?async=1)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--max-jobs', type=int, help='Exit after processing this many jobs')
+        parser.add_argument(
+            '--stale-after', type=int, default=600,
+            help='Requeue running jobs claimed more than this many seconds ago (default: 600)'
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=plan_jobs.MAX_ATTEMPTS,
+            help=f'Fail stale jobs claimed this many times instead of requeueing them (default: {plan_jobs.MAX_ATTEMPTS})'
+        )
+
+    def handle(self, *args, **options):
+        # Allowed foods, patterns, the constraint index, the food matrix and
+        # generated compositions are invalidated through version stamps; with
+        # a process-local cache the API's bumps never reach this process
+        if not versions.is_shared():
+            raise CommandError(
+                'The plan worker needs a cache shared with the web processes (the default database '
+                'cache or Redis); with a process-local cache it would generate plans from stale constraints.'
+            )
+        if options['max_attempts'] < 1:
+            raise CommandError('--max-attempts must be positive.')
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        stale_after = timedelta(seconds=options['stale_after'])
+        processed = 0
+        self.stdout.write(f'Plan worker {worker} started.')
+
+        while options['max_jobs'] is None or processed < options['max_jobs']:
+            close_old_connections()
+            job = plan_jobs.claim_next(worker)
+            if job is None:
+                requeued, failed = plan_jobs.requeue_stale(stale_after, options['max_attempts'])
+                if failed:
+                    self.stderr.write(f'Failed {failed} stale jobs out of attempts.')
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} stale jobs.')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            started = time.perf_counter()
+            owned = plan_jobs.run(job)
+            processed += 1
+            elapsed = time.perf_counter() - started
+            if not owned:
+                self.stderr.write(f'Job {job.id} was requeued while running; its result was discarded.')
+            elif job.status == job.STATUS_SUCCEEDED:
+                self.stdout.write(f'Job {job.id}: meal plan {job.meal_plan_id} for user {job.user_id} ({elapsed:.2f}s)')
+            else:
+                self.stderr.write(f'Job {job.id} failed: {job.error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Plan worker {worker} processed {processed} jobs.'))
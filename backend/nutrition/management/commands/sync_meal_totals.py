@@ -0,0 +1,106 @@
+from django.core.management.base import BaseCommand, CommandError
+from nutrition.models import Meal, MealPlan, MealPlanDayTotals
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored nutrition totals of meals from their foods, and of meal plans and "
+        "their days from their meals, and fix any drift"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report meals and plans whose stored totals differ; exits with an error if any do',
+        )
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=10,
+            help='Number of drifted meals to list (default: 10)',
+        )
+
+    def handle(self, *args, **options):
+        meal_ids = list(Meal.objects.order_by('id').values_list('id', flat=True))
+        drifted = []
+        for start in range(0, len(meal_ids), BATCH_SIZE):
+            batch = meal_ids[start:start + BATCH_SIZE]
+            computed = Meal.computed_totals(batch)
+            batch_drifted = []
+            for meal_id, *values in Meal.objects.filter(id__in=batch).values_list('id', *Meal.TOTAL_FIELDS):
+                differences = {
+                    field: (value, computed[meal_id][field])
+                    for field, value in zip(Meal.TOTAL_FIELDS, values)
+                    if value != computed[meal_id][field]
+                }
+                if differences:
+                    batch_drifted.append((meal_id, differences))
+            drifted.extend(batch_drifted)
+
+            if not options['verify'] and batch_drifted:
+                Meal.objects.bulk_update(
+                    [Meal(id=meal_id, **computed[meal_id]) for meal_id, _ in batch_drifted],
+                    Meal.TOTAL_FIELDS,
+                    batch_size=BATCH_SIZE,
+                )
+
+        for meal_id, differences in drifted[:options['show']]:
+            details = ', '.join(
+                f'{field} {stored} != {expected}' for field, (stored, expected) in differences.items()
+            )
+            self.stdout.write(f'  meal {meal_id}: {details}')
+
+        # Plans are checked against the (now synced) meal totals
+        meal_plan_ids = list(MealPlan.objects.order_by('id').values_list('id', flat=True))
+        drifted_plans = []
+        for start in range(0, len(meal_plan_ids), BATCH_SIZE):
+            batch = meal_plan_ids[start:start + BATCH_SIZE]
+            batch_drifted = self._drifted_plans(batch)
+            drifted_plans.extend(batch_drifted)
+            if not options['verify'] and batch_drifted:
+                MealPlanDayTotals.rebuild(batch_drifted)
+
+        for meal_plan_id in drifted_plans[:options['show']]:
+            self.stdout.write(f'  meal plan {meal_plan_id}: plan or day totals differ from its meals')
+
+        if options['verify']:
+            if drifted or drifted_plans:
+                raise CommandError(
+                    f'{len(drifted)} of {len(meal_ids)} meals and {len(drifted_plans)} of '
+                    f'{len(meal_plan_ids)} meal plans have drifted totals.'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'All {len(meal_ids)} meals and {len(meal_plan_ids)} meal plans have up-to-date totals.'
+            ))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Synced meal totals! Checked: {len(meal_ids)}, Fixed: {len(drifted)}; '
+                f'meal plans checked: {len(meal_plan_ids)}, fixed: {len(drifted_plans)}'
+            )
+        )
+
+    def _drifted_plans(self, meal_plan_ids):
+        """Ids of meal plans whose stored plan or day totals differ from their meals."""
+        plan_totals, day_totals = MealPlanDayTotals.computed(meal_plan_ids)
+        stored_days = {
+            (meal_plan_id, day): [count, values]
+            for meal_plan_id, day, count, *values in MealPlanDayTotals.objects.filter(
+                meal_plan_id__in=meal_plan_ids
+            ).values_list('meal_plan_id', 'day', 'meal_count', *MealPlanDayTotals.TOTAL_FIELDS)
+        }
+        drifted = {meal_plan_id for meal_plan_id, _ in set(stored_days) ^ set(day_totals)}
+        drifted.update(key[0] for key, row in day_totals.items() if stored_days.get(key) != row)
+        drifted.update(
+            meal_plan_id
+            for meal_plan_id, *values in MealPlan.objects.filter(id__in=meal_plan_ids).values_list(
+                'id', *MealPlan.TOTAL_FIELDS
+            )
+            if values != plan_totals[meal_plan_id]
+        )
+        return sorted(drifted)
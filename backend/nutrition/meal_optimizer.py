@@ -0,0 +1,141 @@
+"""
+Macro-aware portion optimizer for meal slots.
+
+Picks one food per role (protein, carb, vegetable) and the gram quantity of
+each so the meal's calories, protein, carbs and fat land as close as possible
+to the slot targets. Candidates are screened in one vectorized pass over the
+nutrient matrix, then every combination of the best candidates is solved as a
+small bounded least-squares problem in batched numpy computations.
+"""
+
+import itertools
+import time
+import numpy as np
+from django.conf import settings
+from .food_matrix import NUTRIENTS
+
+# Nutrients the optimizer targets, in the order targets are passed
+TARGETS = ('calories', 'protein', 'carbs', 'fat')
+TARGET_COLUMNS = [NUTRIENTS.index(nutrient) for nutrient in TARGETS]
+
+
+class MealOptimizer:
+    """
+    Bounded least-squares portion solver over a fixed set of allowed foods.
+
+    Deviations are measured relative to each target so calories (hundreds) and
+    macros (tens of grams) carry comparable weight; calories are weighted
+    double because they are what the user tracks first.
+    """
+
+    MIN_GRAMS = 30.0
+    MAX_GRAMS = 300.0
+    CANDIDATES_PER_ROLE = 8
+    SWEEPS = 30
+    WEIGHTS = np.array([2.0, 1.0, 1.0, 1.0])
+
+    def __init__(self, pools, matrix, time_budget_ms=None):
+        """
+        Args:
+            pools: FoodRolePools of the allowed foods
+            matrix: FoodMatrix covering those foods
+            time_budget_ms: Upper bound on the time spent per optimize() call;
+                defaults to settings.NUTRITION_OPTIMIZER_TIME_BUDGET_MS
+        """
+        self.foods = pools.foods
+        per_100g = matrix.values[matrix.row_indices([food.id for food in self.foods])]
+        self.per_gram = per_100g[:, TARGET_COLUMNS] / 100.0
+        if time_budget_ms is None:
+            time_budget_ms = settings.NUTRITION_OPTIMIZER_TIME_BUDGET_MS
+        self.time_budget = time_budget_ms / 1000.0
+
+        positions = {food.id: position for position, food in enumerate(self.foods)}
+        self.roles = [
+            np.array([positions[food.id] for food in pool], dtype=np.int64)
+            for pool in (pools.proteins, pools.carbs, pools.vegetables)
+            if pool
+        ]
+        if not self.roles and self.foods:
+            self.roles = [np.arange(len(self.foods))]
+
+    def optimize(self, targets, reference=None, penalties=None):
+        """
+        Choose foods and portions for one meal slot.
+
+        Args:
+            targets: Sequence of (calories, protein, carbs, fat) targets
+            reference: Targets deviations are measured relative to (default:
+                targets); pass the usual slot targets when targets are a
+                leftover budget that may be near zero for some nutrients
+            penalties: Optional cost added per food (array aligned to
+                pools.foods), e.g. VarietyEngine.penalties() to avoid repeats
+
+        Returns:
+            List of (Food, grams) tuples, grams rounded to 2 decimals
+        """
+        if not self.roles:
+            return []
+        deadline = time.perf_counter() + self.time_budget
+
+        targets = np.asarray(targets, dtype=np.float64)
+        reference = targets if reference is None else np.asarray(reference, dtype=np.float64)
+        scale = self.WEIGHTS / np.maximum(reference, 1.0)
+        A = self.per_gram * scale
+        b = targets * scale
+
+        # Screen: best single-food fit of every food, one vectorized pass
+        norms = np.einsum('ij,ij->i', A, A)
+        grams = np.clip((A @ b) / np.maximum(norms, 1e-12), self.MIN_GRAMS, self.MAX_GRAMS)
+        residuals = np.linalg.norm(A * grams[:, None] - b, axis=1)
+        if penalties is not None:
+            residuals = residuals + penalties
+        candidates = [self._top(pool, residuals) for pool in self.roles]
+
+        combos = np.array(
+            [combo for combo in itertools.product(*candidates) if len(set(combo)) == len(combo)],
+            dtype=np.int64,
+        )
+        if not len(combos):
+            combos = np.array([[candidates[0][0]]], dtype=np.int64)
+
+        x, cost = self._solve(A[combos], b, deadline)
+        if penalties is not None:
+            cost = cost + penalties[combos].sum(axis=1)
+        best = int(np.argmin(cost))
+        return [
+            (self.foods[food], round(float(quantity), 2))
+            for food, quantity in zip(combos[best].tolist(), x[best])
+        ]
+
+    def _top(self, pool, residuals):
+        k = min(self.CANDIDATES_PER_ROLE, len(pool))
+        order = np.argpartition(residuals[pool], k - 1)[:k]
+        return pool[order].tolist()
+
+    def _solve(self, M, b, deadline):
+        """
+        Minimize ||x M - b|| subject to MIN_GRAMS <= x <= MAX_GRAMS for every
+        combination at once, by cyclic coordinate descent on the normal
+        equations (each step is an exact, clipped 1-D minimization).
+
+        Args:
+            M: (n_combos, n_foods, n_targets) scaled per-gram nutrients
+            b: (n_targets,) scaled targets
+
+        Returns:
+            Tuple (x, cost) of portions (n_combos, n_foods) and residual norms (n_combos,)
+        """
+        G = M @ M.transpose(0, 2, 1)
+        r = M @ b
+        diagonal = np.maximum(np.diagonal(G, axis1=1, axis2=2), 1e-12)
+        x = np.full(r.shape, self.MIN_GRAMS)
+
+        for _ in range(self.SWEEPS):
+            for i in range(x.shape[1]):
+                partial = r[:, i] - np.einsum('cj,cj->c', G[:, i, :], x) + diagonal[:, i] * x[:, i]
+                x[:, i] = np.clip(partial / diagonal[:, i], self.MIN_GRAMS, self.MAX_GRAMS)
+            if time.perf_counter() > deadline:
+                break
+
+        cost = np.linalg.norm(np.einsum('ci,cij->cj', x, M) - b, axis=1)
+        return x, cost
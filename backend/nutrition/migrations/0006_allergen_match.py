@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0005_userprofile_weight_goals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllergenTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Normalized (lowercased) allergen name', max_length=200, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='calorie_target',
+            field=models.PositiveIntegerField(help_text='Daily calorie target (auto-calculated from BMR and goals)'),
+        ),
+        migrations.CreateModel(
+            name='AllergenMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('allergen_normalized', models.CharField(help_text='Normalized (lowercased) allergen name', max_length=200)),
+                ('food', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allergen_matches', to='nutrition.food')),
+            ],
+            options={
+                'verbose_name_plural': 'Allergen Matches',
+                'unique_together': {('allergen_normalized', 'food')},
+            },
+        ),
+    ]
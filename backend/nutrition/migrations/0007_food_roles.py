@@ -0,0 +1,46 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:05
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def assign_roles(apps, schema_editor):
+    """Backfill the role flags with the thresholds of Food.assign_roles."""
+    Food = apps.get_model('nutrition', 'Food')
+    Food.objects.filter(protein_per_100g__gt=Decimal('15')).update(is_protein_source=True)
+    Food.objects.filter(carbs_per_100g__gt=Decimal('20')).update(is_carb_source=True)
+    Food.objects.filter(
+        calories_per_100g__lt=Decimal('100'), carbs_per_100g__lt=Decimal('20')
+    ).update(is_vegetable=True)
+    Food.objects.filter(fat_per_100g__gt=Decimal('20')).update(is_fat_source=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0006_allergen_match'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='food',
+            name='is_carb_source',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='is_fat_source',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='is_protein_source',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='is_vegetable',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(assign_roles, migrations.RunPython.noop),
+    ]
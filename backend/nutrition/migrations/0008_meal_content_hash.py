@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0007_food_roles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Hash of name, meal type and foods; set on interned meals that may be shared by several meal plans', max_length=64, null=True),
+        ),
+    ]
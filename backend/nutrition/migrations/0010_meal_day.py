@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:11
+
+import re
+from django.db import migrations, models
+
+
+DAY_PATTERN = re.compile(r'\bDay (\d+)$')
+
+
+def backfill_day(apps, schema_editor):
+    """Recover the day of generated meals from their "<Meal> Day <n>" names."""
+    Meal = apps.get_model('nutrition', 'Meal')
+    meals = []
+    for meal in Meal.objects.filter(name__contains='Day ').only('id', 'name'):
+        match = DAY_PATTERN.search(meal.name)
+        if match:
+            meal.day = int(match.group(1))
+            meals.append(meal)
+    Meal.objects.bulk_update(meals, ['day'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0009_plan_generation_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='day',
+            field=models.PositiveIntegerField(blank=True, help_text='Day of the meal plan this meal belongs to (1-based)', null=True),
+        ),
+        migrations.RunPython(backfill_day, migrations.RunPython.noop),
+    ]
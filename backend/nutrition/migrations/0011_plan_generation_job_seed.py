@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0010_meal_day'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plangenerationjob',
+            name='seed',
+            field=models.IntegerField(blank=True, help_text='Variety seed passed to the generator', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0011_plan_generation_job_seed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plangenerationjob',
+            name='start_date',
+            field=models.DateField(blank=True, help_text='First day of the plan; defaults to the day it runs', null=True),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:25
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+
+
+TOTAL_SOURCES = {
+    'total_calories': 'calories_per_100g',
+    'total_protein': 'protein_per_100g',
+    'total_carbs': 'carbs_per_100g',
+    'total_fat': 'fat_per_100g',
+    'total_fiber': 'fiber_per_100g',
+    'total_sugar': 'sugar_per_100g',
+}
+
+
+def backfill_totals(apps, schema_editor):
+    """Compute the totals of existing meals the way Meal.compute_totals does."""
+    Meal = apps.get_model('nutrition', 'Meal')
+    MealFood = apps.get_model('nutrition', 'MealFood')
+    sums = defaultdict(lambda: [Decimal('0')] * len(TOTAL_SOURCES))
+    rows = MealFood.objects.values_list(
+        'meal_id', 'quantity_in_grams', *[f'food__{source}' for source in TOTAL_SOURCES.values()]
+    )
+    for meal_id, quantity, *per_100g in rows.iterator():
+        multiplier = Decimal(str(quantity)) / Decimal('100')
+        for index, value in enumerate(per_100g):
+            if value:
+                sums[meal_id][index] += value * multiplier
+
+    meals = []
+    for meal_id, totals in sums.items():
+        meal = Meal(id=meal_id)
+        for field, total in zip(TOTAL_SOURCES, totals):
+            total = total.quantize(Decimal('0.01'))
+            setattr(meal, field, None if field in ('total_fiber', 'total_sugar') and total <= 0 else total)
+        meals.append(meal)
+    Meal.objects.bulk_update(meals, list(TOTAL_SOURCES), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0012_plan_generation_job_start_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meal',
+            name='total_calories',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_carbs',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_fat',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_fiber',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_protein',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='meal',
+            name='total_sugar',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
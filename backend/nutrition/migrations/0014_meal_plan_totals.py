@@ -0,0 +1,83 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:30
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+TOTAL_FIELDS = ['total_calories', 'total_protein', 'total_carbs', 'total_fat']
+
+
+def backfill_totals(apps, schema_editor):
+    """Sum the stored totals of existing plans' meals per plan and per day."""
+    MealPlan = apps.get_model('nutrition', 'MealPlan')
+    MealPlanDayTotals = apps.get_model('nutrition', 'MealPlanDayTotals')
+    Through = MealPlan.meals.through
+    days = {}
+    plans = {}
+    rows = Through.objects.values_list('mealplan_id', 'meal__day', *[f'meal__{field}' for field in TOTAL_FIELDS])
+    for meal_plan_id, day, *values in rows.iterator():
+        row = days.setdefault((meal_plan_id, day or 0), [0, [Decimal('0')] * len(TOTAL_FIELDS)])
+        row[0] += 1
+        row[1] = [total + value for total, value in zip(row[1], values)]
+        plan = plans.setdefault(meal_plan_id, [Decimal('0')] * len(TOTAL_FIELDS))
+        plans[meal_plan_id] = [total + value for total, value in zip(plan, values)]
+
+    MealPlanDayTotals.objects.bulk_create([
+        MealPlanDayTotals(meal_plan_id=meal_plan_id, day=day, meal_count=count, **dict(zip(TOTAL_FIELDS, totals)))
+        for (meal_plan_id, day), (count, totals) in days.items()
+    ], batch_size=1000)
+    MealPlan.objects.bulk_update(
+        [MealPlan(id=meal_plan_id, **dict(zip(TOTAL_FIELDS, totals))) for meal_plan_id, totals in plans.items()],
+        TOTAL_FIELDS,
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0013_meal_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mealplan',
+            name='total_calories',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='mealplan',
+            name='total_carbs',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='mealplan',
+            name='total_fat',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='mealplan',
+            name='total_protein',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.CreateModel(
+            name='MealPlanDayTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.PositiveIntegerField(help_text='Day of the meal plan (1-based); 0 for meals without a day')),
+                ('meal_count', models.PositiveIntegerField(default=0)),
+                ('total_calories', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_protein', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_carbs', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_fat', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('meal_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_totals', to='nutrition.mealplan')),
+            ],
+            options={
+                'verbose_name_plural': 'Meal Plan Day Totals',
+                'ordering': ['meal_plan', 'day'],
+                'constraints': [models.UniqueConstraint(fields=('meal_plan', 'day'), name='unique_meal_plan_day_totals')],
+            },
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
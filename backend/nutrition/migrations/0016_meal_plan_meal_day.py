@@ -0,0 +1,82 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def place_meals_on_days(apps, schema_editor):
+    """Copy every meal's day to its plan links; interned meals keep it only there."""
+    Meal = apps.get_model('nutrition', 'Meal')
+    MealPlanMeal = apps.get_model('nutrition', 'MealPlanMeal')
+    MealPlanMeal.objects.update(day=Subquery(Meal.objects.filter(pk=OuterRef('meal_id')).values('day')))
+    Meal.objects.filter(content_hash__isnull=False).update(day=None)
+
+
+def restore_meal_days(apps, schema_editor):
+    """Give interned meals back the first day they are placed on."""
+    Meal = apps.get_model('nutrition', 'Meal')
+    MealPlanMeal = apps.get_model('nutrition', 'MealPlanMeal')
+    Meal.objects.filter(content_hash__isnull=False).update(day=Subquery(
+        MealPlanMeal.objects.filter(meal_id=OuterRef('pk')).order_by('day').values('day')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition', '0015_cache_table'),
+    ]
+
+    operations = [
+        # The implicit through table becomes MealPlanMeal as it is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='MealPlanMeal',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('mealplan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meal_links', to='nutrition.mealplan')),
+                        ('meal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plan_links', to='nutrition.meal')),
+                    ],
+                    options={
+                        'db_table': 'nutrition_mealplan_meals',
+                        'unique_together': {('mealplan', 'meal')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='mealplan',
+                    name='meals',
+                    field=models.ManyToManyField(related_name='meal_plans', through='nutrition.MealPlanMeal', to='nutrition.meal'),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='mealplanmeal',
+            name='id',
+            field=models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+        ),
+        migrations.AddField(
+            model_name='mealplanmeal',
+            name='day',
+            field=models.PositiveIntegerField(blank=True, help_text='Day of the meal plan (1-based); empty for meals without a day', null=True),
+        ),
+        migrations.AlterField(
+            model_name='meal',
+            name='day',
+            field=models.PositiveIntegerField(blank=True, help_text='Plan day (1-based) of a meal written by hand, used for the plans it is added to; interned meals have none, their day is on each plan link', null=True),
+        ),
+        migrations.AlterField(
+            model_name='meal',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Hash of meal type and foods; set on interned meals that may be shared by several meal plans and days', max_length=64, null=True),
+        ),
+        migrations.RunPython(place_meals_on_days, restore_meal_days),
+        # The same meal can now be placed on several days of a plan
+        migrations.AlterUniqueTogether(
+            name='mealplanmeal',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='mealplanmeal',
+            constraint=models.UniqueConstraint(fields=('mealplan', 'meal', 'day'), name='unique_meal_plan_meal_day'),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from datetime import timedelta
 from decimal import Decimal
+import hashlib
 
 # Create your models here.
 
@@ -117,12 +119,54 @@ class Food(models.Model):
         help_text="Sugar in grams per 100g (optional)"
     )
     categories = models.ManyToManyField(FoodCategory, blank=True, related_name='foods', help_text="Dietary categories/tags for this food")
+
+    # Meal slot roles, derived from the nutrient values on every save (see assign_roles).
+    # Any food can be used as a filler, so fillers have no flag.
+    is_protein_source = models.BooleanField(default=False, editable=False, db_index=True)
+    is_carb_source = models.BooleanField(default=False, editable=False, db_index=True)
+    is_vegetable = models.BooleanField(default=False, editable=False, db_index=True)
+    is_fat_source = models.BooleanField(default=False, editable=False, db_index=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Role thresholds (per 100g)
+    PROTEIN_SOURCE_MIN_PROTEIN = Decimal('15')
+    CARB_SOURCE_MIN_CARBS = Decimal('20')
+    VEGETABLE_MAX_CALORIES = Decimal('100')
+    VEGETABLE_MAX_CARBS = Decimal('20')
+    FAT_SOURCE_MIN_FAT = Decimal('20')
+
+    ROLE_FIELDS = ['is_protein_source', 'is_carb_source', 'is_vegetable', 'is_fat_source']
+    NUTRIENT_FIELDS = ['calories_per_100g', 'protein_per_100g', 'carbs_per_100g', 'fat_per_100g']
+
     def __str__(self):
         return self.name
 
+    def assign_roles(self):
+        """
+        Derive the meal slot role flags from the nutrient values.
+
+        Called from save(); bulk_create and QuerySet.update bypass it, so
+        callers writing foods in bulk must call it themselves.
+        """
+        protein = Decimal(str(self.protein_per_100g))
+        carbs = Decimal(str(self.carbs_per_100g))
+        self.is_protein_source = protein > self.PROTEIN_SOURCE_MIN_PROTEIN
+        self.is_carb_source = carbs > self.CARB_SOURCE_MIN_CARBS
+        self.is_vegetable = (
+            Decimal(str(self.calories_per_100g)) < self.VEGETABLE_MAX_CALORIES
+            and carbs < self.VEGETABLE_MAX_CARBS
+        )
+        self.is_fat_source = Decimal(str(self.fat_per_100g)) > self.FAT_SOURCE_MIN_FAT
+
+    def save(self, *args, **kwargs):
+        self.assign_roles()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.NUTRIENT_FIELDS):
+            kwargs['update_fields'] = set(update_fields) | set(self.ROLE_FIELDS)
+        super().save(*args, **kwargs)
+
     def calculate_nutrition(self, quantity_grams):
         """
         Calculate nutrition for a given quantity in grams.
@@ -142,6 +186,69 @@ class Food(models.Model):
         }
 
 
+def _nutrient_sum(meal_foods, source):
+    """
+    Correlated subquery summing quantity_in_grams * source / 100 over
+    meal_foods. SUM is applied as a plain function so the subquery has no
+    GROUP BY and always yields exactly one row.
+    """
+    decimal = models.DecimalField(max_digits=12, decimal_places=2)
+    return models.Subquery(
+        meal_foods.order_by().annotate(
+            total=models.Func(
+                # Scaled by 0.01 rather than divided by 100, which SQLite does as integer division
+                models.F('quantity_in_grams') * models.F(source) * models.Value(Decimal('0.01'), output_field=decimal),
+                function='SUM',
+                output_field=decimal,
+            )
+        ).values('total'),
+        output_field=decimal,
+    )
+
+
+class MealQuerySet(models.QuerySet):
+    def with_nutrition(self):
+        """
+        Annotate every meal with its totals summed in SQL from its current
+        MealFood rows, as nutrition_<nutrient> (see Meal.annotated_nutrition).
+
+        Each total is a correlated subquery, so the annotation combines with
+        any filter or prefetch without multiplying rows.
+        """
+        meal_foods = MealFood.objects.filter(meal=models.OuterRef('pk'))
+        return self.annotate(**{
+            f'nutrition_{field[len("total_"):]}': _nutrient_sum(meal_foods, f'food__{source}')
+            for field, source in Meal.TOTAL_SOURCES.items()
+        })
+
+    def for_api(self, computed_totals=False):
+        """
+        Prefetch what MealSerializer reads of every meal (its MealFood rows,
+        their foods and the foods' categories), so any number of meals is
+        serialized in a constant number of queries.
+
+        Args:
+            computed_totals: Also annotate the totals summed in SQL (with_nutrition)
+        """
+        queryset = self.prefetch_related('mealfood_set__food__categories')
+        return queryset.with_nutrition() if computed_totals else queryset
+
+
+class MealPlanQuerySet(models.QuerySet):
+    def with_nutrition(self):
+        """
+        Annotate every plan with its calorie and macro totals summed in SQL
+        from the MealFood rows of its meals, as nutrition_<nutrient> (see
+        MealPlan.annotated_nutrition). The stored plan totals add up rounded
+        meal totals, so the two can differ by a few hundredths.
+        """
+        meal_foods = MealFood.objects.filter(meal__meal_plans=models.OuterRef('pk'))
+        return self.annotate(**{
+            f'nutrition_{field[len("total_"):]}': _nutrient_sum(meal_foods, f'food__{Meal.TOTAL_SOURCES[field]}')
+            for field in MealPlan.TOTAL_FIELDS
+        })
+
+
 class Meal(models.Model):
     """
     Meal model representing a single meal (breakfast, lunch, dinner, snack).
@@ -157,16 +264,217 @@ class Meal(models.Model):
     name = models.CharField(max_length=100)
     meal_type = models.CharField(max_length=20, choices=MEAL_TYPE_CHOICES, default='breakfast')
     foods = models.ManyToManyField(Food, through='MealFood', related_name='meals')
+    day = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Plan day (1-based) of a meal written by hand, used for the plans it is added to; "
+                  "interned meals have none, their day is on each plan link"
+    )
+    content_hash = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="Hash of meal type and foods; set on interned meals that may be shared by several meal plans and days"
+    )
+    # Nutrition totals of the meal's foods, recomputed whenever its MealFood rows change
+    total_calories = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_protein = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_carbs = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_fat = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_fiber = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    total_sugar = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MealQuerySet.as_manager()
+
+    # Stored total -> the Food field it sums
+    TOTAL_SOURCES = {
+        'total_calories': 'calories_per_100g',
+        'total_protein': 'protein_per_100g',
+        'total_carbs': 'carbs_per_100g',
+        'total_fat': 'fat_per_100g',
+        'total_fiber': 'fiber_per_100g',
+        'total_sugar': 'sugar_per_100g',
+    }
+    TOTAL_FIELDS = list(TOTAL_SOURCES)
+    # Totals that are None rather than 0 when no food contributes
+    OPTIONAL_TOTALS = ('total_fiber', 'total_sugar')
+
     def __str__(self):
         return f"{self.name} ({self.meal_type})"
 
+    @classmethod
+    def compute_totals(cls, items):
+        """
+        Compute the stored totals of a composition.
+
+        Args:
+            items: Iterable of (quantity_in_grams, per-100g values in TOTAL_SOURCES order)
+
+        Returns:
+            Dictionary of TOTAL_FIELDS to Decimals rounded to 2 places
+        """
+        sums = [Decimal('0')] * len(cls.TOTAL_FIELDS)
+        for quantity, per_100g in items:
+            multiplier = Decimal(str(quantity)) / Decimal('100')
+            for index, value in enumerate(per_100g):
+                if value:
+                    sums[index] += value * multiplier
+
+        totals = {}
+        for field, total in zip(cls.TOTAL_FIELDS, sums):
+            total = total.quantize(Decimal('0.01'))
+            totals[field] = None if field in cls.OPTIONAL_TOTALS and total <= 0 else total
+        return totals
+
+    @classmethod
+    def totals_for_portions(cls, portions):
+        """Stored totals of (Food, grams) pairs; see compute_totals."""
+        return cls.compute_totals(
+            (grams, [getattr(food, source) for source in cls.TOTAL_SOURCES.values()])
+            for food, grams in portions
+        )
+
+    @classmethod
+    def computed_totals(cls, meal_ids):
+        """
+        Compute the totals of meals from their current MealFood rows.
+
+        Returns:
+            Dictionary of meal id to compute_totals() result
+        """
+        meal_ids = list(meal_ids)
+        items = {meal_id: [] for meal_id in meal_ids}
+        fields = [f'food__{source}' for source in cls.TOTAL_SOURCES.values()]
+        for start in range(0, len(meal_ids), 1000):
+            rows = MealFood.objects.filter(meal_id__in=meal_ids[start:start + 1000]).values_list(
+                'meal_id', 'quantity_in_grams', *fields
+            )
+            for meal_id, quantity, *per_100g in rows:
+                items[meal_id].append((quantity, per_100g))
+        return {meal_id: cls.compute_totals(meal_items) for meal_id, meal_items in items.items()}
+
+    @classmethod
+    def refresh_totals(cls, meal_ids):
+        """
+        Recompute and save the stored totals of meals in bulk, after their
+        MealFood rows (or the nutrients of their foods) changed. The totals
+        of the meal plans and plan days containing them are adjusted by the
+        difference.
+
+        Args:
+            meal_ids: Iterable of Meal ids
+        """
+        computed = cls.computed_totals(meal_ids)
+        if not computed:
+            return
+        with transaction.atomic():
+            previous = {
+                meal_id: values
+                for meal_id, *values in cls.objects.filter(id__in=list(computed)).values_list(
+                    'id', *MealPlan.TOTAL_FIELDS
+                )
+            }
+            meals = [Meal(id=meal_id, **totals) for meal_id, totals in computed.items()]
+            cls.objects.bulk_update(meals, cls.TOTAL_FIELDS, batch_size=1000)
+
+            deltas = {}
+            for meal_id, values in previous.items():
+                delta = [computed[meal_id][field] - value for field, value in zip(MealPlan.TOTAL_FIELDS, values)]
+                if any(delta):
+                    deltas[meal_id] = delta
+            if deltas:
+                MealPlanDayTotals.apply(MealPlanDayTotals.changes_for_links(
+                    MealPlanMeal.objects.filter(meal_id__in=list(deltas)).values_list('mealplan_id', 'meal_id', 'day'),
+                    lambda meal_id: (0, deltas[meal_id]),
+                ))
+
+    @property
+    def total_nutrition(self):
+        """Stored totals, shaped like calculate_total_nutrition."""
+        return {
+            field[len('total_'):]: None if getattr(self, field) is None else float(getattr(self, field))
+            for field in self.TOTAL_FIELDS
+        }
+
+    def annotated_nutrition(self):
+        """
+        Totals annotated by MealQuerySet.with_nutrition(), shaped like
+        total_nutrition, or None if the meal was not loaded with them.
+        """
+        if not hasattr(self, 'nutrition_calories'):
+            return None
+        nutrition = {}
+        for field in self.TOTAL_FIELDS:
+            nutrient = field[len('total_'):]
+            value = getattr(self, f'nutrition_{nutrient}')
+            if field in self.OPTIONAL_TOTALS:
+                nutrition[nutrient] = round(float(value), 2) if value is not None and value > 0 else None
+            else:
+                nutrition[nutrient] = round(float(value or 0), 2)
+        return nutrition
+
+    @staticmethod
+    def compute_content_hash(meal_type, items):
+        """
+        Hash a meal composition independently of the order of its foods.
+
+        Neither the name nor the day is part of the hash: the day a meal is
+        eaten on is kept on its plan link (MealPlanMeal), so identical meals
+        on different days, or in different plans, share one row.
+
+        Args:
+            meal_type: Meal type
+            items: Iterable of (food_id, quantity_in_grams) pairs
+
+        Returns:
+            Hex SHA-256 digest
+        """
+        foods = ';'.join(
+            f"{food_id}:{Decimal(str(quantity)).quantize(Decimal('0.01'))}"
+            for food_id, quantity in sorted(items)
+        )
+        return hashlib.sha256(f"{meal_type}|{foods}".encode()).hexdigest()
+
+    def is_shared(self):
+        """Return whether more than one meal plan references this meal."""
+        return self.meal_plans.distinct().count() > 1
+
+    def copy_for_plan(self, meal_plan):
+        """
+        Replace this meal in one meal plan by a private copy (copy-on-write).
+
+        Args:
+            meal_plan: MealPlan containing this meal
+
+        Returns:
+            The new Meal, referenced only by meal_plan, on the same days
+        """
+        with transaction.atomic():
+            copy = Meal.objects.create(
+                name=self.name,
+                meal_type=self.meal_type,
+                day=self.day,
+                **{field: getattr(self, field) for field in self.TOTAL_FIELDS},
+            )
+            MealFood.objects.bulk_create([
+                MealFood(meal=copy, food_id=meal_food.food_id, quantity_in_grams=meal_food.quantity_in_grams)
+                for meal_food in self.mealfood_set.all()
+            ])
+            # Same totals on the same days, so the plan and day totals stay as they are
+            MealPlanMeal.objects.filter(mealplan=meal_plan, meal=self).update(meal=copy)
+        return copy
+
     def calculate_total_nutrition(self):
         """
         Calculate total nutrition for the meal by summing all foods.
         Returns a dictionary with total nutritional values.
+
+        Reads every food of the meal; API responses use the stored
+        total_nutrition instead.
         """
         total_calories = 0
         total_protein = 0
@@ -218,12 +526,22 @@ class MealPlan(models.Model):
     Can optionally have a date range for planning.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meal_plans')
-    meals = models.ManyToManyField(Meal, related_name='meal_plans')
+    meals = models.ManyToManyField(Meal, through='MealPlanMeal', related_name='meal_plans')
     start_date = models.DateField(null=True, blank=True, help_text="Optional start date for the meal plan")
     end_date = models.DateField(null=True, blank=True, help_text="Optional end date for the meal plan")
+    # Nutrition totals of all meals of the plan, adjusted whenever meals are
+    # added, removed or change; MealPlanDayTotals holds the same per day
+    total_calories = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    total_protein = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    total_carbs = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    total_fat = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MealPlanQuerySet.as_manager()
+
+    TOTAL_FIELDS = ['total_calories', 'total_protein', 'total_carbs', 'total_fat']
+
     def __str__(self):
         date_range = ""
         if self.start_date and self.end_date:
@@ -232,18 +550,81 @@ class MealPlan(models.Model):
             date_range = f" (from {self.start_date})"
         return f"Meal Plan for {self.user.username}{date_range}"
 
+    # Plans spanning more days than this are not nested in full in API
+    # responses; their meals are read a page of days at a time
+    NESTED_MEALS_MAX_DAYS = 31
+
+    @property
+    def num_days(self):
+        """Days from start_date to end_date inclusive, or None unless both are set."""
+        if self.start_date and self.end_date:
+            return (self.end_date - self.start_date).days + 1
+        return None
+
+    def nests_meals(self):
+        """Whether API responses include the plan's meals in full."""
+        return self.num_days is None or self.num_days <= self.NESTED_MEALS_MAX_DAYS
+
+    def day_of(self, date):
+        """Plan day (1-based, as in MealPlanMeal.day) of a calendar date; needs start_date."""
+        return (date - self.start_date).days + 1
+
+    def date_of(self, day):
+        """Calendar date of a plan day (1-based), or None without a start_date."""
+        if self.start_date is None:
+            return None
+        return self.start_date + timedelta(days=day - 1)
+
+    @staticmethod
+    def prefetch_meals(meal_plans, computed_totals=False):
+        """
+        Load what MealPlanSerializer nests of meal_plans (see
+        MealQuerySet.for_api) in a constant number of queries however many
+        plans and meals there are. Plans whose meals are not nested, and
+        plans whose meals are already cached, are skipped.
+
+        Args:
+            meal_plans: MealPlan instances
+            computed_totals: Also annotate the meals' totals summed in SQL
+        """
+        models.prefetch_related_objects(
+            [meal_plan for meal_plan in meal_plans if meal_plan.nests_meals()],
+            models.Prefetch('meal_links', queryset=MealPlanMeal.objects.for_api(computed_totals)),
+        )
+
+    @property
+    def total_nutrition(self):
+        """Stored totals, shaped like calculate_total_nutrition."""
+        return {field[len('total_'):]: float(getattr(self, field)) or 0.0 for field in self.TOTAL_FIELDS}
+
+    def annotated_nutrition(self):
+        """
+        Totals annotated by MealPlanQuerySet.with_nutrition(), shaped like
+        total_nutrition, or None if the plan was not loaded with them.
+        """
+        if not hasattr(self, 'nutrition_calories'):
+            return None
+        return {
+            field[len('total_'):]: round(float(getattr(self, f"nutrition_{field[len('total_'):]}") or 0), 2)
+            for field in self.TOTAL_FIELDS
+        }
 
     def calculate_total_nutrition(self):
         """
         Calculate total nutrition for the entire meal plan.
+
+        Reads every meal of the plan, once per day it is placed on (unless
+        prefetch_meals loaded them); API responses use the stored
+        total_nutrition instead.
         """
         total_calories = 0
         total_protein = 0
         total_carbs = 0
         total_fat = 0
 
-        for meal in self.meals.all():
-            nutrition = meal.calculate_total_nutrition()
+        models.prefetch_related_objects([self], 'meal_links__meal')
+        for link in self.meal_links.all():
+            nutrition = link.meal.total_nutrition
             total_calories += nutrition['calories']
             total_protein += nutrition['protein']
             total_carbs += nutrition['carbs']
@@ -257,6 +638,240 @@ class MealPlan(models.Model):
         }
 
 
+class MealPlanMealQuerySet(models.QuerySet):
+    def for_api(self, computed_totals=False):
+        """
+        Order plan links by day and prefetch their meals the way
+        MealQuerySet.for_api does, so any number of a plan's meals is
+        serialized in a constant number of queries.
+
+        Args:
+            computed_totals: Also annotate the meals' totals summed in SQL
+        """
+        return self.order_by('day', 'id').prefetch_related(
+            models.Prefetch('meal', queryset=Meal.objects.for_api(computed_totals))
+        )
+
+
+class MealPlanMeal(models.Model):
+    """
+    Through model placing a Meal on one day of a MealPlan. An interned meal
+    can be placed on several days of the same plan.
+    """
+    mealplan = models.ForeignKey(MealPlan, on_delete=models.CASCADE, related_name='meal_links')
+    meal = models.ForeignKey(Meal, on_delete=models.CASCADE, related_name='plan_links')
+    day = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Day of the meal plan (1-based); empty for meals without a day"
+    )
+
+    objects = MealPlanMealQuerySet.as_manager()
+
+    class Meta:
+        # The table of the implicit through model this one replaced
+        db_table = 'nutrition_mealplan_meals'
+        constraints = [
+            models.UniqueConstraint(fields=['mealplan', 'meal', 'day'], name='unique_meal_plan_meal_day'),
+        ]
+
+    def __str__(self):
+        return f"Meal plan {self.mealplan_id} day {self.day}: {self.meal_id}"
+
+
+class MealPlanDayTotals(models.Model):
+    """
+    Nutrition totals of the meals of one day of a meal plan.
+
+    Rows are adjusted incrementally (see apply) rather than recomputed, so
+    reading a plan's per-day totals is one indexed query. Meals without a
+    day are counted under day NO_DAY.
+    """
+    NO_DAY = 0
+
+    meal_plan = models.ForeignKey(MealPlan, on_delete=models.CASCADE, related_name='day_totals')
+    day = models.PositiveIntegerField(help_text="Day of the meal plan (1-based); 0 for meals without a day")
+    meal_count = models.PositiveIntegerField(default=0)
+    total_calories = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_protein = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_carbs = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_fat = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    TOTAL_FIELDS = MealPlan.TOTAL_FIELDS
+
+    class Meta:
+        verbose_name_plural = "Meal Plan Day Totals"
+        ordering = ['meal_plan', 'day']
+        constraints = [
+            models.UniqueConstraint(fields=['meal_plan', 'day'], name='unique_meal_plan_day_totals'),
+        ]
+
+    def __str__(self):
+        return f"Meal plan {self.meal_plan_id} day {self.day}: {self.total_calories} kcal"
+
+    @property
+    def total_nutrition(self):
+        return {field[len('total_'):]: float(getattr(self, field)) or 0.0 for field in self.TOTAL_FIELDS}
+
+    @classmethod
+    def summarize(cls, placements):
+        """
+        Totals of the meals of a plan that is not saved yet.
+
+        Args:
+            placements: (Meal, day) pairs, meals with their stored totals loaded
+
+        Returns:
+            Tuple (plan totals as MealPlan field values, list of unsaved
+            rows without meal_plan)
+        """
+        changes = cls.changes_for_meals(None, placements)
+        plan_totals = [sum(values, Decimal('0')) for values in zip(*(delta for _, delta in changes.values()))]
+        rows = [
+            cls(day=day, meal_count=count, **dict(zip(cls.TOTAL_FIELDS, delta)))
+            for (_, day), (count, delta) in sorted(changes.items())
+        ]
+        return dict(zip(cls.TOTAL_FIELDS, plan_totals or [Decimal('0')] * len(cls.TOTAL_FIELDS))), rows
+
+    @classmethod
+    def changes_for_meals(cls, meal_plan_id, placements, sign=1, changes=None):
+        """
+        Changes adding (sign=1) or removing (sign=-1) meals to or from days of a plan.
+
+        Args:
+            meal_plan_id: Id of the MealPlan
+            placements: (Meal, day) pairs, meals with their stored totals loaded
+            changes: Changes to add to (default: a new dictionary)
+
+        Returns:
+            Dictionary for apply()
+        """
+        changes = {} if changes is None else changes
+        for meal, day in placements:
+            cls._add_change(changes, meal_plan_id, day, sign, [
+                sign * getattr(meal, field) for field in cls.TOTAL_FIELDS
+            ])
+        return changes
+
+    @classmethod
+    def changes_for_links(cls, links, change_of_meal):
+        """
+        Changes for (meal_plan_id, meal_id, day) plan links.
+
+        Args:
+            links: Iterable of (meal_plan_id, meal_id, day)
+            change_of_meal: Callable returning (meal count delta, totals
+                delta in TOTAL_FIELDS order) of a meal id
+
+        Returns:
+            Dictionary for apply()
+        """
+        changes = {}
+        for meal_plan_id, meal_id, day in links:
+            count, delta = change_of_meal(meal_id)
+            cls._add_change(changes, meal_plan_id, day, count, delta)
+        return changes
+
+    @classmethod
+    def _add_change(cls, changes, meal_plan_id, day, count, delta):
+        change = changes.setdefault((meal_plan_id, day or cls.NO_DAY), [0, [Decimal('0')] * len(cls.TOTAL_FIELDS)])
+        change[0] += count
+        change[1] = [total + value for total, value in zip(change[1], delta)]
+
+    @classmethod
+    def apply(cls, changes):
+        """
+        Add changes to the stored plan and day totals.
+
+        The plans' rows are locked first, so concurrent changes to the same
+        plan run one after the other: a day row cannot be inserted twice,
+        and F() updates make the changes add up instead of overwriting each
+        other. Day rows left without meals are deleted.
+
+        Args:
+            changes: Dictionary of (meal_plan_id, day) to [meal count delta,
+                list of totals deltas in TOTAL_FIELDS order]
+        """
+        changes = {key: change for key, change in changes.items() if change[0] or any(change[1])}
+        if not changes:
+            return
+        plan_deltas = {}
+        for (meal_plan_id, _), (_, delta) in changes.items():
+            totals = plan_deltas.get(meal_plan_id, [Decimal('0')] * len(cls.TOTAL_FIELDS))
+            plan_deltas[meal_plan_id] = [total + value for total, value in zip(totals, delta)]
+
+        with transaction.atomic():
+            # Locked in id order so two writers cannot deadlock on each other's plans
+            list(MealPlan.objects.select_for_update().filter(id__in=plan_deltas).order_by('id').values_list('id'))
+            existing = set(
+                cls.objects.filter(meal_plan_id__in=list(plan_deltas), day__in={day for _, day in changes})
+                .values_list('meal_plan_id', 'day')
+            )
+            for key in existing & set(changes):
+                count, delta = changes[key]
+                cls.objects.filter(meal_plan_id=key[0], day=key[1]).update(
+                    meal_count=models.F('meal_count') + count,
+                    **{field: models.F(field) + value for field, value in zip(cls.TOTAL_FIELDS, delta)},
+                )
+            cls.objects.bulk_create([
+                cls(meal_plan_id=meal_plan_id, day=day, meal_count=count, **dict(zip(cls.TOTAL_FIELDS, delta)))
+                for (meal_plan_id, day), (count, delta) in changes.items()
+                if (meal_plan_id, day) not in existing and count > 0
+            ], batch_size=1000)
+            if any(count < 0 for count, _ in changes.values()):
+                cls.objects.filter(meal_plan_id__in=list(plan_deltas), meal_count=0).delete()
+
+            for meal_plan_id, delta in plan_deltas.items():
+                if any(delta):
+                    MealPlan.objects.filter(id=meal_plan_id).update(
+                        **{field: models.F(field) + value for field, value in zip(cls.TOTAL_FIELDS, delta)}
+                    )
+
+    @classmethod
+    def computed(cls, meal_plan_ids):
+        """
+        Compute the plan and day totals of meal plans from the stored totals
+        of their meals.
+
+        Returns:
+            Tuple (dictionary of meal plan id to plan totals in TOTAL_FIELDS
+            order, dictionary of (meal plan id, day) to [meal count, totals])
+        """
+        meal_plan_ids = list(meal_plan_ids)
+        links = MealPlanMeal.objects.filter(mealplan_id__in=meal_plan_ids).values_list(
+            'mealplan_id', 'day', *(f'meal__{field}' for field in cls.TOTAL_FIELDS)
+        )
+        changes = {}
+        for meal_plan_id, day, *values in links.iterator():
+            cls._add_change(changes, meal_plan_id, day, 1, values)
+        plan_totals = {meal_plan_id: [Decimal('0')] * len(cls.TOTAL_FIELDS) for meal_plan_id in meal_plan_ids}
+        for (meal_plan_id, _), (_, values) in changes.items():
+            plan_totals[meal_plan_id] = [total + value for total, value in zip(plan_totals[meal_plan_id], values)]
+        return plan_totals, changes
+
+    @classmethod
+    def rebuild(cls, meal_plan_ids):
+        """
+        Recompute the plan and day totals of meal plans from the stored
+        totals of their meals, replacing whatever was stored.
+        """
+        meal_plan_ids = list(meal_plan_ids)
+        plan_totals, changes = cls.computed(meal_plan_ids)
+
+        with transaction.atomic():
+            cls.objects.filter(meal_plan_id__in=meal_plan_ids).delete()
+            cls.objects.bulk_create([
+                cls(meal_plan_id=meal_plan_id, day=day, meal_count=count, **dict(zip(cls.TOTAL_FIELDS, values)))
+                for (meal_plan_id, day), (count, values) in changes.items()
+            ], batch_size=1000)
+            MealPlan.objects.bulk_update(
+                [
+                    MealPlan(id=meal_plan_id, **dict(zip(cls.TOTAL_FIELDS, totals)))
+                    for meal_plan_id, totals in plan_totals.items()
+                ],
+                cls.TOTAL_FIELDS,
+                batch_size=1000,
+            )
+
+
 class DietaryPattern(models.Model):
     """
     Dietary patterns that users can follow.
@@ -368,4 +983,75 @@ class UserFoodDislike(models.Model):
         ordering = ['food__name']
     
     def __str__(self):
-        return f"{self.user.username} dislikes {self.food.name}"
\ No newline at end of file
+        return f"{self.user.username} dislikes {self.food.name}"
+
+
+class AllergenTerm(models.Model):
+    """
+    Distinct normalized free-text allergen whose matches are materialized in AllergenMatch.
+    A term exists once its matches against the whole catalog have been computed.
+    """
+    name = models.CharField(max_length=200, unique=True, help_text="Normalized (lowercased) allergen name")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+
+
+class AllergenMatch(models.Model):
+    """
+    Materialized match between a free-text allergen and a food whose name contains it.
+    Lets constraint queries exclude allergens with one indexed join instead of LIKE scans.
+    """
+    allergen_normalized = models.CharField(max_length=200, help_text="Normalized (lowercased) allergen name")
+    food = models.ForeignKey(Food, on_delete=models.CASCADE, related_name='allergen_matches')
+    
+    class Meta:
+        verbose_name_plural = "Allergen Matches"
+        unique_together = [['allergen_normalized', 'food']]
+    
+    def __str__(self):
+        return f"{self.allergen_normalized} in {self.food_id}"
+
+
+class PlanGenerationJob(models.Model):
+    """
+    Queued meal plan generation, processed by the run_plan_worker command.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='plan_generation_jobs')
+    num_days = models.PositiveIntegerField(default=1)
+    algorithm = models.CharField(max_length=20, default='greedy')
+    seed = models.IntegerField(null=True, blank=True, help_text="Variety seed passed to the generator")
+    start_date = models.DateField(null=True, blank=True, help_text="First day of the plan; defaults to the day it runs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    meal_plan = models.ForeignKey(
+        MealPlan, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs',
+        help_text="Generated meal plan once the job succeeded"
+    )
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=200, blank=True, help_text="Worker that claimed the job")
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Plan job {self.id} for {self.user.username} ({self.status})"
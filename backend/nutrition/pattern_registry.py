@@ -0,0 +1,130 @@
+"""
+Process-wide registry of compiled dietary patterns.
+
+Dietary patterns and food categories are managed through the admin and almost
+never change, so they are compiled once into an immutable mapping and served
+from memory. The registry reloads itself when the patterns version stamp is
+bumped (see signals.py).
+"""
+
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+from .models import DietaryPattern
+from . import versions
+
+
+class CompiledPattern(NamedTuple):
+    """A dietary pattern with its excluded categories resolved."""
+    id: int
+    name: str
+    display_name: str
+    description: str
+    excluded_category_ids: frozenset
+    # (id, name, display_name, description) tuples, ordered like FoodCategory
+    excluded_categories: tuple
+
+    def serialize(self):
+        """Return the same structure DietaryPatternSerializer produces."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'excluded_categories': [
+                {'id': category_id, 'name': name, 'description': description}
+                for category_id, name, _, description in self.excluded_categories
+            ],
+        }
+
+
+class PatternRegistry:
+    """
+    Immutable snapshot of all dietary patterns keyed by id.
+    """
+
+    def __init__(self, patterns, version=None):
+        self.patterns = MappingProxyType({pattern.id: pattern for pattern in patterns})
+        self.version = version
+
+    @classmethod
+    def load(cls, version=None):
+        """
+        Compile every dietary pattern from the database (two queries).
+
+        Args:
+            version: Patterns version stamp the snapshot corresponds to
+
+        Returns:
+            PatternRegistry instance
+        """
+        patterns = []
+        for pattern in DietaryPattern.objects.prefetch_related('excluded_categories'):
+            categories = tuple(
+                (category.id, category.name, category.get_name_display(), category.description)
+                for category in pattern.excluded_categories.all()
+            )
+            patterns.append(CompiledPattern(
+                id=pattern.id,
+                name=pattern.name,
+                display_name=pattern.get_name_display(),
+                description=pattern.description,
+                excluded_category_ids=frozenset(category[0] for category in categories),
+                excluded_categories=categories,
+            ))
+        return cls(patterns, version)
+
+    def get(self, pattern_id):
+        """Return the CompiledPattern for an id, or None if it does not exist."""
+        return self.patterns.get(pattern_id)
+
+    def has_all(self, pattern_ids):
+        """Whether every id of pattern_ids is in the registry."""
+        return all(pattern_id in self.patterns for pattern_id in pattern_ids)
+
+    def all(self):
+        """Return all patterns in DietaryPattern ordering (by name)."""
+        return sorted(self.patterns.values(), key=lambda pattern: pattern.name)
+
+    def excluded_category_ids(self, pattern_ids):
+        """Return the union of excluded category ids for the given patterns."""
+        excluded = set()
+        for pattern_id in pattern_ids:
+            pattern = self.patterns.get(pattern_id)
+            if pattern is not None:
+                excluded |= pattern.excluded_category_ids
+        return excluded
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(pattern_ids=()):
+    """
+    Return the process-wide registry, reloading it when the patterns version
+    changed or when it lacks one of pattern_ids.
+
+    Pass the pattern ids of dietary preference rows: those patterns exist,
+    so a miss means the snapshot predates a pattern created by a process
+    whose version bump this one did not see (e.g. a process-local cache).
+
+    Args:
+        pattern_ids: Ids of patterns that must be present
+    """
+    global _registry
+    pattern_ids = list(pattern_ids)
+    version = versions.get_version(versions.PATTERNS)
+    registry = _registry
+    if registry is not None and registry.version == version and registry.has_all(pattern_ids):
+        return registry
+    with _registry_lock:
+        if _registry is None or _registry.version != version or not _registry.has_all(pattern_ids):
+            _registry = PatternRegistry.load(version=version)
+        return _registry
+
+
+def reset():
+    """Drop the loaded registry so the next access reloads it."""
+    global _registry
+    with _registry_lock:
+        _registry = None
@@ -0,0 +1,146 @@
+"""
+Database-backed queue of meal plan generation jobs.
+
+The API enqueues a PlanGenerationJob row and returns immediately; workers
+started with the run_plan_worker command claim queued rows and run the
+generator. Claims use SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it, so concurrent workers never block on or double-claim a job. On
+SQLite, which has no row locks, a conditional UPDATE does the claiming.
+"""
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Meal, PlanGenerationJob
+from .services import MealPlanGenerator
+
+
+# Queued rows looked at per claim attempt on databases without SKIP LOCKED
+CLAIM_CANDIDATES = 10
+
+# Claims after which a job that keeps going stale is failed instead of requeued
+MAX_ATTEMPTS = 3
+
+
+def enqueue(user, num_days=1, algorithm='greedy', seed=None, start_date=None):
+    """Queue a generation job and return it."""
+    return PlanGenerationJob.objects.create(
+        user=user, num_days=num_days, algorithm=algorithm, seed=seed, start_date=start_date
+    )
+
+
+def claim_next(worker):
+    """
+    Claim the oldest queued job for a worker.
+
+    Args:
+        worker: Name recorded on the claimed job
+
+    Returns:
+        The claimed PlanGenerationJob (now running), or None if the queue is empty
+    """
+    queued = PlanGenerationJob.objects.filter(status=PlanGenerationJob.STATUS_QUEUED).order_by('created_at', 'id')
+    claim = {
+        'status': PlanGenerationJob.STATUS_RUNNING,
+        'worker': worker,
+        'started_at': timezone.now(),
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = queued.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            for field, value in claim.items():
+                setattr(job, field, value)
+            job.attempts += 1
+            job.save(update_fields=[*claim, 'attempts'])
+            return job
+
+    # Only one worker's UPDATE can match a row that is still queued
+    for job_id in queued.values_list('id', flat=True)[:CLAIM_CANDIDATES]:
+        claimed = PlanGenerationJob.objects.filter(
+            id=job_id, status=PlanGenerationJob.STATUS_QUEUED
+        ).update(attempts=F('attempts') + 1, **claim)
+        if claimed:
+            return PlanGenerationJob.objects.get(id=job_id)
+    return None
+
+
+def run(job):
+    """
+    Generate the job's meal plan and record the outcome on the job.
+
+    The outcome is only recorded if the worker still owns the job: a job
+    requeued by requeue_stale while it was running may have been claimed
+    again, and the plan generated here is then deleted.
+
+    Args:
+        job: Claimed PlanGenerationJob
+
+    Returns:
+        False if the job was taken away from this worker, else True
+    """
+    meal_plan = None
+    try:
+        meal_plan = MealPlanGenerator.generate_meal_plan(
+            job.user, num_days=job.num_days, algorithm=job.algorithm, seed=job.seed, start_date=job.start_date
+        )
+    except ValueError as e:
+        job.status = PlanGenerationJob.STATUS_FAILED
+        job.error = str(e)
+    except Exception as e:
+        job.status = PlanGenerationJob.STATUS_FAILED
+        job.error = f"Error generating meal plan: {str(e)}"
+    else:
+        job.status = PlanGenerationJob.STATUS_SUCCEEDED
+        job.meal_plan = meal_plan
+        job.error = ''
+    job.finished_at = timezone.now()
+
+    owned = PlanGenerationJob.objects.filter(
+        id=job.id, worker=job.worker, started_at=job.started_at, status=PlanGenerationJob.STATUS_RUNNING
+    ).update(status=job.status, meal_plan=job.meal_plan, error=job.error, finished_at=job.finished_at)
+    if not owned:
+        if meal_plan is not None:
+            _discard(meal_plan)
+        job.refresh_from_db()
+        return False
+    return True
+
+
+def _discard(meal_plan):
+    """Delete a plan nobody will see, with the generated meals no other plan uses."""
+    with transaction.atomic():
+        meal_ids = list(meal_plan.meals.values_list('id', flat=True))
+        meal_plan.delete()
+        Meal.objects.filter(id__in=meal_ids, content_hash__isnull=False, meal_plans__isnull=True).delete()
+
+
+def requeue_stale(timeout, max_attempts=MAX_ATTEMPTS):
+    """
+    Put back jobs whose worker has been running them longer than timeout,
+    e.g. because the worker process died. Jobs already claimed max_attempts
+    times are failed instead, so a job that always outlives the timeout (or
+    kills its worker) is not retried forever.
+
+    Args:
+        timeout: timedelta after which a running job counts as abandoned
+        max_attempts: Claims after which a stale job is failed
+
+    Returns:
+        Tuple (requeued, failed) job counts
+    """
+    stale = PlanGenerationJob.objects.filter(
+        status=PlanGenerationJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timeout,
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=PlanGenerationJob.STATUS_FAILED,
+        error=f"Abandoned: still not finished after {max_attempts} attempts",
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=PlanGenerationJob.STATUS_QUEUED, worker='', started_at=None
+    )
+    return requeued, failed
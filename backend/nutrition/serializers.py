@@ -2,7 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from decimal import Decimal
 from .models import (
-    UserProfile, Food, Meal, MealFood, MealPlan,
+    UserProfile, Food, Meal, MealFood, MealPlan, MealPlanDayTotals, PlanGenerationJob,
     FoodCategory, DietaryPattern, UserDietaryPreference, UserAllergy, UserFoodDislike
 )
 from .calorie_calculator import CalorieCalculator
@@ -211,24 +211,29 @@ class MealSerializer(serializers.ModelSerializer):
     class Meta:
         model = Meal
         fields = [
-            'id', 'name', 'meal_type', 'foods', 'total_nutrition',
+            'id', 'name', 'meal_type', 'day', 'foods', 'total_nutrition',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'total_nutrition']
 
     def get_total_nutrition(self, obj):
-        return obj.calculate_total_nutrition()
+        # Totals summed in SQL (MealQuerySet.with_nutrition) win over the stored ones
+        nutrition = obj.annotated_nutrition()
+        return obj.total_nutrition if nutrition is None else nutrition
 
     def create(self, validated_data):
         foods_data = self.initial_data.get('foods', [])
         meal = Meal.objects.create(**validated_data)
         
-        for food_data in foods_data:
-            MealFood.objects.create(
+        MealFood.objects.bulk_create([
+            MealFood(
                 meal=meal,
                 food_id=food_data.get('food_id'),
                 quantity_in_grams=food_data.get('quantity_in_grams')
             )
+            for food_data in foods_data
+        ])
+        self._store_totals(meal)
         
         return meal
 
@@ -237,24 +242,47 @@ class MealSerializer(serializers.ModelSerializer):
         
         instance.name = validated_data.get('name', instance.name)
         instance.meal_type = validated_data.get('meal_type', instance.meal_type)
+        instance.day = validated_data.get('day', instance.day)
+        # An edited meal no longer matches its interned composition
+        instance.content_hash = None
         instance.save()
         
         if foods_data is not None:
             # Clear existing foods
             MealFood.objects.filter(meal=instance).delete()
             # Add new foods
-            for food_data in foods_data:
-                MealFood.objects.create(
+            MealFood.objects.bulk_create([
+                MealFood(
                     meal=instance,
                     food_id=food_data.get('food_id'),
                     quantity_in_grams=food_data.get('quantity_in_grams')
                 )
+                for food_data in foods_data
+            ])
+            self._store_totals(instance)
         
         return instance
 
+    def _store_totals(self, meal):
+        """Recompute the meal's stored totals (and its plans') after its foods were written."""
+        Meal.refresh_totals([meal.id])
+        meal.refresh_from_db(fields=Meal.TOTAL_FIELDS)
+
+
+class MealPlanMealSerializer(MealSerializer):
+    """
+    A meal of a plan, serialized from its MealPlanMeal link: shaped like
+    MealSerializer, with the day the plan places the meal on.
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance.meal)
+        data['day'] = instance.day
+        return data
+
 
 class MealPlanSerializer(serializers.ModelSerializer):
-    meals = MealSerializer(many=True, read_only=True)
+    meals = serializers.SerializerMethodField()
     meal_ids = serializers.PrimaryKeyRelatedField(
         queryset=Meal.objects.all(),
         source='meals',
@@ -264,17 +292,85 @@ class MealPlanSerializer(serializers.ModelSerializer):
     )
     total_nutrition = serializers.SerializerMethodField()
     user = serializers.PrimaryKeyRelatedField(read_only=True)
+    num_days = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = MealPlan
         fields = [
-            'id', 'user', 'meals', 'meal_ids', 'start_date', 'end_date',
+            'id', 'user', 'meals', 'meal_ids', 'start_date', 'end_date', 'num_days',
             'total_nutrition', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'total_nutrition']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'total_nutrition', 'num_days']
+
+    def get_meals(self, obj):
+        # Long plans are read a page of days at a time from /meal-plans/{id}/meals/
+        if not obj.nests_meals():
+            return None
+        return MealPlanMealSerializer(obj.meal_links.all(), many=True).data
 
     def get_total_nutrition(self, obj):
-        return obj.calculate_total_nutrition()
+        nutrition = obj.annotated_nutrition()
+        return obj.total_nutrition if nutrition is None else nutrition
+
+    def create(self, validated_data):
+        meal_plan = super().create(validated_data)
+        # Adding the meals updated the stored totals in the database
+        meal_plan.refresh_from_db(fields=MealPlan.TOTAL_FIELDS)
+        return meal_plan
+
+    def update(self, instance, validated_data):
+        meal_plan = super().update(instance, validated_data)
+        meal_plan.refresh_from_db(fields=MealPlan.TOTAL_FIELDS)
+        return meal_plan
+
+
+class MealPlanDayTotalsSerializer(serializers.ModelSerializer):
+    """
+    Stored totals of one day of a plan. With a `targets` dict in the context
+    (shaped like total_nutrition) each day also reports how far it is from
+    the targets.
+    """
+    date = serializers.SerializerMethodField()
+    total_nutrition = serializers.SerializerMethodField()
+    difference = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MealPlanDayTotals
+        fields = ['day', 'date', 'meal_count', 'total_nutrition', 'difference']
+
+    def get_date(self, obj):
+        if obj.day == MealPlanDayTotals.NO_DAY:
+            return None
+        return obj.meal_plan.date_of(obj.day)
+
+    def get_total_nutrition(self, obj):
+        return obj.total_nutrition
+
+    def get_difference(self, obj):
+        targets = self.context.get('targets')
+        if targets is None or obj.day == MealPlanDayTotals.NO_DAY:
+            return None
+        return {
+            nutrient: round(value - targets[nutrient], 2)
+            for nutrient, value in obj.total_nutrition.items()
+        }
+
+
+class PlanGenerationJobSerializer(serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = PlanGenerationJob
+        fields = [
+            'id', 'user', 'num_days', 'algorithm', 'seed', 'start_date', 'status', 'meal_plan', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class PlanGenerationJobDetailSerializer(PlanGenerationJobSerializer):
+    """Job with the generated meal plan nested once it succeeded."""
+    meal_plan = MealPlanSerializer(read_only=True)
 
 
 class GroceryItemSerializer(serializers.Serializer):
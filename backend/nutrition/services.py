@@ -1,8 +1,98 @@
+import itertools
+from datetime import timedelta
 from decimal import Decimal
+from typing import NamedTuple
+import numpy as np
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Sum
-from .models import UserProfile, Food, Meal, MealFood, MealPlan
+from django.db import transaction
+from django.db.models import Q, Sum, prefetch_related_objects
+from django.utils import timezone
+from .models import UserProfile, Food, Meal, MealFood, MealPlan, MealPlanMeal, MealPlanDayTotals
 from .constraint_service import ConstraintService
+from .food_matrix import NUTRIENTS, FoodMatrix, get_matrix
+from .meal_optimizer import TARGETS, MealOptimizer
+from .generation_cache import GenerationCache
+from .variety import VarietyEngine
+
+
+BATCH_SIZE = 1000
+
+
+class PlannedMeal(NamedTuple):
+    """A generated meal that has not been saved yet."""
+    name: str
+    meal_type: str
+    # (Food, grams) pairs, grams quantized to 0.01
+    portions: tuple
+    # Day of the plan (1-based)
+    day: int = None
+
+    def content_hash(self):
+        """Return the Meal.content_hash this meal is interned under."""
+        return Meal.compute_content_hash(self.meal_type, [(food.id, grams) for food, grams in self.portions])
+
+
+class FoodRolePools:
+    """
+    Allowed foods partitioned by meal slot role, built once per generation.
+
+    Pools keep the order of the allowed foods. Every food can serve as a
+    filler, so the filler pool is the whole allowed list.
+    """
+
+    def __init__(self, foods):
+        self.foods = list(foods)
+        self.proteins = [food for food in self.foods if food.is_protein_source]
+        self.carbs = [food for food in self.foods if food.is_carb_source]
+        self.vegetables = [food for food in self.foods if food.is_vegetable]
+        self.fats = [food for food in self.foods if food.is_fat_source]
+        self.fillers = self.foods
+
+    def first_filler(self, exclude_ids):
+        """Return the first filler whose id is not in exclude_ids, or None."""
+        return _first_unused(self.fillers, exclude_ids)
+
+
+def _first_unused(foods, exclude_ids):
+    """Return the first of foods whose id is not in exclude_ids, or None."""
+    return next((food for food in foods if food.id not in exclude_ids), None)
+
+
+class InternedMeals(NamedTuple):
+    """Result of MealPlanGenerator._intern_meals."""
+    # content hash -> saved Meal
+    meals: dict
+    # Meals that already existed
+    shared_meals: list
+    # Meals inserted by this call, and their MealFood lists
+    new_meals: list
+    meal_foods_by_meal: list
+
+    def prime(self):
+        """Attach meal foods and food categories as prefetched results."""
+        foods = list({
+            meal_food.food_id: meal_food.food
+            for meal_foods in self.meal_foods_by_meal
+            for meal_food in meal_foods
+        }.values())
+        prefetch_related_objects(foods, 'categories')
+        prefetch_related_objects(self.shared_meals, 'mealfood_set__food__categories')
+        for meal, meal_foods in zip(self.new_meals, self.meal_foods_by_meal):
+            _set_prefetched(meal, 'mealfood_set', meal_foods)
+
+
+def _set_prefetched(instance, cache_name, objects):
+    """
+    Store already loaded related objects the way prefetch_related does, so
+    `<relation>.all()` on the instance returns them without a query.
+    """
+    queryset = getattr(instance, cache_name).all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[cache_name] = queryset
 
 
 class MealPlanGenerator:
@@ -15,166 +105,869 @@ class MealPlanGenerator:
     BREAKFAST_PERCENT = Decimal('0.25')  # 25%
     LUNCH_PERCENT = Decimal('0.35')      # 35%
     DINNER_PERCENT = Decimal('0.40')     # 40%
+    # Budget share of meals outside the daily slots when regenerated on their own
+    SNACK_PERCENT = Decimal('0.10')
+
+    # Meal slots generated for each day: (meal_type, name prefix, share of daily targets)
+    MEAL_SLOTS = (
+        ('breakfast', 'Breakfast', BREAKFAST_PERCENT),
+        ('lunch', 'Lunch', LUNCH_PERCENT),
+        ('dinner', 'Dinner', DINNER_PERCENT),
+    )
+
+    # 'greedy' fills calories with the first food of each role; 'optimized'
+    # solves for foods and portions against calorie and macro targets
+    ALGORITHMS = ('greedy', 'optimized')
+
+    # Bump whenever composition logic changes so cached compositions are not reused
+    ALGORITHM_VERSION = 2
+
+    # Longest plan that can be generated
+    MAX_DAYS = 365
+
+    # Plans longer than LONG_PLAN_DAYS are not memoized and never held in
+    # memory whole: they are composed and saved CHUNK_DAYS at a time
+    LONG_PLAN_DAYS = 31
+    CHUNK_DAYS = 7
 
     @staticmethod
-    def generate_meal_plan(user, num_days=1):
+    def generate_meal_plan(user, num_days=1, algorithm='greedy', seed=None, start_date=None):
         """
         Generate a meal plan for a user based on their calorie target.
         
         Args:
             user: Django User instance
-            num_days: Number of days to generate meals for (default: 1)
+            num_days: Number of days to generate meals for, up to MAX_DAYS (default: 1)
+            algorithm: One of ALGORITHMS (default: 'greedy')
+            seed: Seed of the variety engine; the same seed gives the same plan
+            start_date: Date of the first day (default: today); end_date follows from num_days
         
         Returns:
-            MealPlan instance
+            MealPlan instance; for plans up to LONG_PLAN_DAYS days its meals,
+            meal foods and foods are already cached
+        """
+        days = MealPlanGenerator.compose_days(user, num_days=num_days, algorithm=algorithm, seed=seed)
+        return MealPlanGenerator.persist_days(user, days, num_days, start_date or timezone.localdate())
+
+    @staticmethod
+    def stream_meal_plan(user, num_days=1, algorithm='greedy', seed=None, start_date=None):
         """
+        Generator version of generate_meal_plan for streaming responses.
+
+        Plans up to LONG_PLAN_DAYS days report each day as soon as it is
+        composed and are saved after the last day. Longer plans are saved
+        CHUNK_DAYS days at a time, like generate_meal_plan, and each day is
+        reported once its chunk is saved. Either way an interrupted stream
+        leaves nothing behind: a long plan's saved chunks are deleted.
+
+        Input is validated before this returns (ValueError), not while
+        iterating.
+
+        Args:
+            user: Django User instance
+            num_days: Number of days to generate meals for (default: 1)
+            algorithm: One of ALGORITHMS (default: 'greedy')
+            seed: Seed of the variety engine (see VarietyEngine)
+            start_date: Date of the first day (default: today)
+
+        Returns:
+            Iterator of JSON-serializable dictionaries:
+            {"type": "day", "day", "meals", "day_totals", "running_totals"}
+            for every day, then {"type": "meal_plan", "meal_plan"} with the
+            saved plan's id, dates, meal ids and total nutrition
+        """
+        days = MealPlanGenerator.compose_days(user, num_days=num_days, algorithm=algorithm, seed=seed)
+        return MealPlanGenerator._stream_days(user, days, num_days, start_date or timezone.localdate())
+
+    @staticmethod
+    def _stream_days(user, days, num_days, start_date):
+        matrix = get_matrix()
+        macro_columns = [NUTRIENTS.index(nutrient) for nutrient in TARGETS]
+        running = np.zeros(len(TARGETS))
+
+        def day_event(day, day_meals):
+            meals = []
+            day_vector = np.zeros(len(TARGETS))
+            for planned in day_meals:
+                food_ids = [food.id for food, _ in planned.portions]
+                quantities = [float(grams) for _, grams in planned.portions]
+                values, present = matrix.nutrition(food_ids, quantities)
+                totals = (values * present).sum(axis=0)
+                day_vector += totals[macro_columns]
+                meals.append({
+                    'name': planned.name,
+                    'meal_type': planned.meal_type,
+                    'day': planned.day,
+                    'foods': [
+                        {'food': {'id': food.id, 'name': food.name}, 'quantity_in_grams': str(grams)}
+                        for food, grams in planned.portions
+                    ],
+                    'total_nutrition': FoodMatrix.as_dict(totals, present.any(axis=0)),
+                })
+            running[:] += day_vector
+            return {
+                'type': 'day',
+                'day': day,
+                'meals': meals,
+                'day_totals': MealPlanGenerator._macro_dict(day_vector),
+                'running_totals': MealPlanGenerator._macro_dict(running),
+            }
+
+        if num_days <= MealPlanGenerator.LONG_PLAN_DAYS:
+            # Short plans are reported day by day and saved whole after the last day
+            planned_meals = []
+            for day, day_meals in days:
+                planned_meals.extend(day_meals)
+                yield day_event(day, day_meals)
+            meal_plan = MealPlanGenerator.persist(user, planned_meals, start_date=start_date)
+        else:
+            # Long plans are reported a chunk at a time, each chunk once it is saved.
+            # Closing this generator early closes the saver, which deletes the partial plan.
+            saver = MealPlanGenerator._save_chunks(user, days, num_days, start_date)
+            try:
+                while True:
+                    try:
+                        chunk = next(saver)
+                    except StopIteration as stop:
+                        meal_plan = stop.value
+                        break
+                    for day, day_meals in chunk:
+                        yield day_event(day, day_meals)
+            finally:
+                saver.close()
+
+        yield {
+            'type': 'meal_plan',
+            'meal_plan': {
+                'id': meal_plan.id,
+                'user': user.id,
+                'start_date': meal_plan.start_date,
+                'end_date': meal_plan.end_date,
+                'meals': [
+                    {'id': link.meal.id, 'name': link.meal.name, 'meal_type': link.meal.meal_type, 'day': link.day}
+                    for link in meal_plan.meal_links.select_related('meal').order_by('day', 'id')
+                ],
+                'total_nutrition': meal_plan.total_nutrition,
+                'created_at': meal_plan.created_at,
+            },
+        }
+
+    @staticmethod
+    def compose_meal_plan(user, num_days=1, algorithm='greedy', seed=None):
+        """
+        Build the meals of a plan in memory without writing anything.
+
+        Args:
+            user: Django User instance
+            num_days: Number of days to generate meals for (default: 1)
+            algorithm: One of ALGORITHMS (default: 'greedy')
+            seed: Seed of the variety engine (see VarietyEngine)
+
+        Returns:
+            List of PlannedMeal
+        """
+        return [
+            planned
+            for _, day_meals in MealPlanGenerator.compose_days(
+                user, num_days=num_days, algorithm=algorithm, seed=seed
+            )
+            for planned in day_meals
+        ]
+
+    @staticmethod
+    def compose_days(user, num_days=1, algorithm='greedy', seed=None):
+        """
+        Like compose_meal_plan, but composes lazily one day at a time.
+
+        Input is validated and the allowed foods are loaded before this
+        returns, so errors surface here rather than while iterating.
+
+        Args:
+            user: Django User instance
+            num_days: Number of days to generate meals for (default: 1)
+            algorithm: One of ALGORITHMS (default: 'greedy')
+            seed: Seed of the variety engine (see VarietyEngine)
+
+        Returns:
+            Iterator of (day, list of PlannedMeal) tuples, days in order
+        """
+        if algorithm not in MealPlanGenerator.ALGORITHMS:
+            raise ValueError(f"algorithm must be one of: {', '.join(MealPlanGenerator.ALGORITHMS)}.")
+
         try:
             user_profile = UserProfile.objects.get(user=user)
         except UserProfile.DoesNotExist:
             raise ValueError("User must have a profile with calorie targets to generate a meal plan.")
         
+        # Get all available foods
+        allowed_ids = ConstraintService.get_allowed_food_ids(user)
+        if not allowed_ids:
+            raise ValueError("No foods available in database. Please seed foods first.")
+
+        targets = MealPlanGenerator.generation_targets(user_profile, num_days)
+        target_profile = UserProfile(
+            calorie_target=targets[0], protein_target=targets[1], carb_target=targets[2], fat_target=targets[3]
+        )
+        cacheable = MealPlanGenerator.is_cacheable(num_days)
+        if cacheable:
+            key = GenerationCache.make_key(
+                targets,
+                [percent for _, _, percent in MealPlanGenerator.MEAL_SLOTS],
+                num_days,
+                allowed_ids,
+                algorithm,
+                MealPlanGenerator.ALGORITHM_VERSION,
+                (settings.NUTRITION_VARIETY_WINDOW_DAYS, settings.NUTRITION_VARIETY_PENALTY, seed),
+            )
+            composition = GenerationCache.get(key)
+            if composition is not None:
+                foods = Food.objects.in_bulk({food_id for *_, portions in composition for food_id, _ in portions})
+                planned_meals = [
+                    PlannedMeal(name, meal_type, tuple((foods[food_id], grams) for food_id, grams in portions), day)
+                    for name, meal_type, day, portions in composition
+                ]
+                return (
+                    (day, list(day_meals))
+                    for day, day_meals in itertools.groupby(planned_meals, key=lambda planned: planned.day)
+                )
+
+        allowed_foods = list(Food.objects.filter(id__in=allowed_ids))
+        days = MealPlanGenerator.iter_plan_days(
+            target_profile, FoodRolePools(allowed_foods), num_days, algorithm, seed=seed
+        )
+        return MealPlanGenerator._compose_and_cache(key, days) if cacheable else days
+
+    @staticmethod
+    def is_cacheable(num_days):
+        """
+        Whether compositions of num_days days go through GenerationCache.
+        Long compositions are not memoized, so memory stays bounded by one chunk.
+        """
+        return (
+            getattr(settings, 'NUTRITION_GENERATION_CACHE_SIZE', 1024) > 0
+            and num_days <= MealPlanGenerator.LONG_PLAN_DAYS
+        )
+
+    @staticmethod
+    def generation_targets(user_profile, num_days):
+        """
+        Daily targets a plan of num_days days is generated on. Every
+        generation path (API, stream, generate_meal_plans) goes through this,
+        so a user gets the same plan from each of them.
+
+        Targets are rounded only when the composition is cached, so users
+        with the same rounded targets and allowed foods share one
+        composition; otherwise the user's own targets are used.
+
+        Returns:
+            Tuple of Decimals (calories, protein, carbs, fat)
+        """
+        targets = (
+            user_profile.calorie_target, user_profile.protein_target,
+            user_profile.carb_target, user_profile.fat_target,
+        )
+        if MealPlanGenerator.is_cacheable(num_days):
+            return GenerationCache.round_targets(*targets)
+        return tuple(Decimal(str(target)) for target in targets)
+
+    @staticmethod
+    def _compose_and_cache(key, days):
+        """Pass composed days through and cache the composition once all days are done."""
+        planned_meals = []
+        for day, day_meals in days:
+            planned_meals.extend(day_meals)
+            yield day, day_meals
+        GenerationCache.put(key, tuple(
+            (planned.name, planned.meal_type, planned.day, tuple((food.id, grams) for food, grams in planned.portions))
+            for planned in planned_meals
+        ))
+
+    @staticmethod
+    def plan_meals(user_profile, pools, num_days=1, algorithm='greedy', matrix=None, seed=None):
+        """
+        Compose meals from already loaded data. Does not touch the database
+        when a matrix is passed, so it can run in worker processes.
+
+        Args:
+            user_profile: UserProfile (only the calorie and macro targets are read)
+            pools: FoodRolePools of the user's allowed foods
+            num_days: Number of days to generate meals for
+            algorithm: One of ALGORITHMS
+            matrix: FoodMatrix for the optimizer (default: get_matrix())
+            seed: Seed of the variety engine (see VarietyEngine)
+
+        Returns:
+            List of PlannedMeal
+        """
+        return [
+            planned
+            for _, day_meals in MealPlanGenerator.iter_plan_days(
+                user_profile, pools, num_days, algorithm, matrix, seed
+            )
+            for planned in day_meals
+        ]
+
+    @staticmethod
+    def iter_plan_days(user_profile, pools, num_days=1, algorithm='greedy', matrix=None, seed=None):
+        """
+        Generator version of plan_meals.
+
+        Yields:
+            (day, list of PlannedMeal) tuples, days in order
+        """
         calorie_target = Decimal(str(user_profile.calorie_target))
+        variety = VarietyEngine(pools.foods, seed=seed)
+
+        portions = {}
+        if algorithm == 'optimized':
+            optimizer = MealOptimizer(pools, matrix if matrix is not None else get_matrix())
+            if not variety.enabled:
+                # Portions depend only on the slot targets, so the optimizer runs once per slot
+                for meal_type, _, percent in MealPlanGenerator.MEAL_SLOTS:
+                    portions[meal_type] = MealPlanGenerator._optimize_slot(
+                        optimizer, MealPlanGenerator.slot_targets(user_profile, percent)
+                    )
         
-        # Calculate calories per meal type (keep as Decimal for precision)
-        breakfast_calories = calorie_target * MealPlanGenerator.BREAKFAST_PERCENT
-        lunch_calories = calorie_target * MealPlanGenerator.LUNCH_PERCENT
-        dinner_calories = calorie_target * MealPlanGenerator.DINNER_PERCENT
-        
-        # Get all available foods
-        allowed_foods = list(ConstraintService.get_allowed_foods(user))
+        for day in range(1, num_days + 1):
+            day_meals = []
+            for meal_type, label, percent in MealPlanGenerator.MEAL_SLOTS:
+                # The day is kept on the plan link, so identical days can share meals
+                name = label
+                if algorithm == 'optimized':
+                    if variety.enabled:
+                        slot_portions = MealPlanGenerator._optimize_slot(
+                            optimizer,
+                            MealPlanGenerator.slot_targets(user_profile, percent),
+                            penalties=variety.penalties(meal_type, day),
+                        )
+                    else:
+                        slot_portions = portions[meal_type]
+                    planned = PlannedMeal(name, meal_type, slot_portions, day)
+                else:
+                    # Calculate calories per meal type (keep as Decimal for precision)
+                    planned = MealPlanGenerator._compose_meal(
+                        name=name,
+                        meal_type=meal_type,
+                        target_calories=calorie_target * percent,
+                        pools=pools,
+                        day=day,
+                        variety=variety if variety.enabled else None,
+                    )
+                if variety.enabled:
+                    variety.record(meal_type, day, [food for food, _ in planned.portions])
+                day_meals.append(planned)
+            yield day, day_meals
+
+    @staticmethod
+    def _optimize_slot(optimizer, targets, penalties=None):
+        return tuple(
+            (food, Decimal(str(grams)).quantize(Decimal('0.01')))
+            for food, grams in optimizer.optimize(targets, penalties=penalties)
+        )
+
+    @staticmethod
+    def persist(user, planned_meals, start_date=None):
+        """
+        Save planned meals and their plan in one transaction with bulk inserts.
+
+        See persist_many.
+
+        Args:
+            user: Django User instance
+            planned_meals: List of PlannedMeal
+            start_date: Optional date of the plan's first day
+
+        Returns:
+            MealPlan instance
+        """
+        return MealPlanGenerator.persist_many([(user, planned_meals)], start_date=start_date)[0]
+
+    @staticmethod
+    def persist_days(user, days, num_days, start_date=None):
+        """
+        Save lazily composed days (see compose_days) as one plan.
+
+        Plans up to LONG_PLAN_DAYS days go through persist(), in one
+        transaction. Longer plans are composed and saved CHUNK_DAYS days at a
+        time, each chunk in its own transaction, so only one chunk of meals is
+        in memory at once; a failure deletes the partial plan. Their meals
+        are not cached on the returned plan.
+
+        Args:
+            user: Django User instance
+            days: Iterator of (day, list of PlannedMeal)
+            num_days: Number of days in the plan
+            start_date: Optional date of the plan's first day
+
+        Returns:
+            MealPlan instance
+        """
+        if num_days <= MealPlanGenerator.LONG_PLAN_DAYS:
+            planned_meals = [planned for _, day_meals in days for planned in day_meals]
+            return MealPlanGenerator.persist(user, planned_meals, start_date=start_date)
+
+        saver = MealPlanGenerator._save_chunks(user, days, num_days, start_date)
+        while True:
+            try:
+                next(saver)
+            except StopIteration as stop:
+                return stop.value
+
+    @staticmethod
+    def _save_chunks(user, days, num_days, start_date):
+        """
+        Save a long plan CHUNK_DAYS days at a time, each chunk in its own transaction.
+
+        No transaction stays open while the caller holds a chunk, so a slow
+        consumer (e.g. a stalled HTTP client) holds no locks. If saving fails
+        or the generator is closed before it is exhausted, the partial plan is
+        deleted along with the meals it interned that no other plan uses.
+
+        Yields:
+            Each chunk, a list of (day, list of PlannedMeal), once it is saved
+
+        Returns:
+            The MealPlan, as the generator's return value
+        """
+        meal_plan = MealPlan.objects.create(
+            user=user, start_date=start_date, end_date=MealPlanGenerator._end_date(start_date, num_days)
+        )
+        created_meal_ids = []
+        try:
+            while True:
+                chunk = list(itertools.islice(days, MealPlanGenerator.CHUNK_DAYS))
+                if not chunk:
+                    break
+                planned_meals = [planned for _, day_meals in chunk for planned in day_meals]
+                hashes = [planned.content_hash() for planned in planned_meals]
+                with transaction.atomic():
+                    interned = MealPlanGenerator._intern_meals(planned_meals, hashes)
+                    placements = MealPlanGenerator._placements(planned_meals, hashes, interned)
+                    MealPlanMeal.objects.bulk_create(
+                        [MealPlanMeal(mealplan=meal_plan, meal=meal, day=day) for meal, day in placements],
+                        batch_size=BATCH_SIZE,
+                    )
+                    # Chunks never share a day, so every chunk adds new day rows
+                    chunk_totals, day_rows = MealPlanDayTotals.summarize(placements)
+                    for row in day_rows:
+                        row.meal_plan = meal_plan
+                    MealPlanDayTotals.objects.bulk_create(day_rows, batch_size=BATCH_SIZE)
+                    for field, value in chunk_totals.items():
+                        setattr(meal_plan, field, getattr(meal_plan, field) + value)
+                    MealPlan.objects.filter(id=meal_plan.id).update(
+                        **{field: getattr(meal_plan, field) for field in MealPlan.TOTAL_FIELDS}
+                    )
+                created_meal_ids.extend(meal.id for meal in interned.new_meals)
+                yield chunk
+        except BaseException:
+            MealPlanGenerator._discard_partial_plan(meal_plan, created_meal_ids)
+            raise
+        return meal_plan
+
+    @staticmethod
+    def _discard_partial_plan(meal_plan, created_meal_ids):
+        """Delete a plan whose saving stopped early, and the meals it created that no other plan uses."""
+        with transaction.atomic():
+            meal_plan.delete()
+            Meal.objects.filter(id__in=created_meal_ids, meal_plans__isnull=True).delete()
+
+    @staticmethod
+    def _end_date(start_date, num_days):
+        if start_date is None:
+            return None
+        return start_date + timedelta(days=num_days - 1)
+
+    @staticmethod
+    def persist_many(plans, start_date=None):
+        """
+        Save several generated plans in one transaction with bulk inserts.
+
+        Meals are interned by content hash: a planned meal identical to an
+        existing interned meal (or to one saved in the same call, on any
+        day) reuses that row instead of creating a new one, and each day it
+        is eaten on is a plan link. Shared meals are never edited in place
+        (see MealViewSet).
+
+        The plan links, meals, meal foods and food categories are attached
+        to the returned plans as prefetched results, so serializing them
+        issues no further queries for them. If any write fails nothing is kept.
+
+        Args:
+            plans: List of (User, list of PlannedMeal) tuples
+            start_date: Optional date of the first day of every plan; each
+                plan's end_date follows from its last planned day
+
+        Returns:
+            List of MealPlan instances, in the order of plans
+        """
+        hashes = [[planned.content_hash() for planned in planned_meals] for _, planned_meals in plans]
+
+        with transaction.atomic():
+            interned = MealPlanGenerator._intern_meals(
+                [planned for _, planned_meals in plans for planned in planned_meals],
+                [content_hash for plan_hashes in hashes for content_hash in plan_hashes],
+            )
+            placements_by_plan = [
+                MealPlanGenerator._placements(planned_meals, plan_hashes, interned)
+                for (_, planned_meals), plan_hashes in zip(plans, hashes)
+            ]
+            # Totals are known before the plans exist, so they are inserted with them
+            summaries = [MealPlanDayTotals.summarize(placements) for placements in placements_by_plan]
+            meal_plans = MealPlan.objects.bulk_create([
+                MealPlan(
+                    user=user,
+                    start_date=start_date,
+                    end_date=MealPlanGenerator._end_date(
+                        start_date, max((planned.day or 1 for planned in planned_meals), default=1)
+                    ),
+                    **plan_totals,
+                )
+                for (user, planned_meals), (plan_totals, _) in zip(plans, summaries)
+            ])
+            for meal_plan, (_, day_rows) in zip(meal_plans, summaries):
+                for row in day_rows:
+                    row.meal_plan = meal_plan
+            MealPlanDayTotals.objects.bulk_create(
+                [row for _, day_rows in summaries for row in day_rows],
+                batch_size=BATCH_SIZE,
+            )
+            links_by_plan = [
+                [MealPlanMeal(mealplan=meal_plan, meal=meal, day=day) for meal, day in placements]
+                for meal_plan, placements in zip(meal_plans, placements_by_plan)
+            ]
+            MealPlanMeal.objects.bulk_create(
+                [link for links in links_by_plan for link in links],
+                batch_size=BATCH_SIZE,
+            )
+
+        interned.prime()
+        for meal_plan, links in zip(meal_plans, links_by_plan):
+            _set_prefetched(meal_plan, 'meal_links', links)
+        return meal_plans
+
+    @staticmethod
+    def _placements(planned_meals, hashes, interned):
+        """
+        The distinct (Meal, day) pairs of interned planned meals, in plan order.
+
+        Args:
+            planned_meals: List of PlannedMeal
+            hashes: Their content hashes
+            interned: InternedMeals holding every hash
+
+        Returns:
+            List of (Meal, day) tuples
+        """
+        keys = dict.fromkeys((content_hash, planned.day) for planned, content_hash in zip(planned_meals, hashes))
+        return [(interned.meals[content_hash], day) for content_hash, day in keys]
+
+    @staticmethod
+    def _intern_meals(planned_meals, hashes):
+        """
+        Look up planned meals by content hash and bulk-insert the missing
+        ones with their meal foods. Must run inside a transaction.
+
+        Args:
+            planned_meals: List of PlannedMeal
+            hashes: Their content hashes
+
+        Returns:
+            InternedMeals
+        """
+        # Lowest id wins if concurrent generations interned the same meal twice
+        meals_by_hash = {
+            meal.content_hash: meal
+            for meal in Meal.objects.filter(content_hash__in=set(hashes)).order_by('-id')
+        }
+        shared_meals = list(meals_by_hash.values())
+
+        new_meals = []
+        for planned, content_hash in zip(planned_meals, hashes):
+            if content_hash not in meals_by_hash:
+                meal = Meal(
+                    name=planned.name,
+                    meal_type=planned.meal_type,
+                    content_hash=content_hash,
+                    **Meal.totals_for_portions(planned.portions),
+                )
+                meals_by_hash[content_hash] = meal
+                new_meals.append((meal, planned))
+        Meal.objects.bulk_create([meal for meal, _ in new_meals], batch_size=BATCH_SIZE)
+
+        meal_foods_by_meal = [
+            [MealFood(meal=meal, food=food, quantity_in_grams=grams) for food, grams in planned.portions]
+            for meal, planned in new_meals
+        ]
+        MealFood.objects.bulk_create(
+            [meal_food for meal_foods in meal_foods_by_meal for meal_food in meal_foods],
+            batch_size=BATCH_SIZE,
+        )
+        return InternedMeals(meals_by_hash, shared_meals, [meal for meal, _ in new_meals], meal_foods_by_meal)
+
+    @staticmethod
+    def regenerate_meals(meal_plan, meal_ids, algorithm='optimized'):
+        """
+        Re-solve some meals of a plan and swap them in, keeping every other meal.
+
+        Each day's remaining budget (daily targets minus the meals that are
+        kept) is split between that day's regenerated meals by their slot
+        share. New meals avoid the foods of the meal they replace. A meal
+        placed on several days of the plan is re-solved once, against the
+        first of them, and replaced on all of them. Only the replaced meals'
+        plan links change; meals shared with other plans are left untouched,
+        and replaced generated meals no plan uses any more are deleted.
+
+        Args:
+            meal_plan: MealPlan instance
+            meal_ids: Ids of the plan's meals to regenerate
+            algorithm: One of ALGORITHMS (default: 'optimized')
+
+        Returns:
+            Tuple (replacements, nutrition_delta): dict of old meal id to new
+            Meal, and the change of the plan's calorie and macro totals
+        """
+        if algorithm not in MealPlanGenerator.ALGORITHMS:
+            raise ValueError(f"algorithm must be one of: {', '.join(MealPlanGenerator.ALGORITHMS)}.")
+        try:
+            user_profile = UserProfile.objects.get(user_id=meal_plan.user_id)
+        except UserProfile.DoesNotExist:
+            raise ValueError("User must have a profile with calorie targets to generate a meal plan.")
+
+        # Only the days of the regenerated meals are loaded, however long the plan
+        meal_ids = set(meal_ids)
+        days_needed = set(
+            meal_plan.meal_links.filter(meal_id__in=meal_ids, day__isnull=False).values_list('day', flat=True)
+        )
+        links = list(
+            meal_plan.meal_links.filter(Q(meal_id__in=meal_ids) | Q(day__in=days_needed))
+            .order_by('day', 'id').select_related('meal').prefetch_related('meal__mealfood_set')
+        )
+        if not meal_ids <= {link.meal_id for link in links}:
+            raise ValueError("All meals to regenerate must belong to the meal plan.")
+        if not meal_ids:
+            return {}, MealPlanGenerator._macro_dict(np.zeros(len(TARGETS)))
+
+        allowed_foods = list(ConstraintService.get_allowed_foods(meal_plan.user))
         if not allowed_foods:
             raise ValueError("No foods available in database. Please seed foods first.")
-        
-        # Create meals for each day
-        created_meals = []
-        
-        for day in range(num_days):
-            # Generate breakfast
-            breakfast = MealPlanGenerator._create_meal(
-                name=f"Breakfast Day {day + 1}",
-                meal_type='breakfast',
-                target_calories=breakfast_calories,
-                available_foods=allowed_foods
+
+        matrix = get_matrix()
+        columns = [NUTRIENTS.index(nutrient) for nutrient in TARGETS]
+
+        def macros(meal_foods):
+            if not meal_foods:
+                return np.zeros(len(TARGETS))
+            values, _ = matrix.nutrition(
+                [meal_food.food_id for meal_food in meal_foods],
+                [float(meal_food.quantity_in_grams) for meal_food in meal_foods],
             )
-            created_meals.append(breakfast)
-            
-            # Generate lunch
-            lunch = MealPlanGenerator._create_meal(
-                name=f"Lunch Day {day + 1}",
-                meal_type='lunch',
-                target_calories=lunch_calories,
-                available_foods=allowed_foods
+            return values[:, columns].sum(axis=0)
+
+        shares = {meal_type: float(percent) for meal_type, _, percent in MealPlanGenerator.MEAL_SLOTS}
+        daily = np.array(MealPlanGenerator.slot_targets(user_profile, Decimal('1')))
+
+        # Meals without a day (created by hand) are budgeted on their own slot share
+        days = {}
+        for link in links:
+            days.setdefault(link.day if link.day is not None else ('link', link.id), []).append(link)
+
+        planned_meals = []
+        replaced = []
+        delta = np.zeros(len(TARGETS))
+        for day, day_links in days.items():
+            solved = {meal.id for meal in replaced}
+            regenerate = [
+                link.meal for link in day_links if link.meal_id in meal_ids and link.meal_id not in solved
+            ]
+            if not regenerate:
+                continue
+            kept = np.zeros(len(TARGETS))
+            for link in day_links:
+                if link.meal_id not in meal_ids:
+                    kept += macros(list(link.meal.mealfood_set.all()))
+            day_shares = [shares.get(meal.meal_type, float(MealPlanGenerator.SNACK_PERCENT)) for meal in regenerate]
+            if not isinstance(day, int):
+                day = None
+                remaining = daily * day_shares[0]
+            else:
+                remaining = np.maximum(daily - kept, 0.0)
+
+            for meal, share in zip(regenerate, day_shares):
+                targets = remaining * share / sum(day_shares)
+                current = list(meal.mealfood_set.all())
+                current_ids = {meal_food.food_id for meal_food in current}
+                pools = FoodRolePools([food for food in allowed_foods if food.id not in current_ids] or allowed_foods)
+                if algorithm == 'optimized':
+                    portions = tuple(
+                        (food, Decimal(str(grams)).quantize(Decimal('0.01')))
+                        for food, grams in MealOptimizer(pools, matrix).optimize(targets, reference=daily * share)
+                    )
+                    planned = PlannedMeal(meal.name, meal.meal_type, portions, day)
+                else:
+                    planned = MealPlanGenerator._compose_meal(
+                        meal.name, meal.meal_type, Decimal(str(targets[0])), pools, day
+                    )
+                planned_meals.append(planned)
+                replaced.append(meal)
+                placed_on = sum(1 for link in links if link.meal_id == meal.id)
+                delta -= macros(current) * placed_on
+                delta += macros([
+                    MealFood(food_id=food.id, quantity_in_grams=grams) for food, grams in planned.portions
+                ]) * placed_on
+
+        hashes = [planned.content_hash() for planned in planned_meals]
+        with transaction.atomic():
+            interned = MealPlanGenerator._intern_meals(planned_meals, hashes)
+            replacements = {meal.id: interned.meals[content_hash] for meal, content_hash in zip(replaced, hashes)}
+            swapped = {old_id: new for old_id, new in replacements.items() if new.id != old_id}
+            old_meals = {meal.id: meal for meal in replaced}
+            moved = list(MealPlanMeal.objects.filter(mealplan=meal_plan, meal_id__in=swapped))
+            placed = set(
+                MealPlanMeal.objects.filter(
+                    mealplan=meal_plan, meal_id__in=[new.id for new in swapped.values()]
+                ).values_list('meal_id', 'day')
             )
-            created_meals.append(lunch)
-            
-            # Generate dinner
-            dinner = MealPlanGenerator._create_meal(
-                name=f"Dinner Day {day + 1}",
-                meal_type='dinner',
-                target_calories=dinner_calories,
-                available_foods=allowed_foods
+            changes = MealPlanDayTotals.changes_for_meals(
+                meal_plan.id, [(old_meals[link.meal_id], link.day) for link in moved], sign=-1
             )
-            created_meals.append(dinner)
-        
-        # Create meal plan
-        meal_plan = MealPlan.objects.create(user=user)
-        meal_plan.meals.set(created_meals)
-        
-        return meal_plan
+            repointed = []
+            duplicate_ids = []
+            for link in moved:
+                new = swapped[link.meal_id]
+                if (new.id, link.day) in placed:
+                    # The plan already holds the new meal on that day
+                    duplicate_ids.append(link.id)
+                else:
+                    placed.add((new.id, link.day))
+                    link.meal = new
+                    repointed.append(link)
+            MealPlanMeal.objects.filter(id__in=duplicate_ids).delete()
+            MealPlanMeal.objects.bulk_update(repointed, ['meal'], batch_size=BATCH_SIZE)
+            MealPlanDayTotals.apply(MealPlanDayTotals.changes_for_meals(
+                meal_plan.id, [(link.meal, link.day) for link in repointed], changes=changes
+            ))
+            # Generated meals no plan references any more are garbage
+            Meal.objects.filter(
+                id__in=swapped, content_hash__isnull=False, meal_plans__isnull=True
+            ).delete()
+
+        interned.prime()
+        return replacements, MealPlanGenerator._macro_dict(delta)
+
+    @staticmethod
+    def _macro_dict(vector):
+        return {nutrient: round(float(value), 2) for nutrient, value in zip(TARGETS, vector)}
+
+    @staticmethod
+    def slot_targets(user_profile, percent):
+        """
+        Calorie and macro targets of one meal slot.
+
+        Returns:
+            Tuple of floats (calories, protein, carbs, fat)
+        """
+        return tuple(
+            float(Decimal(str(target)) * percent)
+            for target in (
+                user_profile.calorie_target,
+                user_profile.protein_target,
+                user_profile.carb_target,
+                user_profile.fat_target,
+            )
+        )
 
     @staticmethod
-    def _create_meal(name, meal_type, target_calories, available_foods):
+    def _compose_meal(name, meal_type, target_calories, pools, day=None, variety=None):
         """
-        Create a single meal with foods that approximate the target calories.
+        Compose a single meal with foods that approximate the target calories.
         
         Args:
             name: Name of the meal
             meal_type: Type of meal (breakfast, lunch, dinner, snack)
             target_calories: Target calories for the meal
-            available_foods: List of Food objects to choose from
+            pools: FoodRolePools of the foods to choose from
+            day: Day of the plan the meal belongs to
+            variety: Optional VarietyEngine choosing each role's food instead
+                of the first one of the pool
         
         Returns:
-            Meal instance
+            PlannedMeal instance
         """
-        meal = Meal.objects.create(name=name, meal_type=meal_type)
+        portions = []
         
         # Simple algorithm: select foods to approximate target calories
         # Try to include a protein, carb, and vegetable/fruit
         # Convert target_calories to Decimal for consistent calculations
         remaining_calories = Decimal(str(target_calories))
-        foods_added = []
-        
-        # Categorize foods
-        proteins = [f for f in available_foods if f.protein_per_100g > Decimal('15')]
-        carbs = [f for f in available_foods if f.carbs_per_100g > Decimal('20')]
-        vegetables = [f for f in available_foods if f.calories_per_100g < Decimal('100') and f.carbs_per_100g < Decimal('20')]
+        added_ids = set()
         
         # Add a protein source (if available)
+        proteins = pools.proteins
         if proteins and remaining_calories > Decimal('100'):
-            protein = proteins[0]  # Simple: take first available
+            if variety is None:
+                protein = proteins[0]  # Simple: take first available
+            else:
+                protein = variety.pick(meal_type, 'proteins', proteins, day, added_ids) or proteins[0]
             protein_calories = protein.calories_per_100g
             # Aim for 30-40% of meal calories from protein
             protein_portion_calories = min(remaining_calories * Decimal('0.4'), protein_calories * Decimal('2'))
             protein_quantity = (protein_portion_calories / protein_calories) * Decimal('100')
             
-            MealFood.objects.create(
-                meal=meal,
-                food=protein,
-                quantity_in_grams=protein_quantity.quantize(Decimal('0.01'))
-            )
-            foods_added.append(protein)
+            portions.append((protein, protein_quantity.quantize(Decimal('0.01'))))
+            added_ids.add(protein.id)
             remaining_calories -= protein_portion_calories
         
         # Add a carb source (if available)
+        carbs = pools.carbs
         if carbs and remaining_calories > Decimal('50'):
-            carb = carbs[0]  # Simple: take first available
-            carb_calories = carb.calories_per_100g
-            # Aim for 40-50% of remaining calories from carbs
-            carb_portion_calories = min(remaining_calories * Decimal('0.5'), carb_calories * Decimal('2'))
-            carb_quantity = (carb_portion_calories / carb_calories) * Decimal('100')
-            
-            MealFood.objects.create(
-                meal=meal,
-                food=carb,
-                quantity_in_grams=carb_quantity.quantize(Decimal('0.01'))
-            )
-            foods_added.append(carb)
-            remaining_calories -= carb_portion_calories
+            # A food serving several roles is used once; the role is skipped if nothing else is left
+            if variety is None:
+                carb = _first_unused(carbs, added_ids)  # Simple: take first available
+            else:
+                carb = variety.pick(meal_type, 'carbs', carbs, day, added_ids)
+            if carb is not None:
+                carb_calories = carb.calories_per_100g
+                # Aim for 40-50% of remaining calories from carbs
+                carb_portion_calories = min(remaining_calories * Decimal('0.5'), carb_calories * Decimal('2'))
+                carb_quantity = (carb_portion_calories / carb_calories) * Decimal('100')
+
+                portions.append((carb, carb_quantity.quantize(Decimal('0.01'))))
+                added_ids.add(carb.id)
+                remaining_calories -= carb_portion_calories
         
         # Add a vegetable (if available and calories remain)
+        vegetables = pools.vegetables
         if vegetables and remaining_calories > Decimal('30'):
-            vegetable = vegetables[0]  # Simple: take first available
-            veg_calories = vegetable.calories_per_100g
-            # Use remaining calories or reasonable portion
-            veg_portion_calories = min(remaining_calories, veg_calories * Decimal('1.5'))
-            veg_quantity = (veg_portion_calories / veg_calories) * Decimal('100')
-            
-            MealFood.objects.create(
-                meal=meal,
-                food=vegetable,
-                quantity_in_grams=veg_quantity.quantize(Decimal('0.01'))
-            )
-            foods_added.append(vegetable)
-            remaining_calories -= veg_portion_calories
+            if variety is None:
+                vegetable = _first_unused(vegetables, added_ids)  # Simple: take first available
+            else:
+                vegetable = variety.pick(meal_type, 'vegetables', vegetables, day, added_ids)
+            if vegetable is not None:
+                veg_calories = vegetable.calories_per_100g
+                # Use remaining calories or reasonable portion
+                veg_portion_calories = min(remaining_calories, veg_calories * Decimal('1.5'))
+                veg_quantity = (veg_portion_calories / veg_calories) * Decimal('100')
+
+                portions.append((vegetable, veg_quantity.quantize(Decimal('0.01'))))
+                added_ids.add(vegetable.id)
+                remaining_calories -= veg_portion_calories
         
         # If we're still far from target, add more food
         # Try to fill remaining calories with a balanced food
         if remaining_calories > Decimal('100'):
             # Find a food that hasn't been added yet
-            unused_foods = [f for f in available_foods if f not in foods_added]
-            if unused_foods:
-                filler = unused_foods[0]
+            if variety is None:
+                filler = pools.first_filler(added_ids)
+            else:
+                filler = variety.pick(meal_type, 'fillers', pools.fillers, day, added_ids)
+            if filler is not None:
                 filler_calories = filler.calories_per_100g
                 filler_portion_calories = min(remaining_calories, filler_calories * Decimal('2'))
                 filler_quantity = (filler_portion_calories / filler_calories) * Decimal('100')
                 
-                MealFood.objects.create(
-                    meal=meal,
-                    food=filler,
-                    quantity_in_grams=filler_quantity.quantize(Decimal('0.01'))
-                )
+                portions.append((filler, filler_quantity.quantize(Decimal('0.01'))))
         
-        return meal
+        return PlannedMeal(name, meal_type, tuple(portions), day)
 
 
 class GroceryListGenerator:
@@ -195,27 +988,28 @@ class GroceryListGenerator:
             List of dictionaries with food details and total quantities
         """
         # Get all MealFood entries for meals in this plan
-        meal_foods = MealFood.objects.filter(meal__in=meal_plan.meals.all())
+        # One row per plan link, so a meal eaten on several days counts each time
+        meal_foods = MealFood.objects.filter(meal__plan_links__mealplan=meal_plan)
         
         # Aggregate by food and sum quantities
-        grocery_items = meal_foods.values('food').annotate(
+        grocery_items = list(meal_foods.values('food', 'food__name').annotate(
             total_quantity=Sum('quantity_in_grams')
-        ).order_by('food__name')
+        ).order_by('food__name'))
+        if not grocery_items:
+            return []
+        
+        # Calculate total nutrition for every item at once from the nutrient matrix
+        quantities = [float(item['total_quantity']) for item in grocery_items]
+        values, present = get_matrix().nutrition([item['food'] for item in grocery_items], quantities)
         
         # Build grocery list with food details
         grocery_list = []
-        for item in grocery_items:
-            food = Food.objects.get(pk=item['food'])
-            total_quantity = item['total_quantity']
-            
-            # Calculate total nutrition for this quantity
-            nutrition = food.calculate_nutrition(total_quantity)
-            
+        for item, quantity, item_values, item_present in zip(grocery_items, quantities, values, present):
             grocery_list.append({
-                'food_id': food.id,
-                'food_name': food.name,
-                'total_quantity_grams': float(total_quantity),
-                'nutrition': nutrition,
+                'food_id': item['food'],
+                'food_name': item['food__name'],
+                'total_quantity_grams': quantity,
+                'nutrition': FoodMatrix.as_dict(item_values, item_present),
             })
         
         return grocery_list
@@ -0,0 +1,155 @@
+"""
+Signal receivers that keep cached constraint data in sync with the database.
+Connected from NutritionConfig.ready().
+"""
+
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import (
+    Food, FoodCategory, DietaryPattern, Meal, MealFood, MealPlan, MealPlanMeal, MealPlanDayTotals,
+    UserDietaryPreference, UserAllergy, UserFoodDislike
+)
+from . import allergen_matches, versions
+
+
+@receiver(post_save, sender=Food)
+@receiver(post_delete, sender=Food)
+@receiver(post_save, sender=FoodCategory)
+@receiver(post_delete, sender=FoodCategory)
+@receiver(post_save, sender=DietaryPattern)
+@receiver(post_delete, sender=DietaryPattern)
+def catalog_changed(sender, **kwargs):
+    """Invalidate catalog-derived data when foods, categories or patterns change."""
+    versions.bump_version_on_commit(versions.CATALOG)
+
+
+@receiver(post_save, sender=Food)
+def food_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Keep materialized allergen matches in sync when a food is created or renamed."""
+    if created or update_fields is None or 'name' in update_fields:
+        allergen_matches.refresh_food(instance)
+
+
+@receiver(post_save, sender=Food)
+def food_nutrients_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Recompute the stored totals of meals containing a food whose nutrients may have changed."""
+    if created:
+        return
+    if update_fields is not None and not set(update_fields) & set(Meal.TOTAL_SOURCES.values()):
+        return
+    Meal.refresh_totals(MealFood.objects.filter(food=instance).values_list('meal_id', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Food)
+def food_deleting(sender, instance, **kwargs):
+    """Remember the meals losing a food, whose MealFood rows are deleted with it."""
+    instance._affected_meal_ids = list(
+        MealFood.objects.filter(food=instance).values_list('meal_id', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=Food)
+def food_deleted(sender, instance, **kwargs):
+    """Recompute the stored totals of meals that lost a food."""
+    Meal.refresh_totals(getattr(instance, '_affected_meal_ids', []))
+
+
+def _apply_plan_links(links, sign):
+    """Add (sign=1) or subtract (sign=-1) meals to or from the totals of the plan days linking them."""
+    links = list(links)
+    if not links:
+        return
+    meals = Meal.objects.only(*MealPlan.TOTAL_FIELDS).in_bulk({meal_id for _, meal_id, _ in links})
+    MealPlanDayTotals.apply(MealPlanDayTotals.changes_for_links(
+        links,
+        lambda meal_id: (sign, [sign * getattr(meals[meal_id], field) for field in MealPlan.TOTAL_FIELDS]),
+    ))
+
+
+@receiver(m2m_changed, sender=MealPlanMeal)
+def meal_plan_meals_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep plan and day totals in sync when meals are added to or removed from plans."""
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    # pk_set of a removal may name meals the plan does not hold
+    links = sender.objects.filter(**{'meal_id' if reverse else 'mealplan_id': instance.pk})
+    if action != 'pre_clear':
+        links = links.filter(**{'mealplan_id__in' if reverse else 'meal_id__in': pk_set})
+    if action == 'post_add':
+        # Meals added without through_defaults are placed on their own day
+        links.filter(day__isnull=True, meal__day__isnull=False).update(
+            day=Subquery(Meal.objects.filter(pk=OuterRef('meal_id')).values('day'))
+        )
+    _apply_plan_links(links.values_list('mealplan_id', 'meal_id', 'day'), 1 if action == 'post_add' else -1)
+
+
+@receiver(pre_delete, sender=Meal)
+def meal_deleting(sender, instance, **kwargs):
+    """Subtract a meal from the plans holding it; its plan links are deleted with it."""
+    links = MealPlanMeal.objects.filter(meal_id=instance.pk)
+    _apply_plan_links(links.values_list('mealplan_id', 'meal_id', 'day'), -1)
+
+
+@receiver(pre_save, sender=Meal)
+def meal_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember the stored day of a meal that may be moved to another day."""
+    instance.__dict__.pop('_stored_day', None)
+    if raw or instance.pk is None or (update_fields is not None and 'day' not in update_fields):
+        return
+    instance._stored_day = Meal.objects.filter(pk=instance.pk).values_list('day', flat=True).first()
+
+
+@receiver(post_save, sender=Meal)
+def meal_saved(sender, instance, created, raw=False, **kwargs):
+    """Move a meal, and its totals, to its new day in the plans holding it on its old day."""
+    if created or raw or '_stored_day' not in instance.__dict__:
+        return
+    old_day = instance.__dict__.pop('_stored_day')
+    if (old_day or MealPlanDayTotals.NO_DAY) == (instance.day or MealPlanDayTotals.NO_DAY):
+        return
+    meal = Meal.objects.only(*MealPlan.TOTAL_FIELDS).get(pk=instance.pk)
+    totals = [getattr(meal, field) for field in MealPlan.TOTAL_FIELDS]
+    links = MealPlanMeal.objects.filter(meal_id=instance.pk, day=old_day)
+    moved = list(links.values_list('mealplan_id', 'meal_id', 'day'))
+    links.update(day=instance.day)
+    changes = MealPlanDayTotals.changes_for_links(moved, lambda _: (-1, [-total for total in totals]))
+    changes.update(MealPlanDayTotals.changes_for_links(
+        [(meal_plan_id, meal_id, instance.day) for meal_plan_id, meal_id, _ in moved], lambda _: (1, totals)
+    ))
+    MealPlanDayTotals.apply(changes)
+
+
+@receiver(m2m_changed, sender=Food.categories.through)
+@receiver(m2m_changed, sender=DietaryPattern.excluded_categories.through)
+def catalog_relations_changed(sender, action, **kwargs):
+    """Invalidate catalog-derived data when category assignments change."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        versions.bump_version_on_commit(versions.CATALOG)
+
+
+@receiver(post_save, sender=FoodCategory)
+@receiver(post_delete, sender=FoodCategory)
+@receiver(post_save, sender=DietaryPattern)
+@receiver(post_delete, sender=DietaryPattern)
+def patterns_changed(sender, **kwargs):
+    """Reload the compiled pattern registry when patterns or categories change."""
+    versions.bump_version_on_commit(versions.PATTERNS)
+
+
+@receiver(m2m_changed, sender=DietaryPattern.excluded_categories.through)
+def pattern_exclusions_changed(sender, action, **kwargs):
+    """Reload the compiled pattern registry when a pattern's exclusions change."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        versions.bump_version_on_commit(versions.PATTERNS)
+
+
+@receiver(post_save, sender=UserDietaryPreference)
+@receiver(post_delete, sender=UserDietaryPreference)
+@receiver(post_save, sender=UserAllergy)
+@receiver(post_delete, sender=UserAllergy)
+@receiver(post_save, sender=UserFoodDislike)
+@receiver(post_delete, sender=UserFoodDislike)
+def user_constraints_changed(sender, instance, **kwargs):
+    """Invalidate a user's cached allowed foods when their constraints change."""
+    versions.bump_version_on_commit(versions.user_constraints(instance.user_id))
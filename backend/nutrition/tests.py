@@ -1,3 +1,1060 @@
-from django.test import TestCase
+import json
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from . import allergen_matches, fixed_point, pattern_registry, plan_jobs, versions
+from .constraint_service import ConstraintService
+from .models import (
+    AllergenMatch, AllergenTerm, Food, FoodCategory, DietaryPattern, Meal, MealFood, MealPlan, MealPlanDayTotals,
+    MealPlanMeal, PlanGenerationJob, UserDietaryPreference, UserAllergy, UserFoodDislike, UserProfile
+)
+from .food_matrix import FoodMatrix
+from .meal_optimizer import TARGET_COLUMNS, TARGETS, MealOptimizer
+from .generation_cache import GenerationCache
+from .services import FoodRolePools, GroceryListGenerator, MealPlanGenerator, PlannedMeal
 
-# Create your tests here.
+
+def make_food(name, categories=(), calories='100.00', protein='10.00', carbs='10.00', fat='5.00'):
+    food = Food.objects.create(
+        name=name,
+        calories_per_100g=Decimal(calories),
+        protein_per_100g=Decimal(protein),
+        carbs_per_100g=Decimal(carbs),
+        fat_per_100g=Decimal(fat),
+    )
+    food.categories.set(categories)
+    return food
+
+
+def make_profile(user, calorie_target=2000):
+    return UserProfile.objects.create(
+        user=user, age=30, height=Decimal('70'), weight=Decimal('170'), activity_level='moderately_active',
+        calorie_target=calorie_target,
+        protein_target=Decimal(calorie_target * 3 // 4) / 10,
+        carb_target=Decimal(calorie_target) / 10,
+        fat_target=Decimal(calorie_target * 3 // 9) / 10,
+    )
+
+
+def make_generation_foods():
+    """Foods covering every meal slot role, two per role."""
+    return [
+        make_food('Chicken Breast', calories='165.00', protein='31.00', carbs='0.00', fat='3.60'),
+        make_food('Salmon', calories='208.00', protein='20.00', carbs='0.00', fat='13.00'),
+        make_food('Brown Rice', calories='112.00', protein='2.60', carbs='23.50', fat='0.90'),
+        make_food('Oats', calories='389.00', protein='16.90', carbs='66.30', fat='6.90'),
+        make_food('Broccoli', calories='34.00', protein='2.80', carbs='6.60', fat='0.40'),
+        make_food('Spinach', calories='23.00', protein='2.90', carbs='3.60', fat='0.40'),
+    ]
+
+
+class CacheIsolationMixin:
+    """Start every test from empty caches: version stamps and memos outlive the rolled-back data."""
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        GenerationCache.clear()
+
+
+class ConstraintFixtures:
+    """Foods excluded by patterns, an allergen, a food allergy and a dislike, and a user to hold them."""
+
+    def setUp(self):
+        super().setUp()
+        self.meat = FoodCategory.objects.create(name='is_meat')
+        self.dairy = FoodCategory.objects.create(name='contains_dairy')
+        self.vegetarian = DietaryPattern.objects.create(name='vegetarian')
+        self.vegetarian.excluded_categories.set([self.meat])
+        self.dairy_free = DietaryPattern.objects.create(name='dairy_free')
+        self.dairy_free.excluded_categories.set([self.dairy])
+
+        self.chicken = make_food('Chicken Breast', [self.meat])
+        self.cheese = make_food('Cheddar Cheese', [self.dairy])
+        self.peanut_butter = make_food('Peanut Butter')
+        self.rice = make_food('Brown Rice')
+        self.broccoli = make_food('Broccoli')
+        self.apple = make_food('Apple')
+
+        self.user = User.objects.create_user(username='summary-user', password='secret')
+
+    def add_constraints(self):
+        UserDietaryPreference.objects.create(user=self.user, pattern=self.vegetarian)
+        UserDietaryPreference.objects.create(user=self.user, pattern=self.dairy_free)
+        UserAllergy.objects.create(user=self.user, allergen_name='Peanut', severity='severe')
+        UserAllergy.objects.create(user=self.user, food=self.apple, allergen_name='apple')
+        UserFoodDislike.objects.create(user=self.user, food=self.broccoli, reason='Texture')
+
+
+class ConstraintsSummaryTests(ConstraintFixtures, TestCase):
+    """Tests for ConstraintService.get_user_constraints_summary."""
+
+    def test_counts_match_allowed_foods(self):
+        self.add_constraints()
+
+        summary = ConstraintService.get_user_constraints_summary(self.user)
+
+        allowed = ConstraintService.query_allowed_foods(self.user).count()
+        self.assertEqual(summary['total_allowed_foods'], allowed)
+        self.assertEqual(summary['total_allowed_foods'], 1)
+        self.assertEqual(summary['total_excluded_foods'], Food.objects.count() - allowed)
+        self.assertEqual(
+            [pattern['pattern'] for pattern in summary['dietary_patterns']],
+            ['Dairy-Free', 'Vegetarian']
+        )
+        self.assertEqual(summary['dislikes'], [{'food': 'Broccoli', 'reason': 'Texture'}])
+
+    def test_counts_without_constraints(self):
+        summary = ConstraintService.get_user_constraints_summary(self.user)
+
+        self.assertEqual(summary['total_allowed_foods'], Food.objects.count())
+        self.assertEqual(summary['total_excluded_foods'], 0)
+
+    def test_query_budget_is_fixed(self):
+        self.add_constraints()
+        # Warm the pattern registry and allergen match table so only steady-state queries are counted
+        ConstraintService.get_user_constraints_summary(self.user)
+
+        # preferences, patterns version stamp, allergies, dislikes, allergen terms, counts aggregate
+        with self.assertNumQueries(6):
+            ConstraintService.get_user_constraints_summary(self.user)
+
+        # More constraints must not add queries
+        for name in ['vegan', 'pescatarian', 'keto']:
+            pattern = DietaryPattern.objects.create(name=name)
+            pattern.excluded_categories.set([self.meat, self.dairy])
+            UserDietaryPreference.objects.create(user=self.user, pattern=pattern)
+        for food in [self.rice, self.cheese]:
+            UserFoodDislike.objects.create(user=self.user, food=food)
+        # New patterns trigger a one-off reload of the compiled pattern registry
+        ConstraintService.get_user_constraints_summary(self.user)
+
+        with self.assertNumQueries(6):
+            ConstraintService.get_user_constraints_summary(self.user)
+
+
+class CheckAllowedTests(ConstraintFixtures, CacheIsolationMixin, TestCase):
+    """Food checks against a user's constraints."""
+
+    def post_check(self, data):
+        response = self.client.post('/api/foods/check-allowed/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def assertSameQueries(self, single, batch):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.post_check(single)), 1)
+        with self.assertNumQueries(len(queries)):
+            self.assertGreater(len(self.post_check(batch)), 1)
+
+    def test_batch_check_query_count_is_constant(self):
+        self.add_constraints()
+        food_ids = list(Food.objects.order_by('id').values_list('id', flat=True))
+        other = User.objects.create_user(username='other-user', password='secret')
+        UserFoodDislike.objects.create(user=other, food=self.rice)
+        # Warm the pattern registry so only steady-state queries are counted
+        self.post_check({'user_id': self.user.id, 'food_ids': food_ids[:1]})
+
+        self.assertSameQueries(
+            {'user_id': self.user.id, 'food_ids': food_ids[:1]},
+            {'user_id': self.user.id, 'food_ids': food_ids},
+        )
+        self.assertSameQueries(
+            {'food_id': self.rice.id, 'user_ids': [self.user.id]},
+            {'food_id': self.rice.id, 'user_ids': [self.user.id, other.id]},
+        )
+
+    def test_explanations_match_single_food_reasons(self):
+        self.add_constraints()
+
+        explanations = ConstraintService.explain_exclusions(self.user)
+
+        expected = {}
+        for food in Food.objects.order_by('id'):
+            response = self.client.get(f'/api/foods/{food.id}/check-allowed/?user_id={self.user.id}')
+            if response.json()['exclusion_reasons']:
+                expected[food.id] = response.json()['exclusion_reasons']
+        self.assertEqual(explanations, expected)
+        # Patterns, an allergen name, a food allergy and a dislike all give reasons
+        self.assertEqual(
+            set(expected), {self.chicken.id, self.cheese.id, self.peanut_butter.id, self.apple.id, self.broccoli.id}
+        )
+
+    def test_excluded_foods_use_a_subquery(self):
+        self.add_constraints()
+
+        excluded = ConstraintService.get_excluded_foods(self.user)
+
+        self.assertEqual(set(excluded), set(Food.objects.exclude(id=self.rice.id)))
+        # The allowed ids are selected by the database, not listed in the SQL
+        self.assertIn('IN (SELECT', str(excluded.query))
+        response = self.client.get(f'/api/users/{self.user.id}/excluded-foods/')
+        self.assertEqual({food['food_id'] for food in response.json()}, set(excluded.values_list('id', flat=True)))
+
+
+class AllergenMatchTests(ConstraintFixtures, CacheIsolationMixin, TestCase):
+    """The materialized allergen matches follow the catalog and agree with the in-memory matcher."""
+
+    def allowed_ids(self):
+        """Allowed ids from the ORM path, checked against the index (matcher) path and get_allowed_foods."""
+        orm = set(ConstraintService.query_allowed_foods(self.user).values_list('id', flat=True))
+        with override_settings(NUTRITION_USE_CONSTRAINT_INDEX=True):
+            self.assertEqual(set(ConstraintService.compute_allowed_food_ids(self.user)), orm)
+        self.assertEqual(set(ConstraintService.get_allowed_foods(self.user).values_list('id', flat=True)), orm)
+        return orm
+
+    def matches(self, food):
+        return set(AllergenMatch.objects.filter(food=food).values_list('allergen_normalized', flat=True))
+
+    def test_orm_and_matcher_agree(self):
+        self.assertEqual(len(self.allowed_ids()), Food.objects.count())
+
+        self.add_constraints()
+
+        self.assertEqual(self.allowed_ids(), {self.rice.id})
+
+    def test_food_rename(self):
+        UserAllergy.objects.create(user=self.user, allergen_name='Peanut')
+        self.assertNotIn(self.peanut_butter.id, self.allowed_ids())
+
+        self.rice.name = 'Peanut Rice'
+        self.rice.save()
+        self.assertEqual(self.matches(self.rice), {'peanut'})
+        self.assertNotIn(self.rice.id, self.allowed_ids())
+
+        self.rice.name = 'Brown Rice'
+        self.rice.save(update_fields=['name'])
+        self.assertEqual(self.matches(self.rice), set())
+        self.assertIn(self.rice.id, self.allowed_ids())
+
+    def test_allergy_add_and_remove(self):
+        allergy = UserAllergy.objects.create(user=self.user, allergen_name='RICE')
+
+        self.assertNotIn(self.rice.id, self.allowed_ids())
+        self.assertTrue(AllergenTerm.objects.filter(name='rice').exists())
+        self.assertEqual(self.matches(self.rice), {'rice'})
+
+        allergy.delete()
+
+        self.assertEqual(len(self.allowed_ids()), Food.objects.count())
+
+    def test_bulk_writes_need_a_refresh(self):
+        UserAllergy.objects.create(user=self.user, allergen_name='Peanut')
+        self.allowed_ids()
+
+        cookie, = Food.objects.bulk_create([
+            Food(
+                name='Peanut Cookie', calories_per_100g=Decimal('480.00'), protein_per_100g=Decimal('9.00'),
+                carbs_per_100g=Decimal('60.00'), fat_per_100g=Decimal('24.00'),
+            )
+        ])
+        Food.objects.filter(id=self.rice.id).update(name='Peanut Rice')
+        self.assertEqual(self.matches(cookie), set())
+        self.assertEqual(self.matches(self.rice), set())
+
+        allergen_matches.refresh_foods([cookie])
+        self.assertEqual(self.matches(cookie), {'peanut'})
+
+        call_command('rebuild_allergen_matches', stdout=StringIO())
+        self.assertEqual(self.matches(self.rice), {'peanut'})
+        allowed = self.allowed_ids()
+        self.assertNotIn(cookie.id, allowed)
+        self.assertNotIn(self.rice.id, allowed)
+
+
+class PatternRegistryTests(CacheIsolationMixin, TestCase):
+    """A registry that missed a pattern created elsewhere reloads instead of ignoring it."""
+
+    def setUp(self):
+        super().setUp()
+        self.meat = FoodCategory.objects.create(name='is_meat')
+        self.chicken = make_food('Chicken Breast', [self.meat])
+        self.rice = make_food('Brown Rice')
+        self.user = User.objects.create_user(username='registry-user', password='secret')
+
+    def add_unseen_pattern(self):
+        """Create a pattern while this process keeps a registry that predates it."""
+        stale = pattern_registry.get_registry()
+        vegetarian = DietaryPattern.objects.create(name='vegetarian')
+        vegetarian.excluded_categories.set([self.meat])
+        UserDietaryPreference.objects.create(user=self.user, pattern=vegetarian)
+        # As if the version bump happened in another process's local cache
+        pattern_registry._registry = pattern_registry.PatternRegistry(
+            stale.patterns.values(), version=versions.get_version(versions.PATTERNS)
+        )
+        self.assertIsNone(pattern_registry._registry.get(vegetarian.id))
+        return vegetarian
+
+    def test_summary_reloads_missing_pattern(self):
+        self.add_unseen_pattern()
+
+        summary = ConstraintService.get_user_constraints_summary(self.user)
+
+        self.assertEqual([pattern['pattern'] for pattern in summary['dietary_patterns']], ['Vegetarian'])
+        self.assertEqual(summary['total_allowed_foods'], 1)
+
+    def test_allowed_foods_enforce_missing_pattern(self):
+        self.add_unseen_pattern()
+
+        allowed = ConstraintService.query_allowed_foods(self.user)
+
+        self.assertEqual(list(allowed), [self.rice])
+
+
+class MealPlanQueryCountTests(TestCase):
+    """Meal plan reads take the same number of queries whatever the plan size."""
+
+    # meal plans, plan links, meals, meal foods, foods, food categories
+    QUERIES = 6
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='query-user', password='secret')
+        categories = [FoodCategory.objects.create(name=name) for name in ('is_meat', 'is_grain', 'is_vegetable')]
+        self.foods = [
+            make_food(f'Food {index}', categories[:index % 3 + 1], calories=f'{100 + index}.50')
+            for index in range(6)
+        ]
+
+    def make_plan(self, num_days):
+        start = date(2026, 1, 5)
+        meal_plan = MealPlan.objects.create(
+            user=self.user, start_date=start, end_date=start + timedelta(days=num_days - 1)
+        )
+        meals = []
+        for day in range(1, num_days + 1):
+            for index, meal_type in enumerate(['breakfast', 'lunch', 'dinner']):
+                meal = Meal.objects.create(name=f'{meal_type} {day}', meal_type=meal_type, day=day)
+                MealFood.objects.bulk_create([
+                    MealFood(meal=meal, food=food, quantity_in_grams=Decimal(50 * day + index))
+                    for food in self.foods[index:index + 2]
+                ])
+                meals.append(meal)
+        Meal.refresh_totals([meal.id for meal in meals])
+        meal_plan.meals.add(*meals)
+        return meal_plan
+
+    def test_retrieve(self):
+        for num_days in (1, 7, 28):
+            meal_plan = self.make_plan(num_days)
+            for query in ('', '?totals=computed'):
+                with self.assertNumQueries(self.QUERIES):
+                    response = self.client.get(f'/api/meal-plans/{meal_plan.id}/{query}')
+                self.assertEqual(response.status_code, 200)
+                meals = response.json()['meals']
+                self.assertEqual(len(meals), 3 * num_days)
+                self.assertTrue(all(len(meal['foods']) == 2 for meal in meals))
+
+            # Totals from the prefetched meals match the stored ones without more queries
+            meal_plan = MealPlan.objects.get(pk=meal_plan.pk)
+            MealPlan.prefetch_meals([meal_plan])
+            with self.assertNumQueries(0):
+                calculated = meal_plan.calculate_total_nutrition()
+                for meal in (link.meal for link in meal_plan.meal_links.all()):
+                    self.assertEqual(meal.calculate_total_nutrition()['calories'], meal.total_nutrition['calories'])
+            self.assertEqual(calculated, meal_plan.total_nutrition)
+
+    def test_list(self):
+        for num_days in (1, 7, 28):
+            self.make_plan(num_days)
+            for query in ('', '&totals=computed'):
+                with self.assertNumQueries(self.QUERIES):
+                    response = self.client.get(f'/api/meal-plans/?user_id={self.user.id}{query}')
+                self.assertEqual(response.status_code, 200)
+
+    def test_meal_list(self):
+        for num_days in (1, 7, 28):
+            self.make_plan(num_days)
+            for query in ('', '?totals=computed'):
+                # meals, meal foods, foods, food categories
+                with self.assertNumQueries(self.QUERIES - 2):
+                    response = self.client.get(f'/api/meals/{query}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()), Meal.objects.count())
+
+    def test_long_plan_skips_meals(self):
+        meal_plan = self.make_plan(MealPlan.NESTED_MEALS_MAX_DAYS + 1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/meal-plans/{meal_plan.id}/')
+        self.assertIsNone(response.json()['meals'])
+
+
+class PlanJobTests(CacheIsolationMixin, TestCase):
+    """Ownership and attempt limits of the generation job queue."""
+
+    def setUp(self):
+        super().setUp()
+        make_generation_foods()
+        self.user = User.objects.create_user(username='job-user', password='secret')
+        make_profile(self.user)
+
+    def test_run_records_result_of_owned_job(self):
+        job = plan_jobs.enqueue(self.user, num_days=2)
+        job = plan_jobs.claim_next('worker-a')
+
+        self.assertTrue(plan_jobs.run(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(MealPlan.objects.get().id, job.meal_plan_id)
+
+    def test_run_discards_result_of_requeued_job(self):
+        plan_jobs.enqueue(self.user, num_days=2)
+        job = plan_jobs.claim_next('worker-a')
+        # The job outlives the stale timeout and another worker takes it over
+        PlanGenerationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(plan_jobs.requeue_stale(timedelta(minutes=10)), (1, 0))
+        plan_jobs.claim_next('worker-b')
+
+        self.assertFalse(plan_jobs.run(job))
+
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.worker, job.meal_plan_id), (PlanGenerationJob.STATUS_RUNNING, 'worker-b', None)
+        )
+        self.assertFalse(MealPlan.objects.exists())
+        self.assertFalse(Meal.objects.exists())
+
+    def test_stale_job_fails_after_max_attempts(self):
+        job = plan_jobs.enqueue(self.user)
+        for attempt in range(1, 4):
+            self.assertEqual(plan_jobs.claim_next('worker-a').id, job.id)
+            PlanGenerationJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+            requeued, failed = plan_jobs.requeue_stale(timedelta(minutes=10), max_attempts=3)
+            self.assertEqual((requeued, failed), (0, 1) if attempt == 3 else (1, 0))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (PlanGenerationJob.STATUS_FAILED, 3))
+        self.assertIsNone(plan_jobs.claim_next('worker-a'))
+
+    def test_worker_drains_job_under_default_settings(self):
+        self.assertTrue(versions.is_shared())
+        response = self.client.post(
+            '/api/meal-plans/generate/?async=1', {'user_id': self.user.id, 'num_days': 2},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+
+        call_command('run_plan_worker', once=True, stdout=StringIO())
+
+        job = PlanGenerationJob.objects.get(pk=response.json()['id'])
+        self.assertEqual(job.status, PlanGenerationJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.meal_plan.user, self.user)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_refuses_async_jobs(self):
+        self.assertFalse(versions.is_shared())
+        with self.assertRaisesMessage(CommandError, 'shared'):
+            call_command('run_plan_worker', once=True)
+
+        response = self.client.post(
+            '/api/meal-plans/generate/?async=1', {'user_id': self.user.id}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(PlanGenerationJob.objects.exists())
+
+
+class DedupeMealsTests(TestCase):
+    """dedupe_meals merges interned meals and leaves user-authored ones alone."""
+
+    def make_meal(self, food, interned):
+        meal = Meal.objects.create(name='Lunch Day 1', meal_type='lunch', day=1)
+        MealFood.objects.create(meal=meal, food=food, quantity_in_grams=Decimal('150.00'))
+        if interned:
+            meal.content_hash = Meal.compute_content_hash(meal.meal_type, [(food.id, Decimal('150'))])
+            meal.save(update_fields=['content_hash'])
+        return meal
+
+    def test_only_interned_meals_are_merged(self):
+        food = make_food('Brown Rice')
+        user_meals = [self.make_meal(food, interned=False) for _ in range(2)]
+        interned = [self.make_meal(food, interned=True) for _ in range(2)]
+
+        call_command('dedupe_meals', stdout=StringIO())
+
+        self.assertEqual(
+            list(Meal.objects.order_by('id').values_list('id', 'content_hash')),
+            [(user_meals[0].id, None), (user_meals[1].id, None), (interned[0].id, interned[0].content_hash)],
+        )
+
+
+class MealInterningTests(TestCase):
+    """Identical meals are stored once, however many days of a plan eat them."""
+
+    def test_identical_days_share_one_meal(self):
+        rice, broccoli = make_food('Brown Rice'), make_food('Broccoli')
+        user = User.objects.create_user(username='interning-user', password='secret')
+        portions = ((rice, Decimal('150.00')), (broccoli, Decimal('80.00')))
+        days = [(day, [PlannedMeal('Lunch', 'lunch', portions, day)]) for day in (1, 2)]
+
+        meal_plan = MealPlanGenerator.persist_days(user, iter(days), 2, start_date=date(2026, 3, 2))
+
+        meal = Meal.objects.get()
+        self.assertIsNone(meal.day)
+        self.assertEqual(sorted(meal_plan.meal_links.values_list('meal_id', 'day')), [(meal.id, 1), (meal.id, 2)])
+        self.assertEqual(
+            list(meal_plan.day_totals.values_list('day', 'meal_count', 'total_calories')),
+            [(1, 1, meal.total_calories), (2, 1, meal.total_calories)],
+        )
+        meal_plan.refresh_from_db()
+        self.assertEqual(meal_plan.total_calories, 2 * meal.total_calories)
+
+        response = self.client.get(f'/api/meal-plans/{meal_plan.id}/')
+        self.assertEqual([(meal['id'], meal['day']) for meal in response.json()['meals']], [(meal.id, 1), (meal.id, 2)])
+        grocery_list = GroceryListGenerator.generate_grocery_list(meal_plan)
+        self.assertEqual(
+            {item['food_name']: item['total_quantity_grams'] for item in grocery_list},
+            {'Brown Rice': 300.0, 'Broccoli': 160.0},
+        )
+
+    def test_failed_persist_keeps_nothing(self):
+        rice, broccoli, salmon = make_food('Brown Rice'), make_food('Broccoli'), make_food('Salmon')
+        user = User.objects.create_user(username='interning-user', password='secret')
+        lunch = PlannedMeal('Lunch', 'lunch', ((rice, Decimal('150.00')), (broccoli, Decimal('80.00'))), 1)
+        dinner = PlannedMeal('Dinner', 'dinner', ((salmon, Decimal('120.00')), (rice, Decimal('100.00'))), 1)
+        MealPlanGenerator.persist_many([(user, [lunch])])
+        counts = [model.objects.count() for model in (MealPlan, Meal, MealFood, MealPlanMeal, MealPlanDayTotals)]
+
+        # The links are the last write: meals, meal foods, plans and day totals are in by then
+        with mock.patch.object(MealPlanMeal.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                MealPlanGenerator.persist_many([(user, [lunch, dinner]), (user, [dinner])])
+
+        self.assertEqual(
+            [model.objects.count() for model in (MealPlan, Meal, MealFood, MealPlanMeal, MealPlanDayTotals)],
+            counts,
+        )
+
+
+class PlanTotalsSignalTests(TestCase):
+    """Plan and day totals follow every change to a plan's meals."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='totals-user', password='secret')
+        self.rice = make_food('Brown Rice', calories='112.00')
+        self.oats = make_food('Oats', calories='389.00')
+        self.meal_plan = MealPlan.objects.create(user=self.user)
+        self.meals = [self.make_meal(day, food) for day, food in ((1, self.rice), (1, self.oats), (2, self.rice))]
+
+    def make_meal(self, day, food):
+        meal = Meal.objects.create(name=f'Meal {day} {food.name}', meal_type='lunch', day=day)
+        MealFood.objects.create(meal=meal, food=food, quantity_in_grams=Decimal('150.00'))
+        Meal.refresh_totals([meal.id])
+        return meal
+
+    def assertTotalsMatch(self, expected_days):
+        plan_totals, changes = MealPlanDayTotals.computed([self.meal_plan.id])
+        self.meal_plan.refresh_from_db()
+        self.assertEqual(
+            [getattr(self.meal_plan, field) for field in MealPlan.TOTAL_FIELDS], plan_totals[self.meal_plan.id]
+        )
+        stored = {
+            (row.meal_plan_id, row.day): [row.meal_count, [getattr(row, field) for field in MealPlan.TOTAL_FIELDS]]
+            for row in self.meal_plan.day_totals.all()
+        }
+        self.assertEqual(stored, changes)
+        self.assertEqual(sorted(day for _, day in stored), expected_days)
+
+    def test_add_and_remove_meals(self):
+        self.meal_plan.meals.add(*self.meals)
+        self.assertTotalsMatch([1, 2])
+
+        self.meal_plan.meals.remove(self.meals[2])
+        self.assertTotalsMatch([1])
+
+        self.meals[2].meal_plans.add(self.meal_plan)
+        self.assertTotalsMatch([1, 2])
+
+        self.meal_plan.meals.clear()
+        self.assertTotalsMatch([])
+        self.assertEqual(self.meal_plan.total_calories, 0)
+
+    def test_meal_edits(self):
+        self.meal_plan.meals.add(*self.meals)
+
+        response = self.client.patch(
+            f'/api/meals/{self.meals[1].id}/',
+            {'day': 3, 'foods': [{'food_id': self.oats.id, 'quantity_in_grams': '80.00'}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTotalsMatch([1, 2, 3])
+        self.assertEqual(self.meal_plan.total_calories, Decimal('647.20'))
+
+        self.rice.calories_per_100g = Decimal('130.00')
+        self.rice.save()
+        self.assertTotalsMatch([1, 2, 3])
+        self.assertEqual(self.meal_plan.total_calories, Decimal('701.20'))
+
+    def test_meal_delete(self):
+        self.meal_plan.meals.add(*self.meals)
+
+        self.meals[2].delete()
+        self.assertTotalsMatch([1])
+        self.assertEqual(self.meal_plan.total_calories, Decimal('751.50'))
+
+        self.oats.delete()
+        self.assertTotalsMatch([1])
+        self.assertEqual(self.meal_plan.total_calories, Decimal('168.00'))
+
+
+class SyncMealTotalsTests(TestCase):
+    """sync_meal_totals finds and repairs stored totals that drifted from the foods."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='sync-user')
+        rice, oats = make_food('Brown Rice', calories='112.00'), make_food('Oats', calories='389.00')
+        self.meal_plan = MealPlan.objects.create(user=user)
+        self.meals = []
+        for day, food in ((1, rice), (1, oats), (2, rice)):
+            meal = Meal.objects.create(name=f'Meal {day} {food.name}', meal_type='lunch', day=day)
+            MealFood.objects.create(meal=meal, food=food, quantity_in_grams=Decimal('150.00'))
+            self.meals.append(meal)
+        Meal.refresh_totals([meal.id for meal in self.meals])
+        self.meal_plan.meals.add(*self.meals)
+
+    def sync(self, *args):
+        stdout = StringIO()
+        call_command('sync_meal_totals', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def stored(self):
+        return (
+            list(Meal.objects.order_by('id').values_list('total_calories', flat=True)),
+            list(MealPlan.objects.values_list(*MealPlan.TOTAL_FIELDS)),
+            list(MealPlanDayTotals.objects.order_by('day').values_list('day', 'meal_count', 'total_calories')),
+        )
+
+    def test_no_drift_is_a_no_op(self):
+        before = self.stored()
+
+        self.assertIn('All 3 meals and 1 meal plans have up-to-date totals.', self.sync('--verify'))
+        self.assertIn('Fixed: 0; meal plans checked: 1, fixed: 0', self.sync())
+        self.assertEqual(self.stored(), before)
+
+    def test_repairs_drift(self):
+        expected = self.stored()
+        # QuerySet.update bypasses the signals that keep totals in step
+        Meal.objects.filter(id=self.meals[0].id).update(total_calories=Decimal('1.00'))
+        MealPlanDayTotals.objects.filter(meal_plan=self.meal_plan, day=2).delete()
+        MealPlanDayTotals.objects.filter(meal_plan=self.meal_plan, day=1).update(meal_count=5)
+
+        with self.assertRaisesMessage(CommandError, '1 of 3 meals and 1 of 1 meal plans have drifted totals.'):
+            self.sync('--verify')
+
+        output = self.sync()
+        self.assertIn(f'meal {self.meals[0].id}: total_calories 1.00 != 168.00', output)
+        self.assertIn('Fixed: 1; meal plans checked: 1, fixed: 1', output)
+        self.assertEqual(self.stored(), expected)
+        self.assertIn('have up-to-date totals', self.sync('--verify'))
+
+    def test_repairs_plan_totals(self):
+        expected = self.stored()
+        MealPlan.objects.filter(id=self.meal_plan.id).update(total_calories=Decimal('0.00'))
+
+        self.assertIn('Fixed: 0; meal plans checked: 1, fixed: 1', self.sync())
+        self.assertEqual(self.stored(), expected)
+
+
+class GenerationTargetsTests(CacheIsolationMixin, TestCase):
+    """Targets are rounded for the generation cache only when it is in use."""
+
+    def setUp(self):
+        super().setUp()
+        make_generation_foods()
+        self.users = []
+        for calorie_target in (2000, 2004):
+            user = User.objects.create_user(username=f'targets-{calorie_target}', password='secret')
+            make_profile(user, calorie_target)
+            self.users.append(user)
+
+    def portions(self, user):
+        return [
+            [(food.id, grams) for food, grams in planned.portions]
+            for planned in MealPlanGenerator.compose_meal_plan(user, num_days=2, seed=1)
+        ]
+
+    def test_cached_generation_shares_rounded_targets(self):
+        self.assertEqual(self.portions(self.users[0]), self.portions(self.users[1]))
+
+    @override_settings(NUTRITION_GENERATION_CACHE_SIZE=0)
+    def test_uncached_generation_uses_exact_targets(self):
+        self.assertEqual(
+            MealPlanGenerator.generation_targets(self.users[1].userprofile, 2)[0], Decimal('2004')
+        )
+        self.assertNotEqual(self.portions(self.users[0]), self.portions(self.users[1]))
+
+
+class FoodMatrixRefreshTests(TestCase):
+    """Incremental matrix refreshes pick up rows committed out of timestamp order."""
+
+    def test_refresh_picks_up_late_commit(self):
+        rice = make_food('Brown Rice', calories='112.00')
+        oats = make_food('Oats', calories='389.00')
+        matrix = FoodMatrix.build()
+        # Saved before the last sync but committed after it
+        Food.objects.filter(id=rice.id).update(
+            calories_per_100g=Decimal('130.00'), updated_at=matrix.synced_at - timedelta(seconds=30)
+        )
+        oats.save()
+
+        matrix.refresh()
+
+        self.assertEqual(matrix.values[matrix.rows[rice.id], 0], 130.0)
+
+
+class FoodRoleTests(TestCase):
+    """Meal slot role flags are derived from the nutrients whenever a food is saved."""
+
+    def setUp(self):
+        self.chicken = make_food('Chicken Breast', calories='165.00', protein='31.00', carbs='0.00', fat='3.60')
+        self.rice = make_food('Brown Rice', calories='112.00', protein='2.60', carbs='23.00', fat='0.90')
+        self.broccoli = make_food('Broccoli', calories='34.00', protein='2.80', carbs='6.60', fat='0.40')
+        self.oil = make_food('Olive Oil', calories='884.00', protein='0.00', carbs='0.00', fat='100.00')
+
+    def roles(self, food):
+        return Food.objects.values_list(*Food.ROLE_FIELDS).get(id=food.id)
+
+    def test_roles_derived_on_save(self):
+        self.assertEqual(self.roles(self.chicken), (True, False, False, False))
+        self.assertEqual(self.roles(self.rice), (False, True, False, False))
+        self.assertEqual(self.roles(self.broccoli), (False, False, True, False))
+        self.assertEqual(self.roles(self.oil), (False, False, False, True))
+
+    def test_roles_follow_updates(self):
+        self.chicken.protein_per_100g = Decimal('12.00')
+        self.chicken.carbs_per_100g = Decimal('25.00')
+        # update_fields naming a nutrient also writes the flags
+        self.chicken.save(update_fields=['protein_per_100g', 'carbs_per_100g'])
+        self.assertEqual(self.roles(self.chicken), (False, True, False, False))
+
+        self.broccoli.calories_per_100g = Decimal('150.00')
+        self.broccoli.save()
+        self.assertEqual(self.roles(self.broccoli), (False, False, False, False))
+
+    def test_pools_use_role_flags(self):
+        pools = FoodRolePools(Food.objects.order_by('id'))
+
+        self.assertEqual(pools.proteins, [self.chicken])
+        self.assertEqual(pools.carbs, [self.rice])
+        self.assertEqual(pools.vegetables, [self.broccoli])
+        self.assertEqual(pools.fats, [self.oil])
+        self.assertEqual(pools.first_filler({self.chicken.id}), self.rice)
+
+        Food.objects.filter(id=self.rice.id).update(is_carb_source=False, is_protein_source=True)
+        pools = FoodRolePools(Food.objects.order_by('id'))
+        self.assertEqual(pools.proteins, [self.chicken, self.rice])
+        self.assertEqual(pools.carbs, [])
+
+
+class MealOptimizerTests(TestCase):
+    """MealOptimizer portions stay in bounds, beat the greedy composer and are reproducible."""
+
+    FOODS = [
+        # name, calories, protein, carbs, fat per 100g
+        ('Chicken Breast', '165.00', '31.00', '0.00', '3.60'),
+        ('Salmon', '208.00', '20.00', '0.00', '13.00'),
+        ('Tofu', '76.00', '8.00', '1.90', '4.80'),
+        ('Brown Rice', '112.00', '2.60', '23.00', '0.90'),
+        ('Oats', '389.00', '16.90', '66.30', '6.90'),
+        ('Sweet Potato', '86.00', '1.60', '20.00', '0.10'),
+        ('Broccoli', '34.00', '2.80', '6.60', '0.40'),
+        ('Spinach', '23.00', '2.90', '3.60', '0.40'),
+        ('Olive Oil', '884.00', '0.00', '0.00', '100.00'),
+    ]
+
+    # Targets of one slot, (calories, protein, carbs, fat)
+    SLOTS = [(500.0, 37.5, 50.0, 16.7), (700.0, 52.5, 70.0, 23.3), (350.0, 26.0, 35.0, 11.7)]
+
+    def setUp(self):
+        foods = [
+            make_food(name, calories=calories, protein=protein, carbs=carbs, fat=fat)
+            for name, calories, protein, carbs, fat in self.FOODS
+        ]
+        self.matrix = FoodMatrix.build()
+        self.pools = FoodRolePools(foods)
+        # A generous budget: a deadline cut short would make results timing-dependent
+        self.optimizer = MealOptimizer(self.pools, self.matrix, time_budget_ms=10000)
+
+    def error(self, portions, targets):
+        """The optimizer's objective: weighted deviation relative to each target."""
+        totals = [0.0] * len(TARGETS)
+        for food, grams in portions:
+            row = self.matrix.values[self.matrix.rows[food.id]]
+            for index, column in enumerate(TARGET_COLUMNS):
+                totals[index] += row[column] * float(grams) / 100
+        return sum(
+            (weight * (total - target) / target) ** 2
+            for weight, total, target in zip(MealOptimizer.WEIGHTS, totals, targets)
+        ) ** 0.5
+
+    def test_quantities_respect_bounds(self):
+        for targets in self.SLOTS:
+            portions = self.optimizer.optimize(targets)
+            self.assertTrue(portions)
+            for food, grams in portions:
+                self.assertGreaterEqual(grams, MealOptimizer.MIN_GRAMS, food.name)
+                self.assertLessEqual(grams, MealOptimizer.MAX_GRAMS, food.name)
+
+    def test_no_worse_than_greedy(self):
+        for targets in self.SLOTS:
+            greedy = MealPlanGenerator._compose_meal('Lunch', 'lunch', Decimal(str(targets[0])), self.pools)
+            self.assertLessEqual(
+                self.error(self.optimizer.optimize(targets), targets),
+                self.error(greedy.portions, targets),
+                targets,
+            )
+
+    def test_deterministic(self):
+        for targets in self.SLOTS:
+            portions = self.optimizer.optimize(targets)
+            rebuilt = MealOptimizer(self.pools, FoodMatrix.build(), time_budget_ms=10000)
+            self.assertEqual(rebuilt.optimize(targets), portions)
+            self.assertEqual(self.optimizer.optimize(targets), portions)
+
+
+class SeededGenerationTests(CacheIsolationMixin, TestCase):
+    """The same seed gives the same plan, down to the interned meal rows."""
+
+    def setUp(self):
+        super().setUp()
+        make_generation_foods()
+        self.user = User.objects.create_user(username='seeded-user', password='secret')
+        make_profile(self.user)
+
+    def plan(self, **kwargs):
+        # Recompose from scratch rather than reuse the memoized composition
+        GenerationCache.clear()
+        meal_plan = MealPlanGenerator.generate_meal_plan(self.user, num_days=5, **kwargs)
+        return [
+            (meal.id, [(meal_food.food_id, meal_food.quantity_in_grams) for meal_food in meal.mealfood_set.all()])
+            for meal in meal_plan.meals.order_by('day', 'id').prefetch_related('mealfood_set')
+        ]
+
+    def test_same_seed_same_plan(self):
+        for algorithm in MealPlanGenerator.ALGORITHMS:
+            with self.subTest(algorithm=algorithm):
+                first = self.plan(algorithm=algorithm, seed=42)
+                self.assertEqual(len(first), 15)
+                self.assertEqual(self.plan(algorithm=algorithm, seed=42), first)
+
+        # The seed does drive the greedy composer's choices
+        self.assertNotEqual(self.plan(algorithm='greedy', seed=7), self.plan(algorithm='greedy', seed=42))
+
+
+class GenerateMealPlansCommandTests(CacheIsolationMixin, TestCase):
+    """The generate_meal_plans command, composing in-process (--workers 0)."""
+
+    def setUp(self):
+        super().setUp()
+        make_generation_foods()
+        self.users = [User.objects.create_user(username=f'bulk-user-{n}') for n in range(2)]
+        for user in self.users:
+            make_profile(user)
+        inactive = User.objects.create_user(username='inactive-user', is_active=False)
+        make_profile(inactive)
+        # No profile, no plan
+        User.objects.create_user(username='new-user')
+
+    def generate(self, *args):
+        stdout = StringIO()
+        call_command('generate_meal_plans', '--workers', '0', *args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_one_plan_per_active_user(self):
+        output = self.generate('--num-days', '3', '--seed', '42')
+
+        self.assertIn('Generated 2 meal plans (0 failed)', output)
+        today = timezone.localdate()
+        self.assertEqual(
+            sorted(MealPlan.objects.values_list('user_id', 'start_date', 'end_date')),
+            [(user.id, today, today + timedelta(days=2)) for user in self.users],
+        )
+        for meal_plan in MealPlan.objects.all():
+            self.assertEqual(sorted(set(meal_plan.meal_links.values_list('day', flat=True))), [1, 2, 3])
+
+    def test_user_filter(self):
+        self.generate('--user-ids', str(self.users[1].id), '--num-days', '1')
+
+        self.assertEqual(list(MealPlan.objects.values_list('user_id', flat=True)), [self.users[1].id])
+
+    def test_unknown_user(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown user ids: 999999.'):
+            self.generate('--user-ids', str(self.users[0].id), '999999')
+        self.assertFalse(MealPlan.objects.exists())
+
+    def test_num_days_out_of_range(self):
+        with self.assertRaises(CommandError):
+            self.generate('--num-days', '0')
+
+
+class MealPlanApiTests(CacheIsolationMixin, TestCase):
+    """Generation endpoints of the meal plan API."""
+
+    def setUp(self):
+        super().setUp()
+        make_generation_foods()
+        self.user = User.objects.create_user(username='api-user', password='secret')
+        make_profile(self.user)
+
+    def generate(self, num_days, query=''):
+        return self.client.post(
+            f'/api/meal-plans/generate/{query}',
+            {'user_id': self.user.id, 'num_days': num_days, 'seed': 3, 'start_date': '2026-03-02'},
+            content_type='application/json',
+        )
+
+    def test_regenerate_keeps_locked_meals_and_updates_totals(self):
+        created = self.generate(2).json()
+        meal_plan = MealPlan.objects.get(pk=created['id'])
+        locked = {meal['id'] for meal in created['meals'] if meal['day'] == 1}
+        before = meal_plan.total_nutrition
+
+        response = self.client.post(
+            f'/api/meal-plans/{meal_plan.id}/regenerate/',
+            {'locked_meal_ids': sorted(locked), 'algorithm': 'greedy'},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        unlocked = {meal['id'] for meal in created['meals']} - locked
+        self.assertEqual({int(old_id) for old_id in body['replaced_meals']}, unlocked)
+        meal_ids = set(meal_plan.meals.values_list('id', flat=True))
+        self.assertEqual(meal_ids, locked | set(body['replaced_meals'].values()))
+        self.assertEqual({meal['id'] for meal in body['meal_plan']['meals']}, meal_ids)
+
+        # Stored plan and day totals follow the swap, by the reported delta
+        plan_totals, day_changes = MealPlanDayTotals.computed([meal_plan.id])
+        meal_plan.refresh_from_db()
+        self.assertEqual([getattr(meal_plan, field) for field in MealPlan.TOTAL_FIELDS], plan_totals[meal_plan.id])
+        self.assertEqual(
+            {row.day: row.meal_count for row in meal_plan.day_totals.all()},
+            {day: count for (_, day), (count, _) in day_changes.items()},
+        )
+        self.assertEqual(body['meal_plan']['total_nutrition'], meal_plan.total_nutrition)
+        for nutrient, change in body['nutrition_delta'].items():
+            self.assertAlmostEqual(meal_plan.total_nutrition[nutrient] - before[nutrient], change, places=1)
+
+    def test_stream_yields_each_day_then_the_plan(self):
+        for num_days in (3, MealPlanGenerator.LONG_PLAN_DAYS + 2):
+            with self.subTest(num_days=num_days):
+                response = self.generate(num_days, '?stream=1')
+
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+                events = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+                self.assertEqual([event['type'] for event in events], ['day'] * num_days + ['meal_plan'])
+                self.assertEqual([event['day'] for event in events[:-1]], list(range(1, num_days + 1)))
+                self.assertTrue(all(len(event['meals']) == 3 for event in events[:-1]))
+
+                meal_plan = MealPlan.objects.get(pk=events[-1]['meal_plan']['id'])
+                self.assertEqual(meal_plan.num_days, num_days)
+                self.assertEqual(len(events[-1]['meal_plan']['meals']), meal_plan.meals.count())
+                self.assertAlmostEqual(
+                    events[-2]['running_totals']['calories'], meal_plan.total_nutrition['calories'], places=0
+                )
+
+    def saved_counts(self):
+        return MealPlan.objects.count(), Meal.objects.count(), MealFood.objects.count(), MealPlanDayTotals.objects.count()
+
+    def test_stream_disconnect_discards_partial_plan(self):
+        before = self.saved_counts()
+        response = self.generate(MealPlanGenerator.LONG_PLAN_DAYS + 2, '?stream=1')
+
+        # The first chunk is committed by the time its first day is sent
+        json.loads(next(iter(response.streaming_content)))
+        self.assertEqual(MealPlan.objects.count(), before[0] + 1)
+        response.close()
+
+        self.assertEqual(self.saved_counts(), before)
+
+    def test_stream_failure_discards_partial_plan(self):
+        before = self.saved_counts()
+        summarize = MealPlanDayTotals.summarize
+        calls = []
+
+        def fail_on_second_chunk(meals):
+            calls.append(meals)
+            if len(calls) == 2:
+                raise RuntimeError('disk full')
+            return summarize(meals)
+
+        with mock.patch.object(MealPlanDayTotals, 'summarize', side_effect=fail_on_second_chunk):
+            response = self.generate(MealPlanGenerator.LONG_PLAN_DAYS + 2, '?stream=1')
+            events = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual(events[-1], {'type': 'error', 'detail': 'Error generating meal plan: disk full'})
+        self.assertEqual([event['type'] for event in events[:-1]], ['day'] * MealPlanGenerator.CHUNK_DAYS)
+        self.assertEqual(self.saved_counts(), before)
+
+
+class FixedPointEquivalenceTests(SimpleTestCase):
+    """
+    The candidate fixed-point kernel must give exactly what the Decimal code
+    gives, on randomly generated (seeded) inputs.
+    """
+
+    EXAMPLES = 2000
+
+    def setUp(self):
+        self.random = random.Random(2024)
+
+    def decimal(self, low, high, places=2):
+        return Decimal(self.random.randint(low * 10 ** places, high * 10 ** places)).scaleb(-places)
+
+    def number(self, low, high):
+        """An int, float or Decimal with up to 3 decimal places, like API and form input."""
+        kind = self.random.randrange(3)
+        if kind == 0:
+            return self.random.randint(low, high)
+        if kind == 1:
+            return round(self.random.uniform(low, high), self.random.randint(1, 3))
+        return self.decimal(low, high, self.random.randint(0, 3))
+
+    def food(self):
+        food = Food(
+            calories_per_100g=self.decimal(1, 900),
+            protein_per_100g=self.decimal(0, 90),
+            carbs_per_100g=self.random.choice([Decimal('0.00'), self.decimal(0, 90)]),
+            fat_per_100g=self.decimal(0, 90),
+            fiber_per_100g=self.random.choice([None, Decimal('0.00'), self.decimal(0, 30)]),
+            sugar_per_100g=self.random.choice([None, self.decimal(0, 60)]),
+        )
+        return food, fixed_point.FoodNutrients(tuple(getattr(food, source) for source in Meal.TOTAL_SOURCES.values()))
+
+    def test_food_nutrition(self):
+        for _ in range(self.EXAMPLES):
+            food, nutrients = self.food()
+            quantity = self.number(0, 1000)
+            self.assertEqual(
+                fixed_point.calculate_nutrition(nutrients, quantity),
+                food.calculate_nutrition(quantity),
+                (nutrients.source, quantity),
+            )
+
+    def test_meal_totals(self):
+        for _ in range(self.EXAMPLES // 10):
+            # Whole grams make exact ties at the rounding step common
+            portions = [
+                (*self.food(), self.random.choice([self.random.randint(0, 500), self.number(0, 500)]))
+                for _ in range(self.random.randint(0, 8))
+            ]
+            expected = Meal.totals_for_portions((food, grams) for food, _, grams in portions)
+            totals = fixed_point.compute_totals(
+                ((nutrients, grams) for _, nutrients, grams in portions), Meal.TOTAL_FIELDS, Meal.OPTIONAL_TOTALS
+            )
+            # str() also compares the exponent: 5.00 and 5 are different API values
+            self.assertEqual(
+                {field: str(value) for field, value in totals.items()},
+                {field: str(value) for field, value in expected.items()},
+            )
@@ -1,8 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    health_check, UserViewSet, UserProfileViewSet, FoodViewSet,
-    MealViewSet, MealPlanViewSet,
+    health_check, metrics, UserViewSet, UserProfileViewSet, FoodViewSet,
+    MealViewSet, MealPlanViewSet, PlanGenerationJobViewSet,
     UserDietaryPreferenceViewSet, UserAllergyViewSet, UserFoodDislikeViewSet,
     DietaryPatternViewSet, FoodCategoryViewSet
 )
@@ -13,6 +13,7 @@ router.register(r'users', UserViewSet, basename='user')
 router.register(r'foods', FoodViewSet, basename='food')
 router.register(r'meals', MealViewSet, basename='meal')
 router.register(r'meal-plans', MealPlanViewSet, basename='mealplan')
+router.register(r'plan-jobs', PlanGenerationJobViewSet, basename='plan-job')
 router.register(r'dietary-preferences', UserDietaryPreferenceViewSet, basename='dietary-preference')
 router.register(r'allergies', UserAllergyViewSet, basename='allergy')
 router.register(r'food-dislikes', UserFoodDislikeViewSet, basename='food-dislike')
@@ -21,6 +22,7 @@ router.register(r'food-categories', FoodCategoryViewSet, basename='food-category
 
 urlpatterns = [
     path('health/', health_check),
+    path('metrics/', metrics),
     path('', include(router.urls)),
     # UserProfile endpoints nested under users
     path('users/<int:pk>/profile/', UserProfileViewSet.as_view({
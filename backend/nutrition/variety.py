@@ -0,0 +1,196 @@
+"""
+Variety engine for multi-day meal plans.
+
+Without it every day of a plan repeats the same foods, because each meal
+slot takes the best food of every role. The engine remembers which foods
+each meal type used over the last NUTRITION_VARIETY_WINDOW_DAYS days and
+adds NUTRITION_VARIETY_PENALTY to a food's score per recent use:
+
+- the greedy composer picks foods from a lazily updated min-heap per
+  (meal type, role), so a pick costs O(log n) instead of rescanning the
+  plan so far;
+- the optimizer adds the per-food penalties to its candidate screening and
+  combination costs.
+
+Plans are deterministic: with a seed the greedy preference order is a
+seeded shuffle of each pool, without one it is the pool order.
+"""
+
+import heapq
+import random
+from collections import deque
+import numpy as np
+from django.conf import settings
+
+
+class RecencyWindow:
+    """
+    How often each food was used by one meal type over the last `days` days
+    of the plan. Days must be recorded in order.
+    """
+
+    def __init__(self, size, days):
+        self.days = days
+        self.counts = np.zeros(size, dtype=np.int64)
+        self._history = deque()
+
+    def expire(self, day):
+        """
+        Forget the days that are outside the window ending at `day`.
+
+        Returns:
+            List of food positions whose count dropped
+        """
+        expired = []
+        while self._history and self._history[0][0] <= day - self.days:
+            _, positions = self._history.popleft()
+            for position in positions:
+                self.counts[position] -= 1
+            expired.extend(positions)
+        return expired
+
+    def record(self, day, positions):
+        self._history.append((day, positions))
+        for position in positions:
+            self.counts[position] += 1
+
+
+class _RoleHeap:
+    """
+    Min-heap of one role pool's foods by score (preference + penalty).
+
+    Scores are updated lazily: a count change pushes a fresh entry and bumps
+    the food's version, and entries with an old version are skipped when
+    they reach the top.
+    """
+
+    def __init__(self, positions, bases, penalty):
+        self.bases = dict(zip(positions, bases))
+        self.versions = dict.fromkeys(positions, 0)
+        self.penalty = penalty
+        self.entries = [(base, position, 0) for position, base in self.bases.items()]
+        heapq.heapify(self.entries)
+
+    def update(self, position, count):
+        if position not in self.versions:
+            return
+        self.versions[position] += 1
+        heapq.heappush(
+            self.entries, (self.bases[position] + self.penalty * count, position, self.versions[position])
+        )
+        if len(self.entries) > 4 * len(self.versions) + 16:
+            self.entries = [entry for entry in self.entries if entry[2] == self.versions[entry[1]]]
+            heapq.heapify(self.entries)
+
+    def best(self, exclude):
+        """Return the position of the lowest scoring food not in exclude, or None."""
+        held = []
+        found = None
+        while self.entries:
+            entry = heapq.heappop(self.entries)
+            if entry[2] != self.versions[entry[1]]:
+                continue
+            held.append(entry)
+            if entry[1] not in exclude:
+                found = entry[1]
+                break
+        for entry in held:
+            heapq.heappush(self.entries, entry)
+        return found
+
+
+class VarietyEngine:
+    """
+    Repetition tracking for one plan generation over a fixed list of foods.
+    """
+
+    def __init__(self, foods, window_days=None, penalty=None, seed=None):
+        """
+        Args:
+            foods: Allowed foods (FoodRolePools.foods); penalties() is aligned to this list
+            window_days: Days a use counts against a food; defaults to
+                settings.NUTRITION_VARIETY_WINDOW_DAYS, 0 disables the engine
+            penalty: Score added per recent use; defaults to settings.NUTRITION_VARIETY_PENALTY
+            seed: Seed of the greedy preference order (default: pool order)
+        """
+        self.foods = list(foods)
+        self.positions = {food.id: position for position, food in enumerate(self.foods)}
+        self.window_days = settings.NUTRITION_VARIETY_WINDOW_DAYS if window_days is None else window_days
+        self.penalty = float(settings.NUTRITION_VARIETY_PENALTY if penalty is None else penalty)
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._windows = {}
+        self._heaps = {}
+
+    @property
+    def enabled(self):
+        return self.window_days > 0 and self.penalty > 0
+
+    def pick(self, meal_type, role, pool, day, exclude_ids=()):
+        """
+        Choose the food of a role pool with the lowest score for a meal.
+
+        Scores rank the pool by preference in [0, 1) and add the penalty
+        once per use of the food by this meal type within the window.
+
+        Args:
+            meal_type: Meal type the food is for
+            role: Name of the pool (e.g. 'proteins'); one heap is kept per role
+            pool: List of foods of that role, in preference order
+            day: Day of the plan being composed
+            exclude_ids: Food ids that must not be picked
+
+        Returns:
+            Food, or None if every food of the pool is excluded
+        """
+        self._advance(meal_type, day)
+        heap = self._heaps.get((meal_type, role))
+        if heap is None:
+            heap = self._heaps[(meal_type, role)] = self._build_heap(meal_type, pool)
+        position = heap.best({self.positions[food_id] for food_id in exclude_ids if food_id in self.positions})
+        return None if position is None else self.foods[position]
+
+    def penalties(self, meal_type, day):
+        """
+        Penalty of every food for a meal on `day`.
+
+        Returns:
+            Float array aligned to self.foods
+        """
+        self._advance(meal_type, day)
+        return self._window(meal_type).counts * self.penalty
+
+    def record(self, meal_type, day, foods):
+        """Count the foods of a composed meal against their future scores."""
+        self._advance(meal_type, day)
+        positions = [self.positions[food.id] for food in foods]
+        self._window(meal_type).record(day, positions)
+        self._touch(meal_type, positions)
+
+    def _window(self, meal_type):
+        window = self._windows.get(meal_type)
+        if window is None:
+            window = self._windows[meal_type] = RecencyWindow(len(self.foods), self.window_days)
+        return window
+
+    def _advance(self, meal_type, day):
+        self._touch(meal_type, self._window(meal_type).expire(day))
+
+    def _touch(self, meal_type, positions):
+        counts = self._window(meal_type).counts
+        for (heap_meal_type, _), heap in self._heaps.items():
+            if heap_meal_type == meal_type:
+                for position in positions:
+                    heap.update(position, counts[position])
+
+    def _build_heap(self, meal_type, pool):
+        ranks = list(range(len(pool)))
+        if self.seed is not None:
+            self._rng.shuffle(ranks)
+        positions = [self.positions[food.id] for food in pool]
+        counts = self._window(meal_type).counts
+        heap = _RoleHeap(positions, [rank / len(pool) for rank in ranks], self.penalty)
+        for position in positions:
+            if counts[position]:
+                heap.update(position, counts[position])
+        return heap
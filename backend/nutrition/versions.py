@@ -0,0 +1,87 @@
+"""
+Version stamps used to invalidate in-process and cached constraint data.
+
+Each stamp is a counter kept in the Django cache so that every process sharing
+the cache backend sees the same value. Writers bump a stamp when the data it
+guards changes; readers compare the stamp they built against with the current one.
+"""
+
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Stamp covering foods, categories and dietary pattern definitions
+CATALOG = 'catalog'
+
+# Stamp covering dietary patterns and the categories they exclude
+PATTERNS = 'patterns'
+
+KEY_PREFIX = 'nutrition:version'
+
+
+def user_constraints(user_id):
+    """Name of the stamp covering one user's preferences, allergies and dislikes."""
+    return f"user:{user_id}"
+
+
+def _cache():
+    return caches[getattr(settings, 'NUTRITION_CACHE_ALIAS', 'default')]
+
+
+# Backends whose entries live inside one process, so stamps bumped elsewhere never arrive
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared():
+    """Whether stamps are seen by every process, i.e. the cache alias is not process-local."""
+    alias = getattr(settings, 'NUTRITION_CACHE_ALIAS', 'default')
+    return settings.CACHES[alias]['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def _key(name):
+    return f"{KEY_PREFIX}:{name}"
+
+
+def get_version(name):
+    """
+    Return the current version stamp for `name`, creating it if missing.
+
+    New stamps start from the current time in nanoseconds so that a stamp
+    evicted from the cache never comes back with a value that was already used.
+    """
+    cache = _cache()
+    key = _key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """
+    Advance the version stamp for `name` and return the new value.
+    """
+    cache = _cache()
+    key = _key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Stamp was never created or has been evicted
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+
+
+def bump_version_on_commit(name):
+    """
+    Bump a stamp now and again once the current transaction commits.
+
+    The immediate bump keeps readers inside the transaction consistent; the
+    second one discards anything another process rebuilt from pre-commit data.
+    """
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
@@ -1,27 +1,77 @@
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_date
+from rest_framework.utils.urls import replace_query_param
 from .models import (
-    UserProfile, Food, Meal, MealPlan,
+    UserProfile, Food, Meal, MealPlan, PlanGenerationJob,
     UserDietaryPreference, UserAllergy, UserFoodDislike, DietaryPattern, FoodCategory
 )
 from .serializers import (
     UserSerializer, UserProfileSerializer, UserWithProfileSerializer, 
-    FoodSerializer, MealSerializer, MealPlanSerializer, GroceryListSerializer,
+    FoodSerializer, MealSerializer, MealPlanMealSerializer, MealPlanSerializer, GroceryListSerializer,
     UserDietaryPreferenceSerializer, UserAllergySerializer, UserFoodDislikeSerializer,
-    DietaryPatternSerializer, FoodCategorySerializer, UserConstraintsSummarySerializer
+    DietaryPatternSerializer, FoodCategorySerializer, UserConstraintsSummarySerializer,
+    PlanGenerationJobSerializer, PlanGenerationJobDetailSerializer, MealPlanDayTotalsSerializer
 )
 from .services import MealPlanGenerator, GroceryListGenerator
 from .constraint_service import ConstraintService
+from .pattern_registry import get_registry
+from .generation_cache import GenerationCache
+from .allowed_foods_cache import AllowedFoodCache
+from . import plan_jobs, versions
+
+
+def _ndjson_lines(events):
+    """
+    Encode streamed generation events as NDJSON, ending with an error line on failure.
+
+    The events generator is closed explicitly when the client disconnects, so
+    a partially saved plan is discarded right away rather than when collected.
+    """
+    try:
+        for event in events:
+            yield json.dumps(event, cls=DjangoJSONEncoder) + '\n'
+    except ValueError as e:
+        yield json.dumps({"type": "error", "detail": str(e)}) + '\n'
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": f"Error generating meal plan: {str(e)}"}) + '\n'
+    finally:
+        events.close()
+
+
+def _computed_totals(request):
+    """
+    Whether list/retrieve responses should sum totals in SQL from the meals'
+    current foods (?totals=computed) instead of reading the stored totals.
+    """
+    return request.query_params.get('totals') == 'computed'
+
 
 # Create your views here.
 @api_view(['GET'])
 def health_check(request):
     return Response({"status": "ok"})
 
+
+@api_view(['GET'])
+def metrics(request):
+    """
+    Cache counters of the process serving the request.
+    """
+    return Response({
+        'generation_cache': GenerationCache.stats(),
+        'allowed_foods_cache': AllowedFoodCache.stats(),
+    })
+
 # ----------------------------
 # User ViewSet
 # ----------------------------
@@ -68,6 +118,27 @@ class UserViewSet(viewsets.ViewSet):
         serializer = FoodSerializer(allowed_foods, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], url_path='excluded-foods')
+    def get_excluded_foods(self, request, pk=None):
+        """
+        Get all foods excluded for a user along with the reasons for each.
+        """
+        try:
+            user = User.objects.get(pk=pk)
+        except User.DoesNotExist:
+            return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        
+        excluded_foods = ConstraintService.get_excluded_foods(user)
+        explanations = ConstraintService.explain_exclusions(user, excluded_foods)
+        return Response([
+            {
+                'food_id': food.id,
+                'food_name': food.name,
+                'exclusion_reasons': explanations.get(food.id, []),
+            }
+            for food in excluded_foods.only('id', 'name')
+        ])
+    
     @action(detail=True, methods=['get'], url_path='constraints-summary')
     def get_constraints_summary(self, request, pk=None):
         """
@@ -144,6 +215,9 @@ class FoodViewSet(viewsets.ModelViewSet):
     queryset = Food.objects.all()
     serializer_class = FoodSerializer
     
+    # Upper bound on user/food pairs checked by a single batch request
+    MAX_BATCH_CHECKS = 1000
+    
     def get_queryset(self):
         """
         Optionally filter foods by search query parameter.
@@ -187,6 +261,74 @@ class FoodViewSet(viewsets.ModelViewSet):
             'is_allowed': is_allowed,
             'exclusion_reasons': exclusion_reasons
         })
+    
+    @action(detail=False, methods=['post'], url_path='check-allowed')
+    def check_allowed_batch(self, request):
+        """
+        Check many foods for one user, or one food for many users, in one request.
+        Uses a constant number of queries regardless of the batch size.
+        
+        Expected POST data, either:
+        {
+            "user_id": 1,
+            "food_ids": [1, 2, 3]
+        }
+        or:
+        {
+            "food_id": 1,
+            "user_ids": [1, 2, 3]
+        }
+        """
+        user_id = request.data.get('user_id')
+        food_id = request.data.get('food_id')
+        food_ids = request.data.get('food_ids')
+        user_ids = request.data.get('user_ids')
+        
+        if user_id is not None and food_ids is not None and food_id is None and user_ids is None:
+            user_ids = [user_id]
+        elif food_id is not None and user_ids is not None and user_id is None and food_ids is None:
+            food_ids = [food_id]
+        else:
+            return Response(
+                {"detail": "Provide either user_id with food_ids, or food_id with user_ids."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            user_ids = list(dict.fromkeys(int(pk) for pk in user_ids))
+            food_ids = list(dict.fromkeys(int(pk) for pk in food_ids))
+        except (ValueError, TypeError):
+            return Response(
+                {"detail": "Ids must be valid integers."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not user_ids or not food_ids:
+            return Response(
+                {"detail": "At least one user and one food are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(user_ids) * len(food_ids) > self.MAX_BATCH_CHECKS:
+            return Response(
+                {"detail": f"At most {self.MAX_BATCH_CHECKS} checks are allowed per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        missing_users = set(user_ids) - set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        if missing_users:
+            return Response(
+                {"detail": f"Users not found: {sorted(missing_users)}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        missing_foods = set(food_ids) - set(Food.objects.filter(pk__in=food_ids).values_list('pk', flat=True))
+        if missing_foods:
+            return Response(
+                {"detail": f"Foods not found: {sorted(missing_foods)}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        results = ConstraintService.check_foods_allowed(user_ids, food_ids)
+        return Response({'results': results})
 
 
 # ----------------------------
@@ -207,8 +349,45 @@ class MealViewSet(viewsets.ModelViewSet):
         meal_type = self.request.query_params.get('meal_type', None)
         if meal_type:
             queryset = queryset.filter(meal_type=meal_type)
+        if self.action in ('list', 'retrieve'):
+            # A constant number of queries however many meals are listed
+            queryset = queryset.for_api(_computed_totals(self.request))
         return queryset
 
+    def _meal_plan_for(self, meal):
+        """
+        Resolve the `meal_plan_id` (query param or body) a shared meal is edited for.
+        """
+        meal_plan_id = self.request.query_params.get('meal_plan_id') or self.request.data.get('meal_plan_id')
+        if not meal_plan_id:
+            raise ValidationError({
+                "meal_plan_id": "This meal is shared by several meal plans; meal_plan_id is required to change it."
+            })
+        meal_plan = meal.meal_plans.filter(pk=meal_plan_id).first()
+        if meal_plan is None:
+            raise ValidationError({"meal_plan_id": "This meal is not part of that meal plan."})
+        return meal_plan
+
+    def perform_update(self, serializer):
+        """
+        Edit shared meals copy-on-write: the given plan gets a private copy
+        and every other plan keeps the original.
+        """
+        with transaction.atomic():
+            meal = serializer.instance
+            if meal.is_shared():
+                serializer.instance = meal.copy_for_plan(self._meal_plan_for(meal))
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        """
+        Deleting a shared meal only removes it from the given plan.
+        """
+        if instance.is_shared():
+            self._meal_plan_for(instance).meals.remove(instance)
+        else:
+            instance.delete()
+
 
 # ----------------------------
 # MealPlan ViewSet
@@ -228,7 +407,22 @@ class MealPlanViewSet(viewsets.ModelViewSet):
         user_id = self.request.query_params.get('user_id', None)
         if user_id:
             queryset = queryset.filter(user_id=user_id)
+        if self.action in ('list', 'retrieve') and _computed_totals(self.request):
+            queryset = queryset.with_nutrition()
         return queryset
+
+    # Meals are prefetched after the plans are loaded rather than in
+    # get_queryset: whether a plan nests its meals depends on its own dates
+
+    def list(self, request, *args, **kwargs):
+        meal_plans = list(self.filter_queryset(self.get_queryset()))
+        MealPlan.prefetch_meals(meal_plans, _computed_totals(request))
+        return Response(self.get_serializer(meal_plans, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        meal_plan = self.get_object()
+        MealPlan.prefetch_meals([meal_plan], _computed_totals(request))
+        return Response(self.get_serializer(meal_plan).data)
     
     @action(detail=False, methods=['post'], url_path='generate')
     def generate_meal_plan(self, request):
@@ -238,11 +432,30 @@ class MealPlanViewSet(viewsets.ModelViewSet):
         Expected POST data:
         {
             "user_id": 1,
-            "num_days": 1  # optional, defaults to 1
+            "num_days": 1,  # optional, defaults to 1
+            "algorithm": "greedy",  # optional, "greedy" or "optimized"
+            "seed": 42,  # optional, same seed and inputs give the same plan
+            "start_date": "2026-01-01"  # optional, defaults to today
         }
+
+        num_days can be up to 365. Plans longer than 31 days are returned
+        without nested meals; read them with GET /api/meal-plans/{id}/meals/.
+
+        With ?async=1 the plan is generated by a run_plan_worker process
+        instead: the response is 202 with the queued job, whose status and
+        result are available at /api/plan-jobs/{id}/.
+
+        With ?stream=1 the response is NDJSON (application/x-ndjson): one
+        line per day with its meals, day totals and running totals as soon
+        as the day is composed, then a "meal_plan" line once the plan is
+        saved. Errors after the stream has started are reported as a final
+        {"type": "error"} line and nothing is saved.
         """
         user_id = request.data.get('user_id')
         num_days = request.data.get('num_days', 1)
+        algorithm = request.data.get('algorithm', 'greedy')
+        seed = request.data.get('seed')
+        start_date = request.data.get('start_date')
         
         if not user_id:
             return Response(
@@ -260,9 +473,9 @@ class MealPlanViewSet(viewsets.ModelViewSet):
         
         try:
             num_days = int(num_days)
-            if num_days < 1 or num_days > 30:
+            if num_days < 1 or num_days > MealPlanGenerator.MAX_DAYS:
                 return Response(
-                    {"detail": "num_days must be between 1 and 30."},
+                    {"detail": f"num_days must be between 1 and {MealPlanGenerator.MAX_DAYS}."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
         except (ValueError, TypeError):
@@ -270,9 +483,68 @@ class MealPlanViewSet(viewsets.ModelViewSet):
                 {"detail": "num_days must be a valid integer."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        if algorithm not in MealPlanGenerator.ALGORITHMS:
+            return Response(
+                {"detail": f"algorithm must be one of: {', '.join(MealPlanGenerator.ALGORITHMS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if seed is not None:
+            try:
+                seed = int(seed)
+            except (ValueError, TypeError):
+                return Response(
+                    {"detail": "seed must be a valid integer."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        if start_date is not None:
+            try:
+                start_date = parse_date(str(start_date))
+            except ValueError:
+                start_date = None
+            if start_date is None:
+                return Response(
+                    {"detail": "start_date must be a valid date (YYYY-MM-DD)."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
+        if request.query_params.get('async') in ('1', 'true', 'True'):
+            if not versions.is_shared():
+                # run_plan_worker refuses to start without a shared cache, so the job would never run
+                return Response(
+                    {"detail": "Asynchronous generation needs a cache shared with the plan workers."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            if not UserProfile.objects.filter(user=user).exists():
+                return Response(
+                    {"detail": "User must have a profile with calorie targets to generate a meal plan."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            job = plan_jobs.enqueue(
+                user, num_days=num_days, algorithm=algorithm, seed=seed, start_date=start_date
+            )
+            return Response(PlanGenerationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        if request.query_params.get('stream') in ('1', 'true', 'True'):
+            try:
+                events = MealPlanGenerator.stream_meal_plan(
+                    user, num_days=num_days, algorithm=algorithm, seed=seed, start_date=start_date
+                )
+            except ValueError as e:
+                return Response(
+                    {"detail": str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return StreamingHttpResponse(
+                _ndjson_lines(events), content_type='application/x-ndjson', status=status.HTTP_201_CREATED
+            )
+
         try:
-            meal_plan = MealPlanGenerator.generate_meal_plan(user, num_days=num_days)
+            meal_plan = MealPlanGenerator.generate_meal_plan(
+                user, num_days=num_days, algorithm=algorithm, seed=seed, start_date=start_date
+            )
             serializer = MealPlanSerializer(meal_plan)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except ValueError as e:
@@ -311,6 +583,178 @@ class MealPlanViewSet(viewsets.ModelViewSet):
         serializer = GroceryListSerializer(response_data)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    # Days per page of the meals action
+    MEALS_PAGE_DAYS = 7
+
+    @action(detail=True, methods=['get'], url_path='meals')
+    def meals(self, request, pk=None):
+        """
+        Get a plan's meals a range of days at a time, ordered by day.
+
+        Query params:
+            page: 1-based page of page_size days (default 1)
+            page_size: Days per page (default 7, at most 31)
+            start_date, end_date: Calendar dates to read instead of a page
+                (inclusive; needs a plan with a start_date)
+
+        Meals without a day (added by hand) are listed on the first page.
+        """
+        meal_plan = self.get_object()
+        num_days = meal_plan.num_days or meal_plan.meal_links.aggregate(last=Max('day'))['last'] or 0
+
+        date_range = request.query_params.get('start_date'), request.query_params.get('end_date')
+        if any(date_range):
+            if meal_plan.start_date is None:
+                return Response(
+                    {"detail": "This meal plan has no start_date; use page instead."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                first, last = [parse_date(value) if value else None for value in date_range]
+            except ValueError:
+                first = last = None
+            if first is None and date_range[0] or last is None and date_range[1]:
+                return Response(
+                    {"detail": "start_date and end_date must be valid dates (YYYY-MM-DD)."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            first_day = max(meal_plan.day_of(first), 1) if first else 1
+            last_day = min(meal_plan.day_of(last), num_days) if last else num_days
+            page = None
+        else:
+            try:
+                page = int(request.query_params.get('page', 1))
+                page_size = int(request.query_params.get('page_size', self.MEALS_PAGE_DAYS))
+            except ValueError:
+                return Response(
+                    {"detail": "page and page_size must be valid integers."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if page < 1 or page_size < 1 or page_size > MealPlan.NESTED_MEALS_MAX_DAYS:
+                return Response(
+                    {"detail": f"page must be positive and page_size between 1 and {MealPlan.NESTED_MEALS_MAX_DAYS}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            first_day = (page - 1) * page_size + 1
+            last_day = min(first_day + page_size - 1, num_days)
+
+        in_range = Q(day__gte=first_day, day__lte=last_day)
+        if first_day == 1:
+            in_range |= Q(day__isnull=True)
+        links = meal_plan.meal_links.filter(in_range).for_api(_computed_totals(request))
+
+        url = request.build_absolute_uri()
+        return Response({
+            'meal_plan_id': meal_plan.id,
+            'num_days': num_days,
+            'first_day': first_day,
+            'last_day': last_day,
+            'next': replace_query_param(url, 'page', page + 1) if page and last_day < num_days else None,
+            'previous': replace_query_param(url, 'page', page - 1) if page and page > 1 else None,
+            'results': MealPlanMealSerializer(links, many=True).data,
+        })
+
+    @action(detail=True, methods=['get'], url_path='daily-totals')
+    def daily_totals(self, request, pk=None):
+        """
+        Get a plan's calorie and macro totals per day next to the user's
+        daily targets, read from the stored day totals.
+
+        Days without meals are not listed; meals without a day (added by
+        hand) are summed under day 0.
+        """
+        meal_plan = self.get_object()
+        profile = UserProfile.objects.filter(user_id=meal_plan.user_id).first()
+        targets = None
+        if profile is not None:
+            targets = {
+                'calories': float(profile.calorie_target),
+                'protein': float(profile.protein_target),
+                'carbs': float(profile.carb_target),
+                'fat': float(profile.fat_target),
+            }
+
+        return Response({
+            'meal_plan_id': meal_plan.id,
+            'num_days': meal_plan.num_days,
+            'targets': targets,
+            'total_nutrition': meal_plan.total_nutrition,
+            'days': MealPlanDayTotalsSerializer(
+                meal_plan.day_totals.all(), many=True, context={'targets': targets}
+            ).data,
+        })
+
+    @action(detail=True, methods=['post'], url_path=r'meals/(?P<meal_id>\d+)/regenerate')
+    def regenerate_meal(self, request, pk=None, meal_id=None):
+        """
+        Regenerate a single meal of the plan against the day's remaining budget.
+        Other plans sharing the meal keep the original.
+        
+        Optional POST data:
+        {
+            "algorithm": "optimized"  # or "greedy"
+        }
+        """
+        meal_plan = self.get_object()
+        meal_id = int(meal_id)
+        if not meal_plan.meals.filter(pk=meal_id).exists():
+            return Response(
+                {"detail": "Meal not found in this meal plan."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            replacements, delta = MealPlanGenerator.regenerate_meals(
+                meal_plan, [meal_id], algorithm=request.data.get('algorithm', 'optimized')
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        link = meal_plan.meal_links.filter(meal=replacements[meal_id]).order_by('day').first()
+        return Response({
+            'meal': MealPlanMealSerializer(link).data,
+            'replaced_meal_id': meal_id,
+            'nutrition_delta': delta,
+        })
+
+    @action(detail=True, methods=['post'], url_path='regenerate')
+    def regenerate(self, request, pk=None):
+        """
+        Regenerate every meal of the plan except locked ones. Each day's
+        unlocked meals are re-solved against what its locked meals leave.
+        
+        Optional POST data:
+        {
+            "locked_meal_ids": [1, 2],
+            "algorithm": "optimized"  # or "greedy"
+        }
+        """
+        meal_plan = self.get_object()
+        locked_meal_ids = request.data.get('locked_meal_ids', [])
+        try:
+            locked_meal_ids = {int(meal_id) for meal_id in locked_meal_ids}
+        except (ValueError, TypeError):
+            return Response(
+                {"detail": "locked_meal_ids must be a list of meal ids."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        meal_ids = set(meal_plan.meals.values_list('id', flat=True)) - locked_meal_ids
+        try:
+            replacements, delta = MealPlanGenerator.regenerate_meals(
+                meal_plan, meal_ids, algorithm=request.data.get('algorithm', 'optimized')
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        meal_plan = self.get_queryset().get(pk=meal_plan.pk)
+        MealPlan.prefetch_meals([meal_plan])
+        return Response({
+            'meal_plan': MealPlanSerializer(meal_plan).data,
+            'replaced_meals': {str(old_id): meal.id for old_id, meal in replacements.items()},
+            'nutrition_delta': delta,
+        })
+
 
 # ----------------------------
 # Constraint-related ViewSets
@@ -409,13 +853,63 @@ class UserFoodDislikeViewSet(viewsets.ModelViewSet):
             serializer.save()
 
 
+# ----------------------------
+# PlanGenerationJob ViewSet
+# ----------------------------
+class PlanGenerationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Read-only ViewSet for asynchronous meal plan generation jobs.
+    """
+    queryset = PlanGenerationJob.objects.all()
+    serializer_class = PlanGenerationJobSerializer
+
+    def get_queryset(self):
+        """
+        Filter jobs by user_id and status if provided.
+        """
+        queryset = PlanGenerationJob.objects.all()
+        if self.action == 'retrieve':
+            queryset = queryset.select_related('meal_plan')
+        user_id = self.request.query_params.get('user_id', None)
+        if user_id:
+            queryset = queryset.filter(user_id=user_id)
+        job_status = self.request.query_params.get('status', None)
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return PlanGenerationJobDetailSerializer
+        return PlanGenerationJobSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.meal_plan is not None:
+            MealPlan.prefetch_meals([job.meal_plan])
+        return Response(self.get_serializer(job).data)
+
+
 class DietaryPatternViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Read-only ViewSet for dietary patterns.
-    Patterns are predefined and managed via admin.
+    Patterns are predefined and managed via admin, and served from the
+    compiled pattern registry without hitting the database.
     """
     queryset = DietaryPattern.objects.all()
     serializer_class = DietaryPatternSerializer
+    
+    def list(self, request):
+        return Response([pattern.serialize() for pattern in get_registry().all()])
+    
+    def retrieve(self, request, pk=None):
+        try:
+            pattern = get_registry().get(int(pk))
+        except (ValueError, TypeError):
+            pattern = None
+        if pattern is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(pattern.serialize())
 
 
 class FoodCategoryViewSet(viewsets.ReadOnlyModelViewSet):